@@ -1,133 +1,701 @@
+import argparse
 import chess.pgn
+import gzip
+import io
+import json
+import os
+import sys
 from collections import Counter
-from statistics import mean
-import re
+from clocks import ClockStatsAccumulator, format_clock_stats
+from ingest import Quarantine, format_quarantine, scan_games
+from opening_tree import OpeningTreeAccumulator
+from packed import PackedGame, move_uci
+from players import PlayerStatsAccumulator, format_player_stats, game_date
+from timeseries import Timeline
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import profiling
+import time
 
 
-def analyze_win_loss(games):
-    total_games = len(games)
-    results = [game.headers.get("Result") for game in games]
-    win_count = results.count("1-0")
-    loss_count = results.count("0-1")
-    draw_count = results.count("1/2-1/2")
-    return win_count, loss_count, draw_count, total_games
+class WinLossAccumulator:
+    needs_moves = False
 
+    def __init__(self):
+        self.win_count = 0
+        self.loss_count = 0
+        self.draw_count = 0
+        self.total_games = 0
 
-def analyze_rating_distribution(games):
-    ratings = [int(game.headers.get("WhiteElo", 0)) for game in games]
-    ratings.extend([int(game.headers.get("BlackElo", 0)) for game in games])
-    rating_counts = Counter(ratings)
-    return rating_counts
+    def add(self, game):
+        result = game.headers.get("Result")
+        self.total_games += 1
+        if result == "1-0":
+            self.win_count += 1
+        elif result == "0-1":
+            self.loss_count += 1
+        elif result == "1/2-1/2":
+            self.draw_count += 1
 
+    def merge(self, other):
+        self.win_count += other.win_count
+        self.loss_count += other.loss_count
+        self.draw_count += other.draw_count
+        self.total_games += other.total_games
 
-def analyze_performance_rating(games):
-    performance_ratings = []
-    for game in games:
+    def result(self):
+        return self.win_count, self.loss_count, self.draw_count, self.total_games
+
+
+class RatingDistributionAccumulator:
+    needs_moves = False
+
+    def __init__(self):
+        self.rating_counts = Counter()
+
+    def add(self, game):
+        self.rating_counts[int(game.headers.get("WhiteElo", 0))] += 1
+        self.rating_counts[int(game.headers.get("BlackElo", 0))] += 1
+
+    def merge(self, other):
+        self.rating_counts.update(other.rating_counts)
+
+    def result(self):
+        return self.rating_counts
+
+
+class PerformanceRatingAccumulator:
+    needs_moves = False
+
+    def __init__(self):
+        self.rating_sum = 0
+        self.rating_count = 0
+
+    def add(self, game):
         white_rating = int(game.headers.get("WhiteElo", 0))
         black_rating = int(game.headers.get("BlackElo", 0))
         if "Result" in game.headers:
             result = game.headers["Result"]
             if result == "1-0":
-                performance_ratings.append(white_rating)
+                self.rating_sum += white_rating
             elif result == "0-1":
-                performance_ratings.append(black_rating)
+                self.rating_sum += black_rating
             elif result == "1/2-1/2":
-                performance_ratings.append((white_rating + black_rating) // 2)
-    return mean(performance_ratings) if performance_ratings else 0
+                self.rating_sum += (white_rating + black_rating) // 2
+            else:
+                return
+            self.rating_count += 1
+
+    def merge(self, other):
+        self.rating_sum += other.rating_sum
+        self.rating_count += other.rating_count
+
+    def result(self):
+        if not self.rating_count:
+            return 0
+        # Same int/float behaviour as statistics.mean over the ratings
+        if self.rating_sum % self.rating_count == 0:
+            return self.rating_sum // self.rating_count
+        return self.rating_sum / self.rating_count
+
+
+class CommonOpeningsAccumulator:
+    needs_moves = False
+
+    def __init__(self, top_n=25):
+        self.top_n = top_n
+        self.openings = Counter()
+
+    def add(self, game):
+        eco = game.headers.get("ECO")
+        if eco:
+            self.openings[eco] += 1
+
+    def merge(self, other):
+        self.openings.update(other.openings)
+
+    def result(self):
+        return self.openings.most_common(self.top_n)
+
+
+class TimeUsageAccumulator:
+    needs_moves = True
+
+    def __init__(self):
+        # Whole milliseconds keep the sum exact and cheap, like ClockStats
+        self.time_ms = 0
+        self.time_count = 0
+
+    def add(self, game):
+        if not isinstance(game, PackedGame):
+            game = PackedGame.from_game(game)
+        time_ms = 0
+        count = 0
+        for seconds in game.clocks:
+            if seconds == seconds:
+                time_ms += round(seconds * 1000)
+                count += 1
+        self.time_ms += time_ms
+        self.time_count += count
+
+    def merge(self, other):
+        self.time_ms += other.time_ms
+        self.time_count += other.time_count
+
+    def result(self):
+        return self.time_ms / self.time_count / 1000 if self.time_count else 0
+
+
+class StreakAccumulator:
+    needs_moves = False
+
+    def __init__(self, result_value):
+        self.result_value = result_value
+        self.current_streak = 0
+        self.longest_streak = 0
+        # Run before the first break is kept apart so that shards can be
+        # joined onto the streak still open at the end of the previous shard.
+        self.leading_streak = 0
+        self.broken = False
+
+    def add(self, game):
+        if game.headers["Result"] == self.result_value:
+            self.current_streak += 1
+            return
+        # A streak only counts once it has been broken, as before
+        if not self.broken:
+            self.leading_streak = self.current_streak
+            self.broken = True
+        elif self.current_streak > self.longest_streak:
+            self.longest_streak = self.current_streak
+        self.current_streak = 0
+
+    def merge(self, other):
+        if not other.broken:
+            self.current_streak += other.current_streak
+            return
+        if self.broken:
+            joined_streak = self.current_streak + other.leading_streak
+            self.longest_streak = max(self.longest_streak, other.longest_streak, joined_streak)
+        else:
+            self.leading_streak = self.current_streak + other.leading_streak
+            self.longest_streak = other.longest_streak
+            self.broken = True
+        self.current_streak = other.current_streak
+
+    def result(self):
+        return max(self.longest_streak, self.leading_streak)
+
+
+class WinningStreakAccumulator(StreakAccumulator):
+    def __init__(self):
+        super().__init__("1-0")
+
+
+class LosingStreakAccumulator(StreakAccumulator):
+    def __init__(self):
+        super().__init__("0-1")
+
+
+class ResultsTimelineAccumulator:
+    needs_moves = False
+
+    def __init__(self):
+        self.result_timeline = []
+
+    def add(self, game):
+        self.result_timeline.append(self.row(game))
+
+    def row(self, game):
+        return game.headers["Result"], game_date(game.headers)
+
+    def merge(self, other):
+        self.result_timeline.extend(other.result_timeline)
+
+    def result(self):
+        return self.result_timeline
+
+
+class PositionalAnalysisAccumulator:
+    needs_moves = False
+
+    def __init__(self):
+        self.positions = Counter()
+
+    def add(self, game):
+        self.positions[game.headers.get("Opening", "")] += 1
+
+    def merge(self, other):
+        self.positions.update(other.positions)
+
+    def result(self):
+        return self.positions
+
+
+class GameHighlightsAccumulator:
+    needs_moves = True
+
+    def __init__(self, num_moves=5):
+        self.num_moves = num_moves
+        self.highlights = []
+
+    def add(self, game):
+        self.highlights.append(self.row(game))
+
+    def row(self, game):
+        if not isinstance(game, PackedGame):
+            game = PackedGame.from_game(game)
+        return " ".join(move_uci(code) for code in game.moves[:self.num_moves])
+
+    def merge(self, other):
+        self.highlights.extend(other.highlights)
+
+    def result(self):
+        return self.highlights
+
+
+METRICS = {
+    "win_loss": WinLossAccumulator,
+    "rating_distribution": RatingDistributionAccumulator,
+    "performance_rating": PerformanceRatingAccumulator,
+    "common_openings": CommonOpeningsAccumulator,
+    "time_usage": TimeUsageAccumulator,
+    "winning_streak": WinningStreakAccumulator,
+    "losing_streak": LosingStreakAccumulator,
+    "results_timeline": ResultsTimelineAccumulator,
+    "positional_analysis": PositionalAnalysisAccumulator,
+    "game_highlights": GameHighlightsAccumulator,
+    "clock_stats": ClockStatsAccumulator,
+    "player_stats": PlayerStatsAccumulator,
+    "opening_tree": OpeningTreeAccumulator,
+}
+
+DEFAULT_METRICS = (
+    "win_loss",
+    "rating_distribution",
+    "performance_rating",
+    "common_openings",
+    "winning_streak",
+    "losing_streak",
+)
+
+
+PROGRESS_EVERY = 1000
+
+
+def make_accumulators(metrics=DEFAULT_METRICS, options=None):
+    # options maps a metric to the keyword arguments of its accumulator
+    options = options or {}
+    return {name: METRICS[name](**options.get(name, {})) for name in metrics}
+
+
+def run_accumulators(games, accumulators, progress=None):
+    # progress(games_done) is called every PROGRESS_EVERY games and at the end
+    if profiling.active is not None:
+        add_games_profiled(games, accumulators, progress, profiling.active)
+        with profiling.stage("results"):
+            return {name: accumulator.result() for name, accumulator in accumulators.items()}
+    adders = [accumulator.add for accumulator in accumulators.values()]
+    count = 0
+    for count, game in enumerate(games, 1):
+        for add in adders:
+            add(game)
+        if progress is not None and count % PROGRESS_EVERY == 0:
+            progress(count)
+    if progress is not None:
+        progress(count)
+    return {name: accumulator.result() for name, accumulator in accumulators.items()}
+
+
+def add_games_profiled(games, accumulators, progress, profiler):
+    # The run_accumulators loop, timing the reader and each accumulator
+    # separately. Totals are kept locally and handed over once at the end.
+    read_stage = "read:" + getattr(games, "__name__", "games")
+    read_time = 0.0
+    metric_times = dict.fromkeys(accumulators, 0.0)
+    moves = 0
+    count = 0
+    games = iter(games)
+    while True:
+        start_time = time.perf_counter()
+        game = next(games, None)
+        read_time += time.perf_counter() - start_time
+        if game is None:
+            break
+        count += 1
+        for name, accumulator in accumulators.items():
+            start_time = time.perf_counter()
+            accumulator.add(game)
+            metric_times[name] += time.perf_counter() - start_time
+        if isinstance(game, PackedGame):
+            moves += len(game.moves)
+        if progress is not None and count % PROGRESS_EVERY == 0:
+            progress(count)
+    if progress is not None:
+        progress(count)
+    profiler.add_time(read_stage, read_time, count)
+    for name, seconds in metric_times.items():
+        profiler.add_time("metric:" + name, seconds, count)
+    profiler.count("games parsed", count)
+    if moves:
+        profiler.count("moves visited", moves)
+    return count
+
+
+class HeaderOnlyGame:
+    __slots__ = ("headers", "movetext")
+
+    def __init__(self, headers, movetext=None):
+        self.headers = headers
+        self.movetext = movetext
+
+
+def iter_headers(file, quarantine=None, where=None):
+    for headers, _ in scan_games(file, quarantine=quarantine):
+        if where is None or where(headers):
+            yield HeaderOnlyGame(headers)
+
+
+def iter_packed(file, quarantine=None, where=None, keep_movetext=False):
+    # Games as PackedGame: the mainline is parsed straight into move and
+    # clock arrays, without building python-chess nodes. The movetext is
+    # kept as well when another metric reads it. A game with an illegal
+    # move keeps its moves up to that point and is counted, not skipped, so
+    # every reader yields the same games whichever metrics are asked for.
+    quarantine = Quarantine() if quarantine is None else quarantine
+    for headers, movetext in scan_games(file, keep_movetext=True, quarantine=quarantine):
+        if where is not None and not where(headers):
+            continue
+        game = PackedGame.from_movetext(headers, movetext)
+        if game.errors:
+            quarantine.normalized["truncated moves"] += 1
+        if keep_movetext:
+            game.movetext = movetext
+        yield game
+
+
+def iter_packed_movetext(file, quarantine=None, where=None):
+    return iter_packed(file, quarantine, where, keep_movetext=True)
+
+
+def iter_movetext(file, quarantine=None, where=None):
+    # Headers plus the raw movetext, for metrics that read comments such as
+    # clocks without needing the moves themselves
+    for headers, movetext in scan_games(file, keep_movetext=True, quarantine=quarantine):
+        if where is None or where(headers):
+            yield HeaderOnlyGame(headers, movetext)
+
+
+def compression(pgn_file):
+    with open(pgn_file, "rb") as file:
+        magic = file.read(4)
+    if magic.startswith(b"\x1f\x8b"):
+        return "gzip"
+    if magic == b"\x28\xb5\x2f\xfd":
+        return "zstd"
+    return None
+
+
+def open_pgn(pgn_file):
+    # Opens plain, gzip or zstd compressed PGN files for reading as text
+    kind = compression(pgn_file)
+    if kind == "gzip":
+        return gzip.open(pgn_file, "rt")
+    if kind == "zstd":
+        import zstandard
+        reader = zstandard.ZstdDecompressor().stream_reader(open(pgn_file, "rb"), read_across_frames=True)
+        return io.TextIOWrapper(io.BufferedReader(reader))
+    return open(pgn_file)
+
+
+def needs_moves(accumulators):
+    return any(accumulator.needs_moves for accumulator in accumulators.values())
+
+
+def reader_for(accumulators):
+    needs_movetext = any(getattr(accumulator, "needs_movetext", False) for accumulator in accumulators.values())
+    if needs_moves(accumulators):
+        return iter_packed_movetext if needs_movetext else iter_packed
+    if needs_movetext:
+        return iter_movetext
+    return iter_headers
+
+
+def find_game_start(file, offset):
+    # Returns the offset of the first tag line that follows movetext at or
+    # after offset, or None when no further game starts in the file.
+    tag_regex = chess.pgn.TAG_REGEX
+    file.seek(offset)
+    if offset:
+        # Skip the (possibly partial) line the offset landed in
+        offset += len(file.readline())
+    seen_movetext = offset == 0
+    for line in file:
+        if line.startswith(b"[") and seen_movetext and tag_regex.match(line.decode("utf-8", "replace")):
+            return offset
+        if not line.isspace() and not line.startswith(b"["):
+            seen_movetext = True
+        offset += len(line)
+    return None
+
+
+def shard_offsets(pgn_file, num_shards, min_shard_size=1 << 20):
+    file_size = os.path.getsize(pgn_file)
+    num_shards = max(1, min(num_shards, file_size // min_shard_size))
+    starts = [0]
+    with open(pgn_file, "rb") as file:
+        for shard in range(1, num_shards):
+            start = find_game_start(file, max(starts[-1] + 1, file_size * shard // num_shards))
+            if start is None:
+                break
+            starts.append(start)
+    return list(zip(starts, starts[1:] + [file_size]))
+
+
+class ShardReader(io.RawIOBase):
+    def __init__(self, pgn_file, start, end):
+        self.file = open(pgn_file, "rb")
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        read = self.file.readinto(memoryview(buffer)[:size])
+        self.remaining -= read
+        return read
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def open_shard(pgn_file, start, end):
+    # Decode the same way open(pgn_file) does for the serial path
+    return io.TextIOWrapper(io.BufferedReader(ShardReader(pgn_file, start, end)))
+
+
+def accumulate_shard(pgn_file, start, end, metrics, options=None, profile=False, where=None):
+    # With profile, the worker's stage times and counters are returned too
+    accumulators = make_accumulators(metrics, options)
+    read = reader_for(accumulators)
+    quarantine = Quarantine()
+    with open_shard(pgn_file, start, end) as file:
+        if profile:
+            profiler = profiling.enable()
+            games = add_games_profiled(read(file, quarantine, where), accumulators, None, profiler)
+            profiling.disable()
+            return accumulators, games, (profiler.stages, profiler.counters), quarantine
+        adders = [accumulator.add for accumulator in accumulators.values()]
+        games = 0
+        for game in read(file, quarantine, where):
+            for add in adders:
+                add(game)
+            games += 1
+    return accumulators, games, None, quarantine
+
+
+def analyze_file(pgn_file, metrics=DEFAULT_METRICS, workers=1, progress=None, options=None, quarantine=None,
+                 where=None):
+    # Compressed files can't be split at byte offsets and are read serially.
+    # Malformed games are skipped and recorded in quarantine when given.
+    # where (a query.GameFilter) is tested on each game's headers before its
+    # moves are parsed; only matching games reach the metrics.
+    if where is not None:
+        where = where.resolve(pgn_file)
+    if workers > 1 and compression(pgn_file) is None:
+        shards = shard_offsets(pgn_file, workers)
+        if len(shards) > 1:
+            return analyze_shards(pgn_file, shards, metrics, workers, progress, options, quarantine, where)
+    accumulators = make_accumulators(metrics, options)
+    read = reader_for(accumulators)
+    quarantine = Quarantine() if quarantine is None else quarantine
+    skipped = len(quarantine)
+    profiling.count("bytes read", os.path.getsize(pgn_file))
+    with profiling.stage("analyze_file"), open_pgn(pgn_file) as file:
+        report = run_accumulators(read(file, quarantine, where), accumulators, progress)
+    profiling.count("games quarantined", len(quarantine) - skipped)
+    return report
+
+
+def analyze_shards(pgn_file, shards, metrics, workers, progress=None, options=None, quarantine=None, where=None):
+    # Stage times from the workers are summed, so they add up to more than
+    # the wall time of the analyze_shards stage
+    profiler = profiling.active
+    profiling.count("bytes read", os.path.getsize(pgn_file))
+    # Spawned rather than forked: the GUI calls this from a worker thread,
+    # and a forked child can inherit locks held by the other threads
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+    try:
+        with profiling.stage("analyze_shards"):
+            futures = [executor.submit(accumulate_shard, pgn_file, start, end, metrics, options, profiler is not None,
+                                       where) for start, end in shards]
+            accumulators = None
+            games = 0
+            # Merge in file order so streaks and first-seen ordering match the serial pass
+            for future in futures:
+                partial, shard_games, shard_profile, shard_quarantine = future.result()
+                profiling.count("games quarantined", len(shard_quarantine))
+                if quarantine is not None:
+                    quarantine.merge(shard_quarantine)
+                if accumulators is None:
+                    accumulators = partial
+                else:
+                    with profiling.stage("merge shards"):
+                        for name, accumulator in accumulators.items():
+                            accumulator.merge(partial[name])
+                games += shard_games
+                if shard_profile is not None:
+                    stages, counters = shard_profile
+                    for name, (calls, seconds) in stages.items():
+                        profiler.add_time(name, seconds, calls)
+                    for name, value in counters.items():
+                        profiler.count(name, value)
+                if progress is not None:
+                    progress(games)
+    finally:
+        executor.shutdown(cancel_futures=True)
+    with profiling.stage("results"):
+        return {name: accumulator.result() for name, accumulator in accumulators.items()}
+
+
+def is_game_index(games):
+    return getattr(games, "is_game_index", False)
+
+
+def analyze_win_loss(games):
+    if is_game_index(games):
+        return games.analyze("win_loss")
+    return run_accumulators(games, {"win_loss": WinLossAccumulator()})["win_loss"]
+
+
+def analyze_rating_distribution(games):
+    if is_game_index(games):
+        return games.analyze("rating_distribution")
+    return run_accumulators(games, {"rating_distribution": RatingDistributionAccumulator()})["rating_distribution"]
+
+
+def analyze_performance_rating(games):
+    if is_game_index(games):
+        return games.analyze("performance_rating")
+    return run_accumulators(games, {"performance_rating": PerformanceRatingAccumulator()})["performance_rating"]
 
 
 def analyze_common_openings(games, top_n=25):
-    openings = Counter(game.headers.get("ECO", "") for game in games if game.headers.get("ECO"))
-    return openings.most_common(top_n)
+    if is_game_index(games):
+        return games.analyze("common_openings", top_n=top_n)
+    return run_accumulators(games, {"common_openings": CommonOpeningsAccumulator(top_n)})["common_openings"]
 
 
 def analyze_time_usage(games):
-    move_times = []
-    time_pattern = re.compile(r"(\d+):(\d+):([\d.]+)")
-    for game in games:
-        for node in game.mainline():
-            comment = node.comment
-            if comment and "[%clk" in comment:
-                match = time_pattern.search(comment)
-                if match:
-                    hours, minutes, seconds = match.groups()
-                    total_seconds = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
-                    move_times.append(total_seconds)
-    average_move_time = mean(move_times) if move_times else 0
-    return average_move_time
+    if is_game_index(games):
+        return games.analyze("time_usage")
+    return run_accumulators(games, {"time_usage": TimeUsageAccumulator()})["time_usage"]
+
+
+def analyze_player_stats(games, player=None):
+    if is_game_index(games):
+        return games.analyze("player_stats", player=player)
+    return run_accumulators(games, {"player_stats": PlayerStatsAccumulator(player)})["player_stats"]
+
+
+def analyze_timeline(games, player=None):
+    # The player's games sorted by date, for binning and range queries
+    if is_game_index(games):
+        return games.analyze("timeline", player=player)
+    accumulator = PlayerStatsAccumulator(player)
+    run_accumulators(games, {"player_stats": accumulator})
+    return Timeline.from_player_games(accumulator.games())
+
+
+def analyze_clock_stats(games):
+    if is_game_index(games):
+        return games.analyze("clock_stats")
+    return run_accumulators(games, {"clock_stats": ClockStatsAccumulator()})["clock_stats"]
 
 
 def analyze_winning_streaks(games):
-    streaks = []
-    current_streak = 0
-    for game in games:
-        if game.headers["Result"] == "1-0":
-            current_streak += 1
-        else:
-            if current_streak > 0:
-                streaks.append(current_streak)
-                current_streak = 0
-    longest_streak = max(streaks) if streaks else 0
-    return longest_streak
+    if is_game_index(games):
+        return games.analyze("winning_streak")
+    return run_accumulators(games, {"winning_streak": WinningStreakAccumulator()})["winning_streak"]
 
 
 def analyze_losing_streaks(games):
-    streaks = []
-    current_streak = 0
-    for game in games:
-        if game.headers["Result"] == "0-1":
-            current_streak += 1
-        else:
-            if current_streak > 0:
-                streaks.append(current_streak)
-                current_streak = 0
-    longest_streak = max(streaks) if streaks else 0
-    return longest_streak
+    if is_game_index(games):
+        return games.analyze("losing_streak")
+    return run_accumulators(games, {"losing_streak": LosingStreakAccumulator()})["losing_streak"]
 
 
 def analyze_results_timeline(games):
-    result_timeline = [(game.headers["Result"], game.headers["Date"]) for game in games]
-    return result_timeline
+    if is_game_index(games):
+        return games.analyze("results_timeline")
+    return run_accumulators(games, {"results_timeline": ResultsTimelineAccumulator()})["results_timeline"]
 
 
 def analyze_positional_analysis(games):
-    positions = Counter(game.headers.get("Opening", "") for game in games)
-    return positions
+    if is_game_index(games):
+        return games.analyze("positional_analysis")
+    return run_accumulators(games, {"positional_analysis": PositionalAnalysisAccumulator()})["positional_analysis"]
 
 
 def analyze_game_highlights(games, num_moves=5):
-    highlights = []
-    for game in games:
-        moves = []
-        node = game
-        for _ in range(num_moves):
-            node = node.variations[0] if node.variations else None
-            if node is None:
-                break
-            moves.append(node.move)
-        highlights.append(" ".join(str(move) for move in moves))
-    return highlights
-
-
-def analyze_games(pgn_file):
-    games = []
-    with open(pgn_file) as file:
-        while True:
-            game = chess.pgn.read_game(file)
-            if game is None:
-                break
-            games.append(game)
-
-    win_count, loss_count, draw_count, total_games = analyze_win_loss(games)
-    rating_distribution = analyze_rating_distribution(games)
-    performance_rating = analyze_performance_rating(games)
-    common_openings = analyze_common_openings(games)
-    # average_move_time = analyze_time_usage(games)
-    longest_winning_streak = analyze_winning_streaks(games)
-    longest_losing_streak = analyze_losing_streaks(games)
-    # results_timeline = analyze_results_timeline(games)
-    # positional_analysis = analyze_positional_analysis(games)
-    # game_highlights = analyze_game_highlights(games)
+    if is_game_index(games):
+        return games.analyze("game_highlights", num_moves=num_moves)
+    return run_accumulators(games, {"game_highlights": GameHighlightsAccumulator(num_moves)})["game_highlights"]
+
+
+def analyze_games(pgn_file, workers=1, use_index=False, clocks=False, player=None, output_format=None,
+                  output=None, extra_metrics=(), quarantine_path=None, where=None, index_cache=None):
+    # player="" reports from the perspective of the most frequent player.
+    # where (a query.GameFilter) limits the report to the matching games.
+    # With an output_format ("json", "csv" or "columnar") the report is
+    # written to output instead of printed. Skipped games are summarized on
+    # stderr and listed in quarantine_path when given. index_cache (a
+    # game_index.IndexCache) keeps indexes open between calls.
+    metrics = DEFAULT_METRICS + ("clock_stats",) if clocks else DEFAULT_METRICS
+    options = {}
+    if player is not None:
+        metrics += ("player_stats",)
+        options["player_stats"] = {"player": player or None}
+    metrics += tuple(metric for metric in extra_metrics if metric not in metrics)
+    if where is not None and player and not where.player:
+        where = where.with_player(player)
+    quarantine = Quarantine()
+    if output_format is not None:
+        from reports import build_report
+        with profiling.stage("analyze_games"):
+            if use_index:
+                games = open_game_index(pgn_file, index_cache)
+            else:
+                games = pgn_file
+            build_report(games, metrics, workers, options=options, quarantine=quarantine,
+                         where=where).write(output_format, output)
+        report_quarantine(quarantine, quarantine_path)
+        return
+    with profiling.stage("analyze_games"):
+        if use_index:
+            index = open_game_index(pgn_file, index_cache)
+            report = index.select(where).report(metrics, workers=workers, options=options)
+            quarantine.merge(index.quarantine())
+        else:
+            report = analyze_file(pgn_file, metrics, workers=workers, options=options, quarantine=quarantine,
+                                  where=where)
+    report_quarantine(quarantine, quarantine_path)
+
+    win_count, loss_count, draw_count, total_games = report["win_loss"]
+    rating_distribution = report["rating_distribution"]
+    performance_rating = report["performance_rating"]
+    common_openings = report["common_openings"]
+    # average_move_time = report["time_usage"]
+    longest_winning_streak = report["winning_streak"]
+    longest_losing_streak = report["losing_streak"]
+    # results_timeline = report["results_timeline"]
+    # positional_analysis = report["positional_analysis"]
+    # game_highlights = report["game_highlights"]
 
     print("Win-Loss Ratio:")
     print(f"Wins: {win_count}")
@@ -149,15 +717,21 @@ def analyze_games(pgn_file):
     for opening, count in common_openings:
         print(f"Opening: {opening} - Count: {count}")
 
-    # print("Time Usage:")
-    # print(f"Average Move Time: {average_move_time}")
-    # print()
+    if clocks:
+        print("Time Usage:")
+        print(format_clock_stats(report["clock_stats"]))
+        print()
 
     print("Winning/Losing Streaks:")
     print(f"Longest Winning Streak: {longest_winning_streak}")
     print(f"Longest Losing Streak: {longest_losing_streak}")
     print()
 
+    if player is not None:
+        print("Player Perspective:")
+        print(format_player_stats(report["player_stats"]))
+        print()
+
     # create a calendar that lights up if more or less losses or maybe by elo loss?
     # print("Game Results Timeline:")
     # for result, date in results_timeline:
@@ -175,7 +749,24 @@ def analyze_games(pgn_file):
     # print()
 
 
+def open_game_index(pgn_file, index_cache=None):
+    if index_cache is not None:
+        return index_cache.get(pgn_file)
+    from game_index import open_index
+    return open_index(pgn_file)
+
+
+def report_quarantine(quarantine, path=None):
+    if len(quarantine) or quarantine.normalized:
+        print(format_quarantine(quarantine.result()), file=sys.stderr)
+    if path is not None:
+        with open(path, "w") as file:
+            json.dump(quarantine.result(), file, indent=2)
+
+
 if __name__ == '__main__':
-    pgn_file = "file.pgn"  # Replace with the actual path to your PGN file
+    import cli
 
-    analyze_games(pgn_file)
+    parser = argparse.ArgumentParser(description="Analyze a PGN file")
+    cli.add_analyze_arguments(parser)
+    cli.run_analyze(parser.parse_args())
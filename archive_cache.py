@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import profiling
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "chess-analyzer", "archives")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+CHUNK_SIZE = 1 << 16
+MONTH_URL = re.compile(r"/(\d{4})/(\d{2})$")
+
+
+def month_end(archive_url):
+    # Start of the month after the archive's month, as a UTC timestamp
+    match = MONTH_URL.search(archive_url)
+    if not match:
+        return None
+    year, month = int(match.group(1)), int(match.group(2))
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return datetime(year, month, 1, tzinfo=timezone.utc).timestamp()
+
+
+class ArchiveCache:
+    # Monthly archive bodies on disk keyed by URL. An archive fetched after
+    # its month ended can't change and is served without a request; anything
+    # else is revalidated with a conditional GET. Least recently used entries
+    # are evicted once the cache grows past max_bytes.
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or os.environ.get("CHESS_ANALYZER_CACHE", DEFAULT_CACHE_DIR)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.entries = self.read_entries()
+        self.dirty = False
+
+    def entries_path(self):
+        return os.path.join(self.cache_dir, "entries.json")
+
+    def body_path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def read_entries(self):
+        try:
+            with open(self.entries_path()) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def flush(self):
+        with self.lock:
+            if self.dirty:
+                self.write_entries()
+                self.dirty = False
+
+    def write_entries(self):
+        temp_file = self.entries_path() + ".tmp"
+        with open(temp_file, "w") as file:
+            json.dump(self.entries, file)
+        os.replace(temp_file, self.entries_path())
+
+    def lookup(self, archive_url):
+        key = hashlib.sha1(archive_url.encode()).hexdigest()
+        with self.lock:
+            return key, self.entries.get(key)
+
+    def open_body(self, key):
+        # Opened under the lock, so a body being read can't be evicted from
+        # under its reader: on removal the open file stays readable
+        with self.lock:
+            try:
+                body = open(self.body_path(key), "rb")
+            except OSError:
+                return None
+            if key in self.entries:
+                self.entries[key]["last_used"] = time.time()
+                self.dirty = True
+        return body
+
+    def is_closed(self, entry):
+        end = month_end(entry["url"])
+        return end is not None and entry["fetched_at"] >= end
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, key, archive_url, response):
+        # Streams the body to disk so a large month is never held in memory,
+        # and returns it opened for reading
+        path = self.body_path(key)
+        temp_file = f"{path}.{threading.get_ident()}.tmp"
+        size = 0
+        try:
+            with open(temp_file, "wb") as file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    file.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+        profiling.count("http bytes", size)
+        now = time.time()
+        with self.lock:
+            os.replace(temp_file, path)
+            body = open(path, "rb")
+            self.entries[key] = {
+                "url": archive_url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "size": size,
+                "fetched_at": now,
+                "last_used": now,
+            }
+            self.evict()
+            self.dirty = True
+        return body
+
+    def touch(self, key):
+        now = time.time()
+        with self.lock:
+            if key in self.entries:
+                self.entries[key]["fetched_at"] = now
+                self.entries[key]["last_used"] = now
+                self.dirty = True
+
+    def evict(self):
+        total = sum(entry["size"] for entry in self.entries.values())
+        for key in sorted(self.entries, key=lambda key: self.entries[key]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self.entries.pop(key)["size"]
+            try:
+                os.remove(self.body_path(key))
+            except OSError:
+                pass
+
+    def fetch(self, get, archive_url):
+        # get(url, headers) performs a streamed request; returns the archive
+        # body as an open binary file or None when the archive isn't
+        # available.
+        key, entry = self.lookup(archive_url)
+        if entry is not None and self.is_closed(entry):
+            body = self.open_body(key)
+            if body is not None:
+                self.hits += 1
+                profiling.count("archive cache hits")
+                return body
+
+        headers = self.conditional_headers(entry) if entry is not None else {}
+        response = get(archive_url, headers)
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            body = self.open_body(key)
+            if body is not None:
+                self.revalidated += 1
+                profiling.count("archive cache revalidated")
+                self.touch(key)
+                return body
+            response = get(archive_url, {})
+        with response:
+            if response.status_code != 200:
+                return None
+            self.misses += 1
+            profiling.count("archive cache misses")
+            return self.store(key, archive_url, response)
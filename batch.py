@@ -0,0 +1,198 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import requests
+
+import analytics
+import downloader
+import profiling
+from archive_cache import ArchiveCache
+
+# Players downloaded at the same time, each with ARCHIVE_WORKERS requests in flight
+DEFAULT_DOWNLOADS = 4
+ARCHIVE_WORKERS = 4
+BATCH_METRICS = ("player_stats", "common_openings")
+COLUMNS = ("player", "source", "games", "wins", "draws", "losses", "score", "performance_rating",
+           "expected_score", "winning_streak", "losing_streak", "top_opening", "error")
+
+
+def is_pgn_file(item):
+    return os.path.isfile(item)
+
+
+def read_roster(path):
+    # One username or PGN path per line; blank lines and # comments are skipped
+    with open(path) as file:
+        return [line.split("#")[0].strip() for line in file if line.split("#")[0].strip()]
+
+
+def analyze_player_file(pgn_file, player=None):
+    # Runs in the shared process pool; one file per task
+    options = {"player_stats": {"player": player}}
+    return analytics.analyze_file(pgn_file, BATCH_METRICS, options=options)
+
+
+def summary_row(source, report):
+    stats = report["player_stats"]
+    wins, losses, draws, total = stats["record"]
+    finished = wins + draws + losses
+    expected = stats["expected_score"]
+    openings = report["common_openings"]
+    return {
+        "player": stats["player"],
+        "source": source,
+        "games": total,
+        "wins": wins,
+        "draws": draws,
+        "losses": losses,
+        "score": round((wins + draws / 2) / finished, 3) if finished else None,
+        "performance_rating": stats["performance_rating"],
+        "expected_score": round(expected["expected"] / expected["games"], 3) if expected["games"] else None,
+        "winning_streak": stats["winning_streak"],
+        "losing_streak": stats["losing_streak"],
+        "top_opening": openings[0][0] if openings else None,
+        "openings": openings,
+    }
+
+
+def error_row(source, error):
+    row = dict.fromkeys(COLUMNS)
+    row.update({"player": source, "source": source, "error": str(error)})
+    return row
+
+
+def aggregate(rows):
+    # Totals across every player that was analyzed
+    rows = [row for row in rows if not row.get("error")]
+    wins = sum(row["wins"] for row in rows)
+    draws = sum(row["draws"] for row in rows)
+    losses = sum(row["losses"] for row in rows)
+    finished = wins + draws + losses
+    rated = [row for row in rows if row["performance_rating"] and row["games"]]
+    openings = Counter()
+    for row in rows:
+        openings.update(dict(row["openings"]))
+    return {
+        "players": len(rows),
+        "games": sum(row["games"] for row in rows),
+        "wins": wins,
+        "draws": draws,
+        "losses": losses,
+        "score": round((wins + draws / 2) / finished, 3) if finished else None,
+        "average_performance_rating": round(sum(row["performance_rating"] * row["games"] for row in rated)
+                                            / sum(row["games"] for row in rated)) if rated else None,
+        "best_performance": max(rated, key=lambda row: row["performance_rating"])["player"] if rated else None,
+        "common_openings": openings.most_common(10),
+    }
+
+
+def run_batch(items, output_dir=".", downloads=DEFAULT_DOWNLOADS, workers=None, compress=None,
+              base_url=None, report=print):
+    # Usernames are downloaded a few at a time over one pooled session and a
+    # shared archive cache; every PGN goes to one process pool as soon as it
+    # is on disk. Returns rows in the order the items were given.
+    suffix = {"gzip": ".gz", "zstd": ".zst"}.get(compress, "")
+    session = downloader.make_session(downloads * ARCHIVE_WORKERS)
+    cache = ArchiveCache()
+    rows = [None] * len(items)
+    analyses = {}
+
+    def download(username):
+        pgn_filename = os.path.join(output_dir, f"{username}_games.pgn{suffix}")
+        with profiling.stage("batch:download"):
+            return downloader.download_games(username, pgn_filename, ARCHIVE_WORKERS, session, base_url,
+                                             cache=cache)[0]
+
+    # Spawned rather than forked, since the download threads are running by
+    # the time a worker starts
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as analysis_pool, \
+            ThreadPoolExecutor(max_workers=downloads) as download_pool:
+        fetches = {}
+        for number, item in enumerate(items):
+            if is_pgn_file(item):
+                analyses[analysis_pool.submit(analyze_player_file, item)] = number
+            else:
+                fetches[download_pool.submit(download, item)] = number
+        for future in as_completed(fetches):
+            number = fetches[future]
+            try:
+                pgn_filename = future.result()
+            except (downloader.DownloadError, OSError, requests.RequestException) as error:
+                rows[number] = error_row(items[number], error)
+                report(f"{items[number]}: {error}")
+                continue
+            report(f"{items[number]}: downloaded")
+            analyses[analysis_pool.submit(analyze_player_file, pgn_filename, items[number])] = number
+        for future in as_completed(analyses):
+            number = analyses[future]
+            try:
+                rows[number] = summary_row(items[number], future.result())
+            except (OSError, ValueError) as error:
+                rows[number] = error_row(items[number], error)
+            report(f"{items[number]}: analyzed")
+    return rows
+
+
+def format_table(rows, totals):
+    widths = {"player": max([len("Player")] + [len(str(row["player"])) for row in rows])}
+    lines = [f"{'Player':<{widths['player']}}  {'Games':>6}  {'W':>5}  {'D':>5}  {'L':>5}  {'Score':>6}  "
+             f"{'Perf':>5}  {'Exp':>6}  {'Streak':>7}  Opening"]
+    for row in rows:
+        if row.get("error"):
+            lines.append(f"{row['player']:<{widths['player']}}  error: {row['error']}")
+            continue
+        lines.append(f"{row['player']:<{widths['player']}}  {row['games']:>6}  {row['wins']:>5}  {row['draws']:>5}  "
+                     f"{row['losses']:>5}  {row['score'] or 0:>6.1%}  {row['performance_rating']:>5}  "
+                     f"{row['expected_score'] or 0:>6.1%}  {row['winning_streak']:>3}/{row['losing_streak']:<3}  "
+                     f"{row['top_opening'] or '-'}")
+    lines.append("")
+    lines.append(f"Players: {totals['players']}  Games: {totals['games']}  "
+                 f"W/D/L: {totals['wins']}/{totals['draws']}/{totals['losses']}  "
+                 f"Score: {totals['score'] or 0:.1%}  "
+                 f"Average Performance: {totals['average_performance_rating']}  "
+                 f"Best: {totals['best_performance']}")
+    lines.append("Most Common Openings: " + ", ".join(f"{eco} ({count})" for eco, count in totals["common_openings"]))
+    return "\n".join(lines)
+
+
+def write_output(path, rows, totals):
+    if path.endswith(".json"):
+        with open(path, "w") as file:
+            json.dump({"players": [{column: row.get(column) for column in COLUMNS} for row in rows],
+                       "aggregate": totals}, file, indent=2)
+        return
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Download and analyze many players in one run")
+    parser.add_argument("items", nargs="*", help="chess.com usernames or PGN files")
+    parser.add_argument("--roster", help="File with one username or PGN path per line")
+    parser.add_argument("--output-dir", default=".", help="Where downloaded PGNs are written")
+    parser.add_argument("--downloads", type=int, default=DEFAULT_DOWNLOADS, help="Players downloaded at once")
+    parser.add_argument("--workers", type=int, help="Processes analyzing files (default: one per core)")
+    parser.add_argument("--compress", choices=("gzip", "zstd"), help="Write compressed PGNs")
+    parser.add_argument("--output", help="Write the summary to a .csv or .json file")
+    parser.add_argument("--base-url", help="Games API to download from (default: $CHESS_ANALYZER_API or chess.com)")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+
+    items = args.items + (read_roster(args.roster) if args.roster else [])
+    if not items:
+        parser.error("give usernames, PGN files or --roster")
+    with profiling.profile_from_args(args):
+        rows = run_batch(items, args.output_dir, args.downloads, args.workers, args.compress, args.base_url,
+                         report=lambda message: print(message, file=sys.stderr))
+    totals = aggregate(rows)
+    print(format_table(rows, totals))
+    if args.output:
+        write_output(args.output, rows, totals)
@@ -0,0 +1,416 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import chess
+import chess.pgn
+import requests
+
+import analytics
+import downloader
+from archive_cache import ArchiveCache
+from ingest import Quarantine, normalize_headers
+from mock_api import MockGamesAPI
+
+RESULTS = ["1-0", "0-1", "1/2-1/2"]
+TIME_CONTROLS = ["60", "180", "180+2", "300", "600", "600+5"]
+ECO_CODES = ["A00", "A45", "B01", "B20", "B90", "C00", "C20", "C50", "C65", "D02", "D30", "E60"]
+SIZES = {"1k": 1000, "10k": 10000, "100k": 100000, "1m": 1000000}
+# analyze_* functions timed by the suite, with the metric whose reader they use
+ANALYZE_FUNCTIONS = [
+    ("win_loss", analytics.analyze_win_loss),
+    ("rating_distribution", analytics.analyze_rating_distribution),
+    ("performance_rating", analytics.analyze_performance_rating),
+    ("common_openings", analytics.analyze_common_openings),
+    ("time_usage", analytics.analyze_time_usage),
+    ("clock_stats", analytics.analyze_clock_stats),
+    ("player_stats", analytics.analyze_player_stats),
+    ("winning_streak", analytics.analyze_winning_streaks),
+    ("losing_streak", analytics.analyze_losing_streaks),
+    ("results_timeline", analytics.analyze_results_timeline),
+    ("positional_analysis", analytics.analyze_positional_analysis),
+    ("game_highlights", analytics.analyze_game_highlights),
+]
+# Metrics that parse every move are skipped above this many games
+MAX_MOVE_PARSE_GAMES = 100000
+DEFAULT_TOLERANCE = 0.10
+
+
+def random_movetext(rng, clocks, max_plies=80):
+    board = chess.Board()
+    remaining = [180.0, 180.0]
+    parts = []
+    for ply in range(rng.randint(10, max_plies)):
+        moves = list(board.legal_moves)
+        if not moves:
+            break
+        move = rng.choice(moves)
+        san = board.san(move)
+        board.push(move)
+        if ply % 2 == 0:
+            token = f"{ply // 2 + 1}. {san}"
+        else:
+            token = f"{ply // 2 + 1}... {san}"
+        if clocks:
+            side = ply % 2
+            remaining[side] = max(0.0, remaining[side] - rng.randint(1, 60) / 10)
+            seconds = remaining[side]
+            token += " {[%%clk %d:%02d:%04.1f]}" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+        parts.append(token)
+    return " ".join(parts)
+
+
+def generate_pgn(path, num_games, clocks=True, seed=0, movetext_pool=200):
+    # Movetexts are drawn from a fixed pool so large files stay cheap to build;
+    # headers vary per game. The output only depends on the arguments.
+    rng = random.Random(seed)
+    pool = [random_movetext(rng, clocks) for _ in range(min(movetext_pool, num_games))]
+    with open(path, "w") as file:
+        for index in range(num_games):
+            result = rng.choice(RESULTS)
+            white, black = ("player", f"opponent{index % 997}") if index % 2 else (f"opponent{index % 997}", "player")
+            year = 2015 + index * 10 // max(num_games, 1)
+            file.write(
+                f'[Event "Live Chess"]\n'
+                f'[Site "Chess.com"]\n'
+                f'[Date "{year}.{rng.randint(1, 12):02d}.{rng.randint(1, 28):02d}"]\n'
+                f'[Round "-"]\n'
+                f'[White "{white}"]\n'
+                f'[Black "{black}"]\n'
+                f'[Result "{result}"]\n'
+                f'[WhiteElo "{rng.randint(800, 2400)}"]\n'
+                f'[BlackElo "{rng.randint(800, 2400)}"]\n'
+                f'[TimeControl "{rng.choice(TIME_CONTROLS)}"]\n'
+                f'[ECO "{rng.choice(ECO_CODES)}"]\n'
+                f'\n{pool[index % len(pool)]} {result}\n\n'
+            )
+    return path
+
+
+def time_call(function, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start_time, result
+
+
+def python_chess_parse(pgn_file, metrics):
+    # The original reader: every game built as a python-chess tree
+    def games(file):
+        quarantine = Quarantine()
+        while True:
+            game = chess.pgn.read_game(file)
+            if game is None:
+                break
+            if normalize_headers(game.headers, quarantine, typed=False) is None:
+                yield game
+
+    with analytics.open_pgn(pgn_file) as file:
+        return analytics.run_accumulators(games(file), analytics.make_accumulators(metrics))
+
+
+def full_parse(pgn_file, metrics):
+    with analytics.open_pgn(pgn_file) as file:
+        return analytics.run_accumulators(analytics.iter_packed_movetext(file), analytics.make_accumulators(metrics))
+
+
+def bench_headers_only(pgn_file):
+    metrics = analytics.DEFAULT_METRICS
+    chess_time, chess_report = time_call(python_chess_parse, pgn_file, metrics)
+    packed_time, packed_report = time_call(full_parse, pgn_file, metrics)
+    fast_time, fast_report = time_call(analytics.analyze_file, pgn_file, metrics)
+    if not chess_report == packed_report == fast_report:
+        raise RuntimeError("Header-only scan and full parse disagree")
+    total_games = fast_report["win_loss"][3]
+    print(f"Header-only report over {total_games} games:")
+    print(f"python-chess parse: {chess_time:.2f}s ({total_games / chess_time:.0f} games/s)")
+    print(f"Packed parse: {packed_time:.2f}s ({total_games / packed_time:.0f} games/s)")
+    print(f"Header scan: {fast_time:.2f}s ({total_games / fast_time:.0f} games/s)")
+    print(f"Speedup: {chess_time / fast_time:.1f}x over python-chess, {packed_time / fast_time:.1f}x over packed")
+
+
+def sequential_download(username, base_url, pgn_filename):
+    # The loop download_games used to run: one pass to count games and a
+    # second one to write them, one request at a time
+    archives = requests.get(f"{base_url}/player/{username}/games/archives").json()["archives"]
+    for archive_url in archives:
+        requests.get(archive_url).json()
+    with open(pgn_filename, "w") as file:
+        for archive_url in archives:
+            for game in requests.get(archive_url).json().get("games", []):
+                file.write(game["pgn"] + "\n\n")
+
+
+def bench_download(months=24, latency=0.05, workers=downloader.DEFAULT_WORKERS):
+    with MockGamesAPI(months=months, latency=latency) as api, tempfile.TemporaryDirectory() as directory:
+        pgn_file = os.path.join(directory, "sequential.pgn")
+        sequential_time, _ = time_call(sequential_download, "player", api.base_url, pgn_file)
+        sequential_requests = api.requests
+
+        api.requests = 0
+        pgn_file = os.path.join(directory, "pooled.pgn")
+        pooled_time, _ = time_call(downloader.download_games, "player", pgn_file, workers=workers, base_url=api.base_url)
+        pooled_requests = api.requests
+
+    print(f"Download of {months} monthly archives at {latency * 1000:.0f}ms per request:")
+    print(f"Sequential two-pass: {sequential_time:.2f}s ({sequential_requests} requests)")
+    print(f"Pooled, {workers} workers: {pooled_time:.2f}s ({pooled_requests} requests)")
+    print(f"Speedup: {sequential_time / pooled_time:.1f}x")
+
+
+def load_run(api, username, workers, directory, cache=None):
+    # One download against the mock API; throughput counts what was written
+    api.reset_counters()
+    pgn_file = os.path.join(directory, f"load-{workers}-{time.monotonic_ns()}.pgn")
+    seconds, (_, games) = time_call(downloader.download_games, username, pgn_file, workers=workers,
+                                    base_url=api.base_url, cache=cache)
+    archives = len(api.month_list(username))
+    stats = api.stats()
+    return {
+        "workers": workers,
+        "seconds": seconds,
+        "games": games,
+        "games_per_sec": games / seconds if seconds else 0.0,
+        "mb_per_sec": stats["bytes_sent"] / seconds / 1e6 if seconds else 0.0,
+        "requests": stats["requests"],
+        "throttled": stats["throttled"],
+        "failed_archives": archives - len(downloader.load_download_state(pgn_file)),
+    }
+
+
+def bench_load(args):
+    # Downloads the same archives at each worker count, cold and (with
+    # --cache) again through the warm archive cache, against a mock API
+    # with the given latency, payload size and throttling
+    api = MockGamesAPI(months=args.months, games_per_month=args.games_per_month, latency=args.latency,
+                       plies=args.plies, throttle=args.throttle, rate_limit=args.rate_limit,
+                       retry_after=args.retry_after, fixtures=args.fixtures)
+    rows = []
+    with api, tempfile.TemporaryDirectory() as directory:
+        for workers in [int(count) for count in args.worker_counts.split(",")]:
+            cache = ArchiveCache(os.path.join(directory, f"cache-{workers}")) if args.cache else None
+            rows.append(dict(load_run(api, args.username, workers, directory, cache), pass_="cold"))
+            if cache is not None:
+                rows.append(dict(load_run(api, args.username, workers, directory, cache), pass_="cached"))
+    print(f"Downloads of {args.username!r} at {args.latency * 1000:.0f}ms latency, {args.plies} plies per game, "
+          f"throttle {args.throttle:.0%}, rate limit {args.rate_limit or 'none'}/s:")
+    print(f"{'Workers':>7} {'Pass':>6} {'Seconds':>8} {'Games/s':>9} {'MB/s':>7} {'Requests':>8} {'429s':>6} "
+          f"{'Failed':>6}")
+    for row in rows:
+        print(f"{row['workers']:>7} {row['pass_']:>6} {row['seconds']:>8.2f} {row['games_per_sec']:>9.0f} "
+              f"{row['mb_per_sec']:>7.2f} {row['requests']:>8} {row['throttled']:>6} {row['failed_archives']:>6}")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump([{("pass" if key == "pass_" else key): value for key, value in row.items()} for row in rows],
+                      file, indent=2)
+    return rows
+
+
+def synthetic_path(directory, num_games, clocks):
+    return os.path.join(directory, f"synthetic-{num_games}-{'clocks' if clocks else 'no-clocks'}.pgn")
+
+
+def ensure_pgn(directory, num_games, clocks):
+    # Generated files only depend on their size and clocks, so they are reused
+    path = synthetic_path(directory, num_games, clocks)
+    if not os.path.exists(path):
+        generate_pgn(path + ".tmp", num_games, clocks=clocks)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def run_analyze_function(pgn_file, metric):
+    function = dict(ANALYZE_FUNCTIONS)[metric]
+    read = analytics.reader_for({metric: analytics.METRICS[metric]()})
+    with analytics.open_pgn(pgn_file) as file:
+        function(read(file))
+
+
+def run_analyze_games(pgn_file):
+    with contextlib.redirect_stdout(io.StringIO()):
+        analytics.analyze_games(pgn_file, clocks=True, player="")
+
+
+def run_download(num_games):
+    months = 12
+    with MockGamesAPI(months=months, games_per_month=max(1, num_games // months)) as api, \
+            tempfile.TemporaryDirectory() as directory:
+        downloader.download_games("player", os.path.join(directory, "player.pgn"), base_url=api.base_url)
+
+
+def measure(case):
+    # Runs in a fresh process so peak RSS belongs to this case alone.
+    # Allocation pressure is reported as garbage collections triggered and
+    # the net change in allocated blocks; tracemalloc's peak is optional as
+    # it slows the run down several times.
+    function, args, num_games, trace = case
+    gc.collect()
+    collections_before = sum(generation["collections"] for generation in gc.get_stats())
+    blocks_before = sys.getallocatedblocks()
+    if trace:
+        tracemalloc.start()
+    seconds, _ = time_call(function, *args)
+    result = {
+        "seconds": seconds,
+        "games_per_sec": num_games / seconds if seconds else 0.0,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "gc_collections": sum(generation["collections"] for generation in gc.get_stats()) - collections_before,
+        "allocated_blocks": sys.getallocatedblocks() - blocks_before,
+    }
+    if trace:
+        result["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def suite_cases(directory, sizes, trace):
+    for num_games in sizes:
+        for clocks in (True, False):
+            pgn_file = ensure_pgn(directory, num_games, clocks)
+            variant = "clocks" if clocks else "no-clocks"
+            for metric, _ in ANALYZE_FUNCTIONS:
+                needs_moves = analytics.METRICS[metric].needs_moves
+                yield (f"analyze_{metric}/{num_games}/{variant}",
+                       (run_analyze_function, (pgn_file, metric), num_games, trace),
+                       needs_moves and num_games > MAX_MOVE_PARSE_GAMES)
+            yield f"analyze_games/{num_games}/{variant}", (run_analyze_games, (pgn_file,), num_games, trace), False
+        yield (f"download_games/{num_games}", (run_download, (num_games,), num_games, trace),
+               num_games > MAX_MOVE_PARSE_GAMES)
+
+
+def run_suite(sizes, directory, repeat=1, trace=False):
+    # Each case runs repeat times in its own process; the fastest run is kept
+    results = {}
+    context = get_context("spawn")
+    for name, case, skip in suite_cases(directory, sizes, trace):
+        if skip:
+            results[name] = {"skipped": True}
+            print(f"{name}: skipped")
+            continue
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(measure, case).result())
+        best = min(runs, key=lambda run: run["seconds"])
+        best["peak_rss_kb"] = min(run["peak_rss_kb"] for run in runs)
+        results[name] = best
+        print(f"{name}: {best['seconds']:.2f}s ({best['games_per_sec']:.0f} games/s, "
+              f"peak RSS {best['peak_rss_kb'] / 1024:.0f} MB)")
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": repeat,
+            "trace_allocations": trace,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    # Cases slower or bigger than the baseline by more than tolerance
+    regressions = []
+    for name, result in report["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None or result.get("skipped") or previous.get("skipped"):
+            continue
+        if result["games_per_sec"] < previous["games_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['games_per_sec']:.0f} games/s, "
+                               f"baseline {previous['games_per_sec']:.0f}")
+        if result["peak_rss_kb"] > previous["peak_rss_kb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {result['peak_rss_kb']} KB, baseline {previous['peak_rss_kb']}")
+    return regressions
+
+
+def parse_sizes(value):
+    return [SIZES[size.lower()] if size.lower() in SIZES else int(size) for size in value.split(",")]
+
+
+def bench_suite(args):
+    directory = args.data_dir or tempfile.mkdtemp(prefix="chess-bench-")
+    os.makedirs(directory, exist_ok=True)
+    report = run_suite(parse_sizes(args.sizes), directory, args.repeat, args.trace_allocations)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline["meta"].get("trace_allocations", False) != args.trace_allocations:
+            print("Warning: only one of the runs traced allocations, so timings aren't comparable")
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analytics pipeline")
+    parser.add_argument("pgn_file", nargs="?", help="PGN file to benchmark (generated if omitted)")
+    parser.add_argument("--games", type=int, default=10000, help="Number of synthetic games to generate")
+    parser.add_argument("--no-clocks", action="store_true", help="Generate games without clock comments")
+    parser.add_argument("--download", action="store_true", help="Benchmark downloads against a local mock API")
+    parser.add_argument("--months", type=int, default=24, help="Monthly archives served by the mock API")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock API latency per request in seconds")
+    parser.add_argument("--workers", type=int, default=downloader.DEFAULT_WORKERS, help="Concurrent downloads")
+    parser.add_argument("--load-test", action="store_true",
+                        help="Measure download throughput and throttling at several worker counts")
+    parser.add_argument("--worker-counts", default="1,2,4,8,16", help="Load test worker counts, e.g. 1,4,16")
+    parser.add_argument("--games-per-month", type=int, default=50, help="Games in each mock monthly archive")
+    parser.add_argument("--plies", type=int, default=40, help="Moves per mock game, for the payload size")
+    parser.add_argument("--throttle", type=float, default=0.0, help="Share of mock API requests answered with 429")
+    parser.add_argument("--rate-limit", type=int, help="Mock API requests per second before answering 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--fixtures", help="Serve recorded archives from this directory (see mock_api.py --record)")
+    parser.add_argument("--username", default="player", help="Player whose archives the load test downloads")
+    parser.add_argument("--cache", action="store_true", help="Repeat each load test download through the archive cache")
+    parser.add_argument("--suite", action="store_true", help="Time every analyze function, the report and the download")
+    parser.add_argument("--sizes", default="1k,10k", help="Suite sizes in games, e.g. 1k,10k,100k,1m")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per suite case; the fastest is kept")
+    parser.add_argument("--trace-allocations", action="store_true", help="Record tracemalloc peaks (slow)")
+    parser.add_argument("--data-dir", help="Directory to keep generated suite PGNs in between runs")
+    parser.add_argument("--output", help="Write suite results to this JSON file")
+    parser.add_argument("--baseline", help="Suite results JSON to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown or memory growth against the baseline")
+    args = parser.parse_args()
+
+    if args.suite:
+        bench_suite(args)
+        return
+
+    if args.download:
+        bench_download(args.months, args.latency, args.workers)
+        return
+
+    if args.load_test:
+        bench_load(args)
+        return
+
+    if args.pgn_file:
+        bench_headers_only(args.pgn_file)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        pgn_file = os.path.join(directory, "synthetic.pgn")
+        generate_pgn(pgn_file, args.games, clocks=not args.no_clocks)
+        bench_headers_only(pgn_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import tkinter as tk
+from tkinter import filedialog, ttk
+
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
+
+from charts import BIN_WIDTHS, FIGURE_SIZE, draw_rating_histogram
+
+
+class RatingChartWindow(tk.Toplevel):
+    # The rating distribution drawn on one embedded figure. Showing another
+    # histogram redraws the same figure and canvas, so repeated use doesn't
+    # create figures. on_width(width) is called when another bin width is
+    # picked.
+    def __init__(self, master, on_width=None):
+        super().__init__(master)
+        self.title("Rating Distribution")
+        self.on_width = on_width
+        self.histogram = None
+
+        controls = tk.Frame(self)
+        controls.pack(side=tk.BOTTOM, fill=tk.X)
+        tk.Label(controls, text="Bin width (Elo):").pack(side=tk.LEFT)
+        self.width_var = tk.StringVar()
+        widths = ttk.Combobox(controls, textvariable=self.width_var, values=BIN_WIDTHS, width=6, state="readonly")
+        widths.bind("<<ComboboxSelected>>", self.on_select_width)
+        widths.pack(side=tk.LEFT)
+        tk.Button(controls, text="Export...", command=self.export).pack(side=tk.RIGHT)
+
+        self.figure = Figure(figsize=FIGURE_SIZE)
+        self.axes = self.figure.add_subplot()
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self)
+        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+
+    def show(self, histogram):
+        self.histogram = histogram
+        self.width_var.set(str(histogram.width))
+        draw_rating_histogram(self.axes, histogram)
+        self.canvas.draw_idle()
+        self.deiconify()
+        self.lift()
+
+    def on_select_width(self, event):
+        width = int(self.width_var.get())
+        if self.on_width is not None and (self.histogram is None or width != self.histogram.width):
+            self.on_width(width)
+
+    def export(self):
+        path = filedialog.asksaveasfilename(parent=self, defaultextension=".png",
+                                            filetypes=[("PNG Image", "*.png"), ("SVG Image", "*.svg")])
+        if path:
+            self.figure.savefig(path)
@@ -0,0 +1,113 @@
+import argparse
+import hashlib
+import os
+
+import numpy as np
+
+DEFAULT_BIN_WIDTH = 50
+BIN_WIDTHS = (25, 50, 100, 200)
+EXPORT_FORMATS = ("png", "svg")
+FIGURE_SIZE = (8, 4.5)
+
+
+class RatingHistogram:
+    # A player's wins, draws and losses by opponent rating, in bins of width
+    # Elo from the lowest rated opponent's bin to the highest's. Games
+    # against unrated opponents are left out.
+    def __init__(self, width, starts, wins, draws, losses, player=None):
+        self.width = width
+        self.starts = starts
+        self.wins = wins
+        self.draws = draws
+        self.losses = losses
+        self.player = player
+
+    @classmethod
+    def from_player_games(cls, games, width=DEFAULT_BIN_WIDTH):
+        rated = games.opp_elo > 0
+        bins = games.opp_elo[rated] // width
+        scores = games.my_score[rated]
+        if not bins.size:
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(width, empty, empty, empty, empty, games.player)
+        first = int(bins.min())
+        size = int(bins.max()) - first + 1
+        slots = bins - first
+        wins, draws, losses = (np.bincount(slots[scores == score], minlength=size) for score in (1, 0.5, 0))
+        return cls(width, (first + np.arange(size)) * width, wins, draws, losses, games.player)
+
+    def __len__(self):
+        return len(self.starts)
+
+
+def draw_rating_histogram(axes, histogram):
+    # Wins above the axis and losses below it. Clears the axes first, so
+    # one figure can be redrawn for any number of charts.
+    axes.clear()
+    bar_width = histogram.width * 0.8
+    axes.bar(histogram.starts, histogram.wins, width=bar_width, align="edge", color="green", label="Wins")
+    axes.bar(histogram.starts, -histogram.losses, width=bar_width, align="edge", color="red", label="Losses")
+    limit = max(int(histogram.wins.max(initial=0)), int(histogram.losses.max(initial=0)), 1)
+    # Symmetric, with room above the tallest bar
+    axes.set_ylim(-limit * 1.1, limit * 1.1)
+    axes.set_xlabel("Opponent Rating (Elo)")
+    axes.set_ylabel("Count")
+    title = "Win and Loss Distribution by Rating"
+    axes.set_title(f"{title} ({histogram.player})" if histogram.player else title)
+    if len(histogram):
+        axes.legend(loc="upper right")
+
+
+class ChartExporter:
+    # One off-screen figure reused for every export, so writing charts for
+    # many players needs neither a display nor more memory per chart
+    def __init__(self, size=FIGURE_SIZE):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        self.figure = Figure(figsize=size)
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+
+    def export(self, histogram, path):
+        # The format follows the extension (.png or .svg)
+        draw_rating_histogram(self.axes, histogram)
+        self.figure.savefig(path)
+        return path
+
+
+def export_rating_charts(pgn_files, output_dir=".", output_format="png", width=DEFAULT_BIN_WIDTH, player=None,
+                         index_cache=None):
+    # One chart per PGN, from the player's side (the most frequent player
+    # in each file unless given). Returns the paths written.
+    from game_index import open_index
+    os.makedirs(output_dir, exist_ok=True)
+    exporter = ChartExporter()
+    paths = []
+    for pgn_file in pgn_files:
+        index = index_cache.get(pgn_file) if index_cache is not None else open_index(pgn_file)
+        histogram = index.analyze("rating_histogram", player=player, width=width)
+        path = os.path.join(output_dir, f"{chart_name(pgn_file)}.rating.{output_format}")
+        paths.append(exporter.export(histogram, path))
+    return paths
+
+
+def chart_name(pgn_file):
+    # The file name without .pgn and a compression suffix, plus a hash of
+    # the full path so same-named files from different directories don't
+    # overwrite each other's charts
+    name = os.path.basename(pgn_file)
+    stem, extension = os.path.splitext(name)
+    if extension in (".gz", ".zst"):
+        name = stem
+    stem, extension = os.path.splitext(name)
+    if extension.lower() == ".pgn":
+        name = stem
+    return f"{name}-{hashlib.sha1(os.path.abspath(pgn_file).encode()).hexdigest()[:8]}"
+
+
+if __name__ == '__main__':
+    import cli
+
+    parser = argparse.ArgumentParser(description="Write rating distribution charts without a display")
+    cli.add_chart_arguments(parser)
+    cli.run_chart(parser.parse_args())
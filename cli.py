@@ -0,0 +1,256 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+
+import profiling
+
+# Every command imports what it needs when it runs, so `--help` and small
+# jobs never pay for numpy, python-chess, requests or matplotlib.
+DEFAULT_SOCKET = os.path.join(os.path.expanduser("~"), ".cache", "chess-analyzer", "daemon.sock")
+# Modules the daemon imports before taking jobs
+WARM_MODULES = ("analytics", "game_index", "reports", "query", "timeseries")
+# Indexes opened by jobs in this process; only set in the daemon, where
+# they outlive a job and later jobs reuse their cached results
+index_cache = None
+
+
+def add_download_arguments(parser):
+    parser.add_argument("username", nargs="?", help="chess.com username")
+    parser.add_argument("--compress", choices=("gzip", "zstd"), help="Write a compressed PGN")
+    parser.add_argument("--base-url", help="Games API to download from (default: $CHESS_ANALYZER_API or chess.com)")
+    profiling.add_arguments(parser)
+
+
+def run_download(args):
+    from script import download_games
+    username = args.username or input("Enter the username: ")
+    with profiling.profile_from_args(args):
+        download_games(username, args.compress, args.base_url)
+
+
+def add_analyze_arguments(parser, formats=("text", "json", "csv", "columnar"), default_format="text"):
+    parser.add_argument("pgn_file", nargs="?", default="file.pgn", help="Path to your PGN file")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes to parse with")
+    parser.add_argument("--index", action="store_true", help="Build or reuse the on-disk game index")
+    parser.add_argument("--clocks", action="store_true", help="Report think time from the clock comments")
+    parser.add_argument("--player", nargs="?", const="", default=None,
+                        help="Report results from this player's side (the most frequent player if no name is given)")
+    parser.add_argument("--format", choices=formats, default=default_format,
+                        help="Report format; csv and columnar write a directory of files")
+    parser.add_argument("--output", help="File (json) or directory (csv, columnar) to write the report to")
+    parser.add_argument("--include", action="append", default=[],
+                        choices=("results_timeline", "positional_analysis", "game_highlights", "time_usage"),
+                        help="Add a section to a json, csv or columnar report (repeatable)")
+    parser.add_argument("--quarantine", metavar="FILE", help="Write the malformed games that were skipped to FILE (JSON)")
+    parser.add_argument("--where", metavar="QUERY",
+                        help='Only games matching QUERY, e.g. "blitz black since:2023 rating:1800- eco:B result:win"')
+    profiling.add_arguments(parser)
+
+
+def add_report_arguments(parser):
+    add_analyze_arguments(parser, ("json", "csv", "columnar"), "json")
+
+
+def run_analyze(args):
+    import analytics
+    import query
+    try:
+        where = query.from_text(args.where)
+    except ValueError as error:
+        sys.exit(f"error: {error}")
+    with profiling.profile_from_args(args):
+        analytics.analyze_games(args.pgn_file, workers=args.workers, use_index=args.index, clocks=args.clocks,
+                                player=args.player, output_format=None if args.format == "text" else args.format,
+                                output=args.output, extra_metrics=args.include, quarantine_path=args.quarantine,
+                                where=where, index_cache=index_cache)
+
+
+def add_chart_arguments(parser):
+    parser.add_argument("pgn_files", nargs="+", help="PGN files, one chart each")
+    parser.add_argument("--player", help="Whose results to chart (default: the most frequent player in each file)")
+    parser.add_argument("--width", type=int, default=50, help="Rating bin width in Elo")
+    parser.add_argument("--format", choices=("png", "svg"), default="png", help="Image format")
+    parser.add_argument("--output-dir", default=".", help="Directory to write the charts to")
+    profiling.add_arguments(parser)
+
+
+def run_chart(args):
+    from charts import export_rating_charts
+    with profiling.profile_from_args(args):
+        for path in export_rating_charts(args.pgn_files, args.output_dir, args.format, args.width, args.player,
+                                         index_cache):
+            print(path)
+
+
+def add_gui_arguments(parser):
+    profiling.add_arguments(parser)
+
+
+def run_gui(args):
+    from est2 import ChessAnalyzerApp
+    with profiling.profile_from_args(args):
+        ChessAnalyzerApp().run()
+
+
+def add_serve_arguments(parser):
+    parser.add_argument("--stop", action="store_true", help="Stop the daemon listening on --socket")
+
+
+def run_serve(args):
+    if args.stop:
+        print(send_job(args.socket, {"stop": True})["stdout"], end="")
+        return
+    serve(args.socket)
+
+
+COMMANDS = {
+    "download": ("Download a player's games", add_download_arguments, run_download),
+    "analyze": ("Analyze a PGN file", add_analyze_arguments, run_analyze),
+    "report": ("Write a JSON, CSV or columnar report for a PGN file", add_report_arguments, run_analyze),
+    "chart": ("Write rating distribution charts (PNG or SVG) without a display", add_chart_arguments, run_chart),
+    "gui": ("Open the analyzer window", add_gui_arguments, run_gui),
+    "serve": ("Run a warm daemon that takes jobs from --daemon clients", add_serve_arguments, run_serve),
+}
+
+
+def default_address():
+    return os.environ.get("CHESS_ANALYZER_DAEMON") or DEFAULT_SOCKET
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Chess Pynalytics")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Run the command in the daemon started with `serve` instead of this process")
+    parser.add_argument("--socket", default=None, help=f"The daemon's Unix socket "
+                                                       f"(default: $CHESS_ANALYZER_DAEMON or {DEFAULT_SOCKET})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, (description, add_arguments, _) in COMMANDS.items():
+        add_arguments(commands.add_parser(name, help=description, description=description))
+    return parser
+
+
+def run(argv):
+    # Parses and runs one command line in this process; returns the exit status
+    parser = build_parser()
+    try:
+        args = parser.parse_args(argv)
+        args.socket = args.socket or default_address()
+        if args.daemon and args.command != "serve":
+            job_argv = [argument for argument in argv if argument != "--daemon"]
+            response = send_job(args.socket, {"argv": job_argv, "cwd": os.getcwd()})
+            sys.stdout.write(response["stdout"])
+            sys.stderr.write(response["stderr"])
+            return response["status"]
+        COMMANDS[args.command][2](args)
+    except SystemExit as exit:
+        if exit.code is None or isinstance(exit.code, int):
+            return exit.code or 0
+        print(exit.code, file=sys.stderr)
+        return 1
+    return 0
+
+
+def connect(address):
+    if not hasattr(socket, "AF_UNIX"):
+        sys.exit("error: the daemon needs Unix domain sockets, which this platform doesn't have")
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(address)
+    return client
+
+
+def send_job(address, job):
+    try:
+        client = connect(address)
+    except OSError as error:
+        sys.exit(f"error: no daemon at {address} ({error}); start one with `cli.py serve`")
+    with client, client.makefile("rwb") as stream:
+        stream.write(json.dumps(job).encode() + b"\n")
+        stream.flush()
+        return json.loads(stream.readline())
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    # One JSON job per connection: {"argv": [...], "cwd": ...} runs a
+    # command with its output captured; {"stop": true} shuts the daemon down
+    def handle(self):
+        job = json.loads(self.rfile.readline())
+        if job.get("stop"):
+            self.reply(0, "Daemon stopped\n", "")
+            self.server.stopping = True
+            return
+        stdout, stderr = io.StringIO(), io.StringIO()
+        previous_dir = os.getcwd()
+        try:
+            os.chdir(job.get("cwd") or previous_dir)
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    status = run(job["argv"])
+                except Exception:
+                    import traceback
+                    traceback.print_exc()
+                    status = 1
+        finally:
+            os.chdir(previous_dir)
+        self.reply(status, stdout.getvalue(), stderr.getvalue())
+
+    def reply(self, status, stdout, stderr):
+        self.wfile.write(json.dumps({"status": status, "stdout": stdout, "stderr": stderr}).encode() + b"\n")
+
+
+def make_server(address):
+    # Jobs run with the daemon owner's rights, so only a Unix socket that
+    # nobody else can connect to (mode 0600) is offered, never TCP
+    if not hasattr(socket, "AF_UNIX"):
+        sys.exit("error: the daemon needs Unix domain sockets, which this platform doesn't have")
+    if os.path.exists(address):
+        try:
+            connect(address).close()
+        except OSError:
+            # Left behind by a daemon that didn't shut down cleanly
+            os.remove(address)
+        else:
+            sys.exit(f"error: a daemon is already listening on {address}")
+    os.makedirs(os.path.dirname(address) or ".", mode=0o700, exist_ok=True)
+    # Created without group or other permissions, so there is no moment
+    # when another user could connect
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(address, JobHandler)
+    finally:
+        os.umask(umask)
+    os.chmod(address, 0o600)
+    return server
+
+
+def serve(address):
+    # Jobs run one at a time in this process, with the heavy modules already
+    # imported and game indexes kept open between jobs
+    global index_cache
+    import importlib
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+    from game_index import IndexCache
+    index_cache = IndexCache()
+    server = make_server(address)
+    server.stopping = False
+    print(f"Listening on {address}", file=sys.stderr)
+    try:
+        with server:
+            while not server.stopping:
+                server.handle_request()
+    finally:
+        if os.path.exists(address):
+            os.remove(address)
+
+
+def main(argv=None):
+    sys.exit(run(sys.argv[1:] if argv is None else argv))
+
+
+if __name__ == '__main__':
+    main()
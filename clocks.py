@@ -0,0 +1,180 @@
+import re
+from array import array
+
+import numpy as np
+
+CLOCK_REGEX = re.compile(r"\[%clk\s+(\d+):(\d+):([\d.]+)")
+# Think times are histogrammed at clock resolution (0.1s) up to an hour,
+# which keeps percentiles exact enough with bounded memory
+HISTOGRAM_RESOLUTION = 10
+HISTOGRAM_BINS = 3600 * HISTOGRAM_RESOLUTION + 1
+# Plies at which the middlegame and endgame start (after moves 10 and 30)
+PHASE_PLIES = (20, 60)
+PHASES = ("opening", "middlegame", "endgame")
+# A move is made in time trouble when less than this share of the base time is left
+TIME_TROUBLE_FRACTION = 0.1
+PERCENTILES = (10, 25, 50, 75, 90)
+BATCH_GAMES = 1000
+
+
+def clock_seconds(movetext):
+    # Clock comments in movetext order; chess.com PGNs have no variations,
+    # so this is the mainline sequence.
+    return [int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+            for hours, minutes, seconds in CLOCK_REGEX.findall(movetext)]
+
+
+def parse_time_control(time_control):
+    # "180+2" -> (180.0, 2.0). Daily ("1/86400") and unknown controls have
+    # no meaningful think time and give (nan, nan).
+    base, _, increment = (time_control or "").partition("+")
+    try:
+        return float(base), float(increment or 0)
+    except ValueError:
+        return float("nan"), float("nan")
+
+
+def think_times(clocks, offsets, bases, increments):
+    # Vectorized over every move of every game: clocks is the flat array of
+    # remaining time after each ply and offsets[i]:offsets[i + 1] the plies
+    # of game i. A player's think time is their previous remaining time
+    # (the base time for their first move) minus the current one, plus the
+    # increment. Returns (think, ply, remaining, base, game) for timed games.
+    clocks = np.asarray(clocks, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    game = np.repeat(np.arange(len(counts)), counts)
+    ply = np.arange(len(clocks)) - np.repeat(offsets[:-1] - offsets[0], counts)
+    base = np.asarray(bases, dtype=np.float64)[game]
+    increment = np.asarray(increments, dtype=np.float64)[game]
+
+    previous = base.copy()
+    later = np.flatnonzero(ply >= 2)
+    previous[later] = clocks[later - 2]
+    think = np.maximum(previous - clocks + increment, 0.0)
+
+    timed = ~np.isnan(base)
+    return think[timed], ply[timed], clocks[timed], base[timed], game[timed]
+
+
+class ClockStats:
+    # Mergeable think-time statistics with memory independent of the number
+    # of moves
+    def __init__(self):
+        self.games = 0
+        self.moves = 0
+        self.think_sum = 0
+        self.phase_sums = [0] * len(PHASES)
+        self.phase_moves = np.zeros(len(PHASES), dtype=np.int64)
+        self.trouble_moves = 0
+        self.trouble_games = 0
+        self.histogram = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+
+    def add_arrays(self, clocks, offsets, bases, increments):
+        think, ply, remaining, base, game = think_times(clocks, offsets, bases, increments)
+        if not think.size:
+            return
+        # Whole milliseconds keep the sums exact, so batches and shards can
+        # be combined in any order with identical results
+        think_ms = np.rint(think * 1000).astype(np.int64)
+        self.games += len(np.unique(game))
+        self.moves += think_ms.size
+        self.think_sum += int(think_ms.sum())
+        phase = np.searchsorted(PHASE_PLIES, ply, side="right")
+        for number in range(len(PHASES)):
+            self.phase_sums[number] += int(think_ms[phase == number].sum())
+        self.phase_moves += np.bincount(phase, minlength=len(PHASES))
+        trouble = remaining < base * TIME_TROUBLE_FRACTION
+        self.trouble_moves += int(np.count_nonzero(trouble))
+        self.trouble_games += len(np.unique(game[trouble]))
+        bins = np.minimum(think_ms * HISTOGRAM_RESOLUTION // 1000, HISTOGRAM_BINS - 1)
+        self.histogram += np.bincount(bins, minlength=HISTOGRAM_BINS)
+
+    def merge(self, other):
+        self.games += other.games
+        self.moves += other.moves
+        self.think_sum += other.think_sum
+        self.phase_sums = [mine + theirs for mine, theirs in zip(self.phase_sums, other.phase_sums)]
+        self.phase_moves += other.phase_moves
+        self.trouble_moves += other.trouble_moves
+        self.trouble_games += other.trouble_games
+        self.histogram += other.histogram
+
+    def percentiles(self):
+        if not self.moves:
+            return {percentile: 0 for percentile in PERCENTILES}
+        cumulative = np.cumsum(self.histogram)
+        ranks = np.ceil(np.array(PERCENTILES) / 100 * self.moves)
+        bins = np.searchsorted(cumulative, ranks)
+        return {percentile: float(bin_number) / HISTOGRAM_RESOLUTION
+                for percentile, bin_number in zip(PERCENTILES, bins.tolist())}
+
+    def result(self):
+        phase_moves = self.phase_moves.tolist()
+        return {
+            "games": self.games,
+            "moves": self.moves,
+            "average_think_time": self.think_sum / self.moves / 1000 if self.moves else 0,
+            "phase_average_think_time": {phase: total / moves / 1000 if moves else 0
+                                         for phase, total, moves in zip(PHASES, self.phase_sums, phase_moves)},
+            "time_trouble_moves": self.trouble_moves / self.moves if self.moves else 0,
+            "time_trouble_games": self.trouble_games / self.games if self.games else 0,
+            "think_time_percentiles": self.percentiles(),
+        }
+
+
+class ClockStatsAccumulator:
+    # Streaming-engine accumulator. Games are buffered and their clocks
+    # processed in vectorized batches of BATCH_GAMES.
+    needs_moves = False
+    needs_movetext = True
+
+    def __init__(self):
+        self.stats = ClockStats()
+        self.reset_batch()
+
+    def reset_batch(self):
+        self.clocks = array("d")
+        self.offsets = array("q", [0])
+        self.bases = array("d")
+        self.increments = array("d")
+
+    def add(self, game):
+        movetext = getattr(game, "movetext", None)
+        if movetext is None:
+            # A fully parsed python-chess game
+            movetext = " ".join(node.comment for node in game.mainline())
+        self.clocks.extend(clock_seconds(movetext))
+        self.offsets.append(len(self.clocks))
+        base, increment = parse_time_control(game.headers.get("TimeControl"))
+        self.bases.append(base)
+        self.increments.append(increment)
+        if len(self.bases) >= BATCH_GAMES:
+            self.flush()
+
+    def flush(self):
+        if len(self.bases):
+            self.stats.add_arrays(self.clocks, self.offsets, self.bases, self.increments)
+            self.reset_batch()
+
+    def merge(self, other):
+        self.flush()
+        other.flush()
+        self.stats.merge(other.stats)
+
+    def result(self):
+        self.flush()
+        return self.stats.result()
+
+
+def format_clock_stats(stats):
+    phases = ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in stats["phase_average_think_time"].items())
+    percentiles = ", ".join(f"p{percentile} {seconds:.1f}s"
+                            for percentile, seconds in stats["think_time_percentiles"].items())
+    return (
+        f"Average Think Time: {stats['average_think_time']:.2f}s over {stats['moves']} moves\n"
+        f"By Phase: {phases}\n"
+        f"Think Time Percentiles: {percentiles}\n"
+        f"Moves in Time Trouble: {stats['time_trouble_moves']:.1%}\n"
+        f"Games Reaching Time Trouble: {stats['time_trouble_games']:.1%}"
+    )
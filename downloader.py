@@ -0,0 +1,295 @@
+import codecs
+import email.utils
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import profiling
+
+API_URL = "https://api.chess.com/pub"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+DEFAULT_WORKERS = 8
+CHUNK_SIZE = 1 << 16
+SPOOL_SIZE = 1 << 20
+WRITE_BUFFER_SIZE = 1 << 20
+GAMES_ARRAY = re.compile(r'"games"\s*:\s*\[')
+
+
+def api_url():
+    # CHESS_ANALYZER_API points every download at another server, such as
+    # mock_api.py
+    return os.environ.get("CHESS_ANALYZER_API", API_URL).rstrip("/")
+
+
+class DownloadError(Exception):
+    pass
+
+
+class NoArchivesError(DownloadError):
+    pass
+
+
+def make_session(pool_size=DEFAULT_WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_with_retry(session, url, retries=5, backoff=0.5, timeout=30, headers=None, stream=False):
+    # Retries throttled (429) and server-side (5xx) responses and dropped
+    # connections with exponential backoff, honouring Retry-After.
+    for attempt in range(retries + 1):
+        profiling.count("http requests")
+        if attempt:
+            profiling.count("http retries")
+        try:
+            response = session.get(url, timeout=timeout, headers=headers, stream=stream)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            response.close()
+            # The backoff is a floor, so "Retry-After: 0" doesn't spend the
+            # retries at once
+            delay = max(retry_after_seconds(response.headers.get("Retry-After")), backoff * 2 ** attempt)
+        time.sleep(delay)
+
+
+def retry_after_seconds(value):
+    # Retry-After as seconds (whole or not) or an HTTP date; 0 when absent
+    # or unreadable
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0.0
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def fetch_archive_list(session, username, base_url=None):
+    base_url = base_url or api_url()
+    try:
+        with profiling.stage("download:archive list"):
+            response = get_with_retry(session, f"{base_url}/player/{username}/games/archives")
+    except requests.RequestException:
+        raise DownloadError("Failed to retrieve archives.")
+    if response.status_code != 200:
+        raise DownloadError("Failed to retrieve archives.")
+    profiling.count("http bytes", len(response.content))
+    try:
+        archives = response.json().get("archives", [])
+    except ValueError:
+        raise DownloadError("Failed to read the archive list.")
+    if not archives:
+        raise NoArchivesError("No game archives found.")
+    return archives
+
+
+def fetch_archive(session, archive_url, cache=None):
+    # Returns the archive body as a binary file, or None if it couldn't be
+    # fetched. Bodies are spooled to disk past SPOOL_SIZE so memory stays
+    # flat however large a month is.
+    with profiling.stage("download:fetch archive"):
+        return fetch_archive_body(session, archive_url, cache)
+
+
+def fetch_archive_body(session, archive_url, cache):
+    try:
+        if cache is not None:
+            return cache.fetch(lambda url, headers: get_with_retry(session, url, headers=headers, stream=True),
+                               archive_url)
+        with get_with_retry(session, archive_url, stream=True) as response:
+            if response.status_code != 200:
+                return None
+            body = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+            for chunk in response.iter_content(CHUNK_SIZE):
+                body.write(chunk)
+        profiling.count("http bytes", body.tell())
+        body.seek(0)
+        return body
+    except (requests.RequestException, OSError):
+        return None
+
+
+def iter_archive_pgns(body):
+    # Decodes the game objects of an archive one at a time from a binary
+    # file and yields their PGN, instead of loading the whole JSON document.
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = None
+    end_of_body = False
+    while True:
+        if position is None:
+            match = GAMES_ARRAY.search(buffer)
+            if match:
+                position = match.end()
+        else:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer):
+                if buffer[position] == "]":
+                    return
+                try:
+                    game, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # Only the start of the object has been read so far
+                    if end_of_body:
+                        raise
+                else:
+                    pgn = game.get("pgn")
+                    if pgn is not None:
+                        yield pgn
+                    continue
+        if end_of_body:
+            return
+        chunk = body.read(CHUNK_SIZE)
+        end_of_body = not chunk
+        if position is None:
+            buffer = buffer[-32:]
+        else:
+            buffer = buffer[position:]
+            position = 0
+        buffer += text_decoder.decode(chunk, final=end_of_body)
+
+
+def open_pgn_for_append(pgn_filename, append):
+    # .gz and .zst names are written compressed; appending adds a new
+    # gzip member / zstd frame, which the readers decode transparently.
+    mode = "a" if append else "w"
+    if pgn_filename.endswith(".gz"):
+        return gzip.open(pgn_filename, mode + "t", compresslevel=6)
+    if pgn_filename.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise DownloadError("Writing .zst files requires the zstandard package.")
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(pgn_filename, mode + "b")))
+    return open(pgn_filename, mode, buffering=WRITE_BUFFER_SIZE)
+
+
+def fetch_archives(session, archive_urls, workers=DEFAULT_WORKERS, cache=None):
+    # Yields (archive_url, body) in the order given while up to `workers`
+    # requests are in flight. body is None if the archive couldn't be fetched.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for archive_url in archive_urls:
+            pending.append((archive_url, executor.submit(fetch_archive, session, archive_url, cache)))
+            if len(pending) >= workers * 2:
+                archive_url, future = pending.popleft()
+                yield archive_url, future.result()
+        while pending:
+            archive_url, future = pending.popleft()
+            yield archive_url, future.result()
+
+
+def download_state_path(pgn_filename):
+    return pgn_filename + ".state.json"
+
+
+def load_download_state(pgn_filename):
+    # Games already written per archive URL, in download order
+    if not os.path.exists(pgn_filename):
+        return {}
+    try:
+        with open(download_state_path(pgn_filename)) as file:
+            return json.load(file).get("archives", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_download_state(pgn_filename, written):
+    with open(download_state_path(pgn_filename), "w") as file:
+        json.dump({"archives": written}, file)
+
+
+def pending_archives(archives, written):
+    # Monthly archives only grow while the month is open, so every archive
+    # before the most recent one written is complete. The most recent one is
+    # fetched again and the games already written are skipped. A month that
+    # failed on an earlier run is fetched now and so ends up in the PGN after
+    # the newer months, out of date order.
+    last_written = next((archive_url for archive_url in reversed(archives) if archive_url in written), None)
+    return [(archive_url, written.get(archive_url, 0)) for archive_url in archives
+            if archive_url not in written or archive_url == last_written]
+
+
+def write_archive(file, body, skip):
+    # Writes the archive's games after the first `skip` and returns how many
+    # games the archive holds. The games are spooled until the whole archive
+    # has been decoded, so a malformed one raises ValueError having written
+    # nothing.
+    games = 0
+    with tempfile.SpooledTemporaryFile(SPOOL_SIZE, mode="w+", encoding="utf-8") as spool:
+        for pgn in iter_archive_pgns(body):
+            games += 1
+            if games > skip:
+                spool.write(pgn + "\n\n")
+        spool.seek(0)
+        shutil.copyfileobj(spool, file, CHUNK_SIZE)
+    return games
+
+
+def download_games(username, pgn_filename=None, workers=DEFAULT_WORKERS, session=None,
+                   base_url=None, progress=None, cache=None):
+    # Fetches every pending monthly archive exactly once and appends the
+    # games to the PGN in chronological order, through the archive cache if
+    # one is given. progress(done, total, games) is called after each
+    # archive. base_url defaults to api_url(). Returns (pgn_filename, games
+    # written).
+    pgn_filename = pgn_filename or f"{username}_games.pgn"
+    session = session or make_session(workers)
+    archives = fetch_archive_list(session, username, base_url)
+
+    written = load_download_state(pgn_filename)
+    pending = pending_archives(archives, written)
+    downloaded_games = 0
+
+    # Append to what earlier runs wrote; start over if we don't know what that was
+    with open_pgn_for_append(pgn_filename, bool(written)) as file:
+        skips = dict(pending)
+        for done, (archive_url, body) in enumerate(fetch_archives(session, list(skips), workers, cache), 1):
+            skip = skips[archive_url]
+            games = None
+            if body is not None:
+                with body, profiling.stage("download:write archive"):
+                    try:
+                        games = write_archive(file, body, skip)
+                    except ValueError:
+                        # Malformed archive; it is fetched again on the next run
+                        pass
+            if games is not None:
+                downloaded_games += max(0, games - skip)
+                file.flush()
+                written[archive_url] = max(skip, games)
+                save_download_state(pgn_filename, written)
+            if progress is not None:
+                progress(done, len(skips), downloaded_games)
+
+    if cache is not None:
+        cache.flush()
+    profiling.count("games downloaded", downloaded_games)
+    return pgn_filename, downloaded_games
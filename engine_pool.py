@@ -0,0 +1,332 @@
+import argparse
+import math
+import os
+import queue
+import shlex
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import chess
+import chess.engine
+import chess.polyglot
+
+import analytics
+import profiling
+from opening_tree import san_moves
+from packed import start_board
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "chess-analyzer", "evals.sqlite3")
+DEFAULT_DEPTH = 12
+# Mates are stored as this many centipawns; losses are capped at MAX_SWING
+MATE_SCORE = 100000
+MAX_SWING = 1000
+# Centipawn losses at which a move counts as an inaccuracy, mistake or blunder
+INACCURACY, MISTAKE, BLUNDER = 50, 100, 300
+BATCH_GAMES = 200
+
+
+def engine_command():
+    # CHESS_ANALYZER_ENGINE, else a stockfish on the PATH
+    command = os.environ.get("CHESS_ANALYZER_ENGINE") or shutil.which("stockfish")
+    return shlex.split(command) if command else None
+
+
+def limit_key(limit):
+    return ",".join(f"{name}={value}" for name, value in (("depth", limit.depth), ("nodes", limit.nodes),
+                                                          ("time", limit.time)) if value is not None)
+
+
+def signed_key(key):
+    # sqlite integers are signed 64-bit
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class EvalCache:
+    # Evaluations on disk keyed by (Zobrist hash, search limit), as White's
+    # score in centipawns and the best move
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("CHESS_ANALYZER_EVALS", DEFAULT_CACHE_PATH)
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS evals (key INTEGER, search TEXT, score INTEGER, best TEXT, "
+            "PRIMARY KEY (key, search)) WITHOUT ROWID")
+
+    def get_many(self, keys, search):
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            chunk = [signed_key(key) for key in keys[start:start + 500]]
+            rows = self.connection.execute(
+                f"SELECT key, score, best FROM evals WHERE search = ? AND key IN ({','.join('?' * len(chunk))})",
+                [search] + chunk)
+            found.update((key % (1 << 64), (score, best)) for key, score, best in rows)
+        return found
+
+    def put_many(self, evals, search):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO evals VALUES (?, ?, ?, ?)",
+                [(signed_key(key), search, score, best) for key, (score, best) in evals.items()])
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class EnginePool:
+    # Long-lived UCI processes, one per worker thread. A search borrows an
+    # idle engine, so every engine stays busy while positions are queued.
+    def __init__(self, command, workers=None, limit=None):
+        self.limit = limit or chess.engine.Limit(depth=DEFAULT_DEPTH)
+        workers = workers or os.cpu_count() or 1
+        self.engines = [chess.engine.SimpleEngine.popen_uci(command) for _ in range(workers)]
+        self.idle = queue.Queue()
+        for engine in self.engines:
+            self.idle.put(engine)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.evaluated = 0
+        self.busy_time = 0.0
+
+    def analyse(self, fen):
+        engine = self.idle.get()
+        try:
+            info = engine.analyse(chess.Board(fen), self.limit)
+        finally:
+            self.idle.put(engine)
+        score = info["score"].white().score(mate_score=MATE_SCORE)
+        best = info["pv"][0].uci() if info.get("pv") else None
+        return score, best
+
+    def evaluate(self, positions):
+        # positions maps keys to FENs; returns keys to (score, best move)
+        start_time = time.perf_counter()
+        keys = list(positions)
+        with profiling.stage("engine:evaluate"):
+            results = dict(zip(keys, self.executor.map(self.analyse, (positions[key] for key in keys))))
+        self.busy_time += time.perf_counter() - start_time
+        profiling.count("engine positions", len(results))
+        self.evaluated += len(results)
+        return results
+
+    def positions_per_second(self):
+        return self.evaluated / self.busy_time if self.busy_time else 0.0
+
+    def close(self):
+        self.executor.shutdown()
+        for engine in self.engines:
+            try:
+                engine.quit()
+            except chess.engine.EngineError:
+                engine.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def terminal_score(board):
+    # White's score in a finished position, which needs no engine
+    if board.is_checkmate():
+        return -MATE_SCORE if board.turn == chess.WHITE else MATE_SCORE
+    return 0
+
+
+def win_percent(centipawns):
+    return 50 + 50 * (2 / (1 + math.exp(-0.00368208 * centipawns)) - 1)
+
+
+def move_accuracy(before, after):
+    # Accuracy of a move from the drop in the mover's winning chances
+    return max(0.0, min(100.0, 103.1668 * math.exp(-0.04354 * (win_percent(before) - win_percent(after))) - 3.1669))
+
+
+def game_positions(game):
+    # Mainline positions as (zobrist key, fen, finished) plus the colour
+    # that moved into each position after the first
+    movetext = getattr(game, "movetext", None)
+    board = start_board(game.headers)
+    positions = [(chess.polyglot.zobrist_hash(board), board.fen(), False)]
+    movers = []
+    if movetext is None:
+        moves = list(game.mainline_moves())
+    else:
+        moves = san_moves(movetext, None)
+    for move in moves:
+        movers.append(board.turn)
+        try:
+            board.push(move if isinstance(move, chess.Move) else board.parse_san(move))
+        except ValueError:
+            movers.pop()
+            break
+        positions.append((chess.polyglot.zobrist_hash(board), board.fen(), board.is_game_over()))
+    return positions, movers
+
+
+class AccuracyStats:
+    def __init__(self):
+        self.games = 0
+        self.moves = 0
+        self.centipawn_loss = 0
+        self.accuracy = 0.0
+        self.inaccuracies = 0
+        self.mistakes = 0
+        self.blunders = 0
+
+    def add_move(self, before, after):
+        # before/after are the mover's scores either side of the move
+        before = max(-MAX_SWING, min(MAX_SWING, before))
+        after = max(-MAX_SWING, min(MAX_SWING, after))
+        loss = max(0, before - after)
+        self.moves += 1
+        self.centipawn_loss += loss
+        self.accuracy += move_accuracy(before, after)
+        if loss >= BLUNDER:
+            self.blunders += 1
+        elif loss >= MISTAKE:
+            self.mistakes += 1
+        elif loss >= INACCURACY:
+            self.inaccuracies += 1
+
+    def result(self):
+        return {
+            "games": self.games,
+            "moves": self.moves,
+            "average_centipawn_loss": self.centipawn_loss / self.moves if self.moves else 0,
+            "accuracy": self.accuracy / self.moves if self.moves else 0,
+            "inaccuracies": self.inaccuracies,
+            "mistakes": self.mistakes,
+            "blunders": self.blunders,
+        }
+
+
+def analyze_accuracy(pgn_file, command, limit=None, workers=None, player=None, cache=None, progress=None,
+                     where=None):
+    # Evaluates every mainline position once: positions are deduplicated
+    # by Zobrist hash within each batch of games and looked up in the
+    # evaluation cache before anything is sent to the engines. With a
+    # player, only their moves are scored; with where (a query.GameFilter),
+    # only the matching games.
+    limit = limit or chess.engine.Limit(depth=DEFAULT_DEPTH)
+    search = limit_key(limit)
+    player = player.lower() if player else None
+    if where is not None:
+        where = where.resolve(pgn_file)
+    stats = AccuracyStats()
+    positions_seen = cached = 0
+    start_time = time.perf_counter()
+    own_cache = cache is None
+    cache = cache or EvalCache()
+    try:
+        with EnginePool(command, workers, limit) as pool, analytics.open_pgn(pgn_file) as file:
+            batch = []
+            for game in analytics.iter_movetext(file, where=where):
+                if player is None or player in (game.headers.get("White", "").lower(),
+                                                game.headers.get("Black", "").lower()):
+                    batch.append(game)
+                if len(batch) == BATCH_GAMES:
+                    seen, hits = score_batch(batch, pool, cache, search, player, stats)
+                    positions_seen += seen
+                    cached += hits
+                    batch = []
+                    if progress is not None:
+                        progress(stats.games)
+            if batch:
+                seen, hits = score_batch(batch, pool, cache, search, player, stats)
+                positions_seen += seen
+                cached += hits
+            if progress is not None:
+                progress(stats.games)
+            engine_rate = pool.positions_per_second()
+    finally:
+        if own_cache:
+            cache.close()
+    elapsed = time.perf_counter() - start_time
+    report = stats.result()
+    report.update({
+        "positions": positions_seen,
+        "cached": cached,
+        "evaluated": positions_seen - cached,
+        "engine_positions_per_second": engine_rate,
+        "positions_per_second": positions_seen / elapsed if elapsed else 0.0,
+    })
+    return report
+
+
+def score_batch(games, pool, cache, search, player, stats):
+    # Returns (unique positions, positions found in the cache)
+    per_game = [game_positions(game) for game in games]
+    scores = {}
+    pending = {}
+    for positions, _ in per_game:
+        for key, fen, finished in positions:
+            if finished:
+                scores[key] = terminal_score(chess.Board(fen))
+            elif key not in scores:
+                pending[key] = fen
+    for key in scores:
+        pending.pop(key, None)
+    unique = len(pending) + len(scores)
+    found = cache.get_many(pending, search)
+    missing = {key: fen for key, fen in pending.items() if key not in found}
+    profiling.count("eval cache hits", len(found))
+    profiling.count("eval cache misses", len(missing))
+    evaluated = pool.evaluate(missing)
+    cache.put_many(evaluated, search)
+    for key, (score, _) in list(found.items()) + list(evaluated.items()):
+        scores[key] = score
+
+    for game, (positions, movers) in zip(games, per_game):
+        stats.games += 1
+        white = game.headers.get("White", "").lower()
+        for ply, mover in enumerate(movers):
+            if player is not None and (white == player) != (mover == chess.WHITE):
+                continue
+            sign = 1 if mover == chess.WHITE else -1
+            stats.add_move(sign * scores[positions[ply][0]], sign * scores[positions[ply + 1][0]])
+    return unique, len(found)
+
+
+def format_accuracy(report):
+    return (
+        f"Games: {report['games']}\n"
+        f"Moves: {report['moves']}\n"
+        f"Accuracy: {report['accuracy']:.1f}%\n"
+        f"Average Centipawn Loss: {report['average_centipawn_loss']:.1f}\n"
+        f"Inaccuracies: {report['inaccuracies']}\n"
+        f"Mistakes: {report['mistakes']}\n"
+        f"Blunders: {report['blunders']}\n"
+        f"Positions: {report['positions']} ({report['cached']} cached, {report['evaluated']} evaluated)\n"
+        f"Engine Throughput: {report['engine_positions_per_second']:.0f} positions/sec"
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Score move accuracy with a pool of UCI engines")
+    parser.add_argument("pgn_file", help="Path to your PGN file")
+    parser.add_argument("--engine", help="UCI engine command (default: $CHESS_ANALYZER_ENGINE or stockfish)")
+    parser.add_argument("--depth", type=int, help=f"Search depth (default {DEFAULT_DEPTH} unless --nodes is given)")
+    parser.add_argument("--nodes", type=int, help="Nodes to search per position")
+    parser.add_argument("--workers", type=int, help="Engine processes to run (default: one per core)")
+    parser.add_argument("--player", help="Only score this player's moves")
+    parser.add_argument("--cache", help="Evaluation cache file")
+    args = parser.parse_args()
+
+    command = shlex.split(args.engine) if args.engine else engine_command()
+    if command is None:
+        parser.error("no UCI engine found; pass --engine or set CHESS_ANALYZER_ENGINE")
+    depth = args.depth if args.depth or args.nodes else DEFAULT_DEPTH
+    with EvalCache(args.cache) as cache:
+        report = analyze_accuracy(args.pgn_file, command, chess.engine.Limit(depth=depth, nodes=args.nodes),
+                                  args.workers, args.player, cache)
+    print(format_accuracy(report))
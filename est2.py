@@ -1,11 +1,23 @@
+import argparse
 import tkinter as tk
-from tkinter import filedialog, messagebox
-import requests
+from tkinter import filedialog, messagebox, simpledialog
 import os
+import threading
 import time
-import chess.pgn
-from analytics import *
-import matplotlib.pyplot as plt
+import profiling
+from tasks import TaskRunner
+
+PGN_FILETYPES = [("PGN Files", "*.pgn *.pgn.gz *.pgn.zst"), ("All Files", "*")]
+# Imported in the background once the window is up, so the first report
+# doesn't wait for numpy and python-chess. Requests, the engine pool and
+# matplotlib are only imported by the commands that use them.
+PRELOAD_MODULES = ("analytics", "game_index", "reports", "report_view", "query")
+
+
+def preload_modules():
+    import importlib
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
 
 
 class ChessAnalyzerApp(tk.Tk):
@@ -21,21 +33,28 @@ class ChessAnalyzerApp(tk.Tk):
         self.config(menu=menubar)
 
         file_menu = tk.Menu(menubar, tearoff=0)
+        file_menu.add_command(label="Open PGN...", command=self.open_dataset)
         file_menu.add_command(label="Download Games", command=self.download_games)
+        file_menu.add_command(label="Cancel Running Task", command=self.cancel_task)
         file_menu.add_separator()
-        file_menu.add_command(label="Exit", command=self.quit)
+        file_menu.add_command(label="Exit", command=self.on_close)
         menubar.add_cascade(label="File", menu=file_menu)
 
         analyze_menu = tk.Menu(menubar, tearoff=0)
+        analyze_menu.add_command(label="Filter Games...", command=self.filter_games)
+        analyze_menu.add_separator()
         analyze_menu.add_command(label="Analyze Games", command=self.analyze_games)
         analyze_menu.add_command(label="Rating Distribution", command=self.analyze_rating_distribution)
         analyze_menu.add_command(label="Performance Rating", command=self.analyze_performance_rating)
+        analyze_menu.add_command(label="Player Statistics", command=self.analyze_player_stats)
         analyze_menu.add_command(label="Common Openings", command=self.analyze_common_openings)
+        analyze_menu.add_command(label="Opening Explorer", command=self.explore_openings)
         analyze_menu.add_command(label="Average Move Time", command=self.analyze_time_usage)
         analyze_menu.add_command(label="Longest Winning Streak", command=self.analyze_winning_streaks)
         analyze_menu.add_command(label="Longest Losing Streak", command=self.analyze_losing_streaks)
         analyze_menu.add_command(label="Results Timeline", command=self.analyze_results_timeline)
         analyze_menu.add_command(label="Positional Analysis", command=self.analyze_positional_analysis)
+        analyze_menu.add_command(label="Move Accuracy", command=self.analyze_accuracy)
         analyze_menu.add_command(label="Game Highlights", command=self.analyze_game_highlighs)
         menubar.add_cascade(label="Analyze", menu=analyze_menu)
 
@@ -49,6 +68,15 @@ class ChessAnalyzerApp(tk.Tk):
         self.status_label = tk.Label(self, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
         self.status_label.pack(side=tk.BOTTOM, fill=tk.X)
 
+        self.tasks = TaskRunner(self, self.update_progress)
+        self.datasets = None
+        self.dataset_path = None
+        self.dataset_player = None
+        self.dataset_filter = None
+        self.chart_window = None
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.bind("<Escape>", lambda event: self.cancel_task())
+
         self.username_entry = tk.Entry(self, width=20)
         self.username_entry.insert(0, "Enter Username")
         self.username_entry.bind("<FocusIn>", self.on_entry_focus_in)
@@ -63,6 +91,7 @@ class ChessAnalyzerApp(tk.Tk):
             relief=tk.SOLID,
             bd=1,
         )
+        self.after_idle(lambda: threading.Thread(target=preload_modules, daemon=True).start())
 
     def show_about_dialog(self):
         about_text = (
@@ -108,273 +137,241 @@ class ChessAnalyzerApp(tk.Tk):
             messagebox.showwarning("Warning", "Please enter a username.")
             return
 
-        url = f"https://api.chess.com/pub/player/{username}/games/archives"
-        response = requests.get(url)
-        if response.status_code != 200:
-            messagebox.showerror("Error", "Failed to retrieve archives.")
+        def download(task):
+            with profiling.stage("gui:Download"):
+                return timed_download(task)
+
+        from archive_cache import ArchiveCache
+        from downloader import download_games as fetch_games
+
+        def timed_download(task):
+            start_time = time.time()
+            pgn_filename, downloaded_games = fetch_games(
+                username,
+                progress=lambda done, total, games: task.progress(games, done, total),
+                cache=ArchiveCache(),
+            )
+            return pgn_filename, time.time() - start_time
+
+        def done(result):
+            pgn_filename, elapsed_time = result
+            self.set_dataset(pgn_filename, username)
+            messagebox.showinfo("Info", f"All games retrieved and written to: {pgn_filename}")
+            messagebox.showinfo("Info", f"Time elapsed: {elapsed_time:.2f} seconds")
+
+        self.tasks.submit("Download", download, done, self.show_download_error)
+
+    def show_download_error(self, error):
+        from downloader import DownloadError, NoArchivesError
+        if isinstance(error, NoArchivesError):
+            messagebox.showinfo("Info", str(error))
+        elif isinstance(error, DownloadError):
+            messagebox.showerror("Error", str(error))
+        else:
+            self.show_task_error(error)
+
+    def show_task_error(self, error):
+        messagebox.showerror("Error", f"{type(error).__name__}: {error}")
+
+    def update_progress(self, task, finished):
+        if finished:
+            state = "cancelled" if task.cancelled else "done"
+            self.status_var.set(f"{task.name} {state}: {task.count} games ({task.rate():.0f} games/sec)")
             return
-
-        archives = response.json().get("archives", [])
-        if not archives:
-            messagebox.showinfo("Info", "No game archives found.")
+        if task.total:
+            progress = task.done / task.total * 100
+            progress_bar_length = 20
+            filled_length = int(progress_bar_length * task.done / task.total)
+            bar = "█" * filled_length + "-" * (progress_bar_length - filled_length)
+            self.status_var.set(f"{task.name}: [{bar}] {progress:.2f}% ({task.done}/{task.total}, "
+                                f"{task.count} games, {task.rate():.0f} games/sec)")
+        else:
+            self.status_var.set(f"{task.name}: {task.count} games ({task.rate():.0f} games/sec)")
+
+    def cancel_task(self):
+        self.tasks.cancel()
+
+    def on_close(self):
+        self.tasks.shutdown()
+        self.quit()
+
+    def open_dataset(self):
+        pgn_file_path = filedialog.askopenfilename(title="Select PGN File", filetypes=PGN_FILETYPES)
+        if pgn_file_path:
+            self.set_dataset(pgn_file_path)
+        return pgn_file_path
+
+    def set_dataset(self, pgn_file_path, player=None):
+        # Without a player, reports take the side of the most frequent one
+        self.dataset_path = pgn_file_path
+        self.dataset_player = player
+        self.dataset_filter = None
+        self.update_title()
+
+    def update_title(self):
+        title = f"Chess Pynalytics - {os.path.basename(self.dataset_path)}"
+        if self.dataset_filter is not None:
+            title += f" [{self.dataset_filter}]"
+        self.title(title)
+
+    def filter_games(self):
+        # Every report after this covers only the matching games
+        text = simpledialog.askstring(
+            "Filter Games", "Games to include, e.g. blitz black since:2023 rating:1800- eco:B result:win\n"
+                            "(leave blank for all games):",
+            initialvalue=str(self.dataset_filter or ""), parent=self)
+        if text is None:
             return
-
-        pgn_filename = f"{username}_games.pgn"
-        total_games = 0
-        downloaded_games = 0
-
-        start_time = time.time()
-
-        for archive_url in archives:
-            response = requests.get(archive_url)
-            if response.status_code == 200:
-                games = response.json().get("games", [])
-                total_games += len(games)
-
-        with open(pgn_filename, "w") as file:
-            for archive_url in archives:
-                response = requests.get(archive_url)
-                if response.status_code == 200:
-                    games = response.json().get("games", [])
-                    for game in games:
-                        pgn = game.get("pgn")
-                        if pgn is not None:
-                            file.write(pgn + "\n\n")
-                            downloaded_games += 1
-                            self.update_progress(downloaded_games, total_games)
-
-        elapsed_time = time.time() - start_time
-
-        messagebox.showinfo("Info", f"All games retrieved and written to: {pgn_filename}")
-        messagebox.showinfo("Info", f"Time elapsed: {elapsed_time:.2f} seconds")
-
-    def update_progress(self, downloaded, total):
-        progress = downloaded / total * 100
-        progress_bar_length = 20
-        filled_length = int(progress_bar_length * downloaded / total)
-        bar = "█" * filled_length + "-" * (progress_bar_length - filled_length)
-        self.status_var.set(f"Progress: [{bar}] {progress:.2f}% ({downloaded}/{total} games)")
-        self.update()
-
-    def analyze_games(self):
-        pgn_file_path = filedialog.askopenfilename(title="Select PGN File", filetypes=[("PGN Files", "*.pgn")])
-        if not pgn_file_path:
+        import query
+        try:
+            where = query.from_text(text)
+        except ValueError as error:
+            messagebox.showerror("Error", str(error))
             return
-
-        games = []
-        with open(pgn_file_path) as file:
-            while True:
-                game = chess.pgn.read_game(file)
-                if game is None:
-                    break
-                games.append(game)
-
-        win_count, loss_count, draw_count, total_games = analyze_win_loss(games)
-        rating_distribution = analyze_rating_distribution(games)
-        performance_rating = analyze_performance_rating(games)
-        common_openings = analyze_common_openings(games)
-        average_move_time = analyze_time_usage(games)
-        longest_winning_streak = analyze_winning_streaks(games)
-        longest_losing_streak = analyze_losing_streaks(games)
-        results_timeline = analyze_results_timeline(games)
-        positional_analysis = analyze_positional_analysis(games)
-        game_highlights = analyze_game_highlights(games)
-
-        messagebox.showinfo("Win-Loss Ratio",
-                            f"Wins: {win_count}\nLosses: {loss_count}\nDraws: {draw_count}\nTotal Games: {total_games}")
-        messagebox.showinfo("Rating Distribution", str(rating_distribution))
-        messagebox.showinfo("Performance Rating", f"Performance Rating: {performance_rating}")
-        messagebox.showinfo("Most Common Openings", str(common_openings))
-        messagebox.showinfo("Average Move Time", f"Average Move Time: {average_move_time}")
-        messagebox.showinfo("Winning/Losing Streaks",
-                            f"Longest Winning Streak: {longest_winning_streak}\nLongest Losing Streak: {longest_losing_streak}")
-        messagebox.showinfo("Game Results Timeline", str(results_timeline))
-        messagebox.showinfo("Positional Analysis", str(positional_analysis))
-        messagebox.showinfo("Game Highlights", "\n".join(game_highlights))
-
-    def analyze_rating_distribution(self):
-        pgn_file_path = filedialog.askopenfilename(title="Select PGN File", filetypes=[("PGN Files", "*.pgn")])
+        if where is not None and self.dataset_player and not where.player:
+            where = where.with_player(self.dataset_player)
+        self.dataset_filter = where
+        if self.dataset_path:
+            self.update_title()
+
+    def run_analysis(self, name, work, done):
+        # Runs work(games, task) in the background on the active dataset's
+        # index, asking for a PGN only if none is open yet, and hands the
+        # result to done()
+        pgn_file_path = self.dataset_path or self.open_dataset()
         if not pgn_file_path:
             return
+        if self.datasets is None:
+            from game_index import IndexCache
+            self.datasets = IndexCache()
 
-        games = []
-        with open(pgn_file_path) as file:
-            while True:
-                game = chess.pgn.read_game(file)
-                if game is None:
-                    break
-                games.append(game)
-
-        win_ratings = []
-        loss_ratings = []
-
-        for game in games:
-            white_rating = int(game.headers.get("WhiteElo", 0))
-            black_rating = int(game.headers.get("BlackElo", 0))
-            result = game.headers.get("Result")
-            if result == "1-0":
-                win_ratings.append(white_rating)
-            elif result == "0-1":
-                loss_ratings.append(black_rating)
-
-        # Count win distribution in increments of 50 Elo
-        win_counts = Counter((rating // 50) * 50 for rating in win_ratings)
-
-        # Count loss distribution in increments of 50 Elo
-        loss_counts = Counter((rating // 50) * 50 for rating in loss_ratings)
-
-        # Create graph for wins
-        win_x = list(win_counts.keys())
-        win_y = list(win_counts.values())
-        plt.bar(win_x, win_y, width=40, color='green')
-
-        # Create graph for losses (inverted)
-        loss_x = list(loss_counts.keys())
-        loss_y = [-count for count in loss_counts.values()]
-        plt.bar(loss_x, loss_y, width=40, color='red')
-
-        # Set y-axis limits
-        max_count = max(max(win_y), max(loss_y))
-        plt.ylim(-max_count, max_count)
-        plt.xlabel("Rating (Elo)")
-        plt.ylabel("Count")
-        plt.title("Win and Loss Distribution by Rating")
-        plt.show()
+        def analyze(task):
+            with profiling.stage("gui:" + name):
+                games = self.datasets.get(pgn_file_path, progress=task.progress).select(self.dataset_filter)
+                return work(games, task)
 
-    def analyze_performance_rating(self):
-        pgn_file_path = filedialog.askopenfilename(title="Select PGN File", filetypes=[("PGN Files", "*.pgn")])
-        if not pgn_file_path:
-            return
+        self.tasks.submit(name, analyze, done, self.show_task_error)
 
-        games = []
-        with open(pgn_file_path) as file:
-            while True:
-                game = chess.pgn.read_game(file)
-                if game is None:
-                    break
-                games.append(game)
+    def analyze_games(self):
+        from reports import REPORT_METRICS, build_report
+
+        def work(games, task):
+            return build_report(games, REPORT_METRICS, workers=os.cpu_count() or 1, progress=task.progress,
+                                options={"player_stats": {"player": self.dataset_player}})
+
+        self.run_analysis("Analyze Games", work, lambda report: self.show_report(report, "Analyze Games"))
+
+    def show_report(self, report, title):
+        from report_view import ReportWindow
+        ReportWindow(self, report, title, self.tasks)
+
+    def run_report(self, name, metric):
+        # One metric in the paged report view
+        from reports import build_report
+        self.run_analysis(name, lambda games, task: build_report(games, (metric,), progress=task.progress),
+                          lambda report: self.show_report(report, name))
+
+    def analyze_rating_distribution(self, width=None):
+        # Histograms are cached on the dataset's index per player and bin
+        # width, so redrawing one already seen costs nothing
+        from charts import DEFAULT_BIN_WIDTH
+        width = width or DEFAULT_BIN_WIDTH
+        self.run_analysis("Rating Distribution",
+                          lambda games, task: games.analyze("rating_histogram", player=self.dataset_player,
+                                                            width=width),
+                          self.show_rating_chart)
+
+    def show_rating_chart(self, histogram):
+        # One chart window, redrawn in place
+        from chart_view import RatingChartWindow
+        if self.chart_window is None or not self.chart_window.winfo_exists():
+            self.chart_window = RatingChartWindow(self, on_width=self.analyze_rating_distribution)
+        self.chart_window.show(histogram)
 
-        performance_rating = analyze_performance_rating(games)
-        messagebox.showinfo("Rating Distribution", str(performance_rating))
+    def analyze_performance_rating(self):
+        from analytics import analyze_performance_rating
+        self.run_analysis("Performance Rating",
+                          lambda games, task: analyze_performance_rating(games),
+                          lambda performance_rating: messagebox.showinfo("Rating Distribution", str(performance_rating)))
+
+    def analyze_player_stats(self):
+        from players import format_player_stats
+        self.run_analysis("Player Statistics",
+                          lambda games, task: games.analyze("player_stats", player=self.dataset_player),
+                          lambda player_stats: messagebox.showinfo("Player Statistics",
+                                                                   format_player_stats(player_stats)))
 
     def analyze_common_openings(self):
-        pgn_file_path = filedialog.askopenfilename(title="Select PGN File", filetypes=[("PGN Files", "*.pgn")])
-        if not pgn_file_path:
+        self.run_report("Common Openings", "common_openings")
+
+    def explore_openings(self):
+        moves = simpledialog.askstring("Opening Explorer", "Moves to the position (e.g. e4 c5), blank for the start:",
+                                       parent=self)
+        if moves is None:
             return
+        from opening_tree import format_lookup, open_opening_tree
 
-        games = []
-        with open(pgn_file_path) as file:
-            while True:
-                game = chess.pgn.read_game(file)
-                if game is None:
-                    break
-                games.append(game)
+        def work(games, task):
+            player = games.player_games(self.dataset_player).player
+            tree = open_opening_tree(games.pgn_file, player=player, progress=task.progress, where=games.where)
+            return format_lookup(tree.lookup(moves.split()))
 
-        common_openings = analyze_common_openings(games)
-        messagebox.showinfo("Most Common Openings", str(common_openings))
+        self.run_analysis("Opening Explorer", work, lambda text: messagebox.showinfo("Opening Explorer", text))
 
     def analyze_time_usage(self):
-        pgn_file_path = filedialog.askopenfilename(title="Select PGN File", filetypes=[("PGN Files", "*.pgn")])
-        if not pgn_file_path:
-            return
-
-        games = []
-        with open(pgn_file_path) as file:
-            while True:
-                game = chess.pgn.read_game(file)
-                if game is None:
-                    break
-                games.append(game)
-
-        average_move_time = analyze_time_usage(games)
-        messagebox.showinfo("Average Move Time", f"Average Move Time: {average_move_time}")
+        from clocks import format_clock_stats
+        self.run_analysis("Average Move Time",
+                          lambda games, task: games.analyze("clock_stats", progress=task.progress),
+                          lambda clock_stats: messagebox.showinfo("Average Move Time", format_clock_stats(clock_stats)))
 
     def analyze_winning_streaks(self):
-        pgn_file_path = filedialog.askopenfilename(title="Select PGN File", filetypes=[("PGN Files", "*.pgn")])
-        if not pgn_file_path:
-            return
-
-        games = []
-        with open(pgn_file_path) as file:
-            while True:
-                game = chess.pgn.read_game(file)
-                if game is None:
-                    break
-                games.append(game)
-
-        longest_winning_streak = analyze_winning_streaks(games)
-        messagebox.showinfo("Winning Streaks",
-                            f"Longest Winning Streak: {longest_winning_streak}")
+        from analytics import analyze_winning_streaks
+        self.run_analysis("Longest Winning Streak",
+                          lambda games, task: analyze_winning_streaks(games),
+                          lambda longest_winning_streak: messagebox.showinfo(
+                              "Winning Streaks", f"Longest Winning Streak: {longest_winning_streak}"))
 
     def analyze_losing_streaks(self):
-        pgn_file_path = filedialog.askopenfilename(title="Select PGN File", filetypes=[("PGN Files", "*.pgn")])
-        if not pgn_file_path:
-            return
-
-        games = []
-        with open(pgn_file_path) as file:
-            while True:
-                game = chess.pgn.read_game(file)
-                if game is None:
-                    break
-                games.append(game)
-
-        longest_losing_streak = analyze_losing_streaks(games)
-        messagebox.showinfo("Losing Streaks",
-                            f"Longest Losing Streak: {longest_losing_streak}")
+        from analytics import analyze_losing_streaks
+        self.run_analysis("Longest Losing Streak",
+                          lambda games, task: analyze_losing_streaks(games),
+                          lambda longest_losing_streak: messagebox.showinfo(
+                              "Losing Streaks", f"Longest Losing Streak: {longest_losing_streak}"))
 
     def analyze_results_timeline(self):
-        pgn_file_path = filedialog.askopenfilename(title="Select PGN File", filetypes=[("PGN Files", "*.pgn")])
-        if not pgn_file_path:
-            return
-
-        games = []
-        with open(pgn_file_path) as file:
-            while True:
-                game = chess.pgn.read_game(file)
-                if game is None:
-                    break
-                games.append(game)
-
-        results_timeline = analyze_results_timeline(games)
-        messagebox.showinfo("Game Results Timeline", str(results_timeline))
+        self.run_report("Results Timeline", "results_timeline")
 
     def analyze_positional_analysis(self):
-        pgn_file_path = filedialog.askopenfilename(title="Select PGN File", filetypes=[("PGN Files", "*.pgn")])
-        if not pgn_file_path:
+        self.run_report("Positional Analysis", "positional_analysis")
+
+    def analyze_accuracy(self):
+        from engine_pool import analyze_accuracy, engine_command, format_accuracy
+        command = engine_command()
+        if command is None:
+            messagebox.showerror("Error", "No UCI engine found. Install stockfish or set CHESS_ANALYZER_ENGINE.")
             return
 
-        games = []
-        with open(pgn_file_path) as file:
-            while True:
-                game = chess.pgn.read_game(file)
-                if game is None:
-                    break
-                games.append(game)
+        def work(games, task):
+            player = games.player_games(self.dataset_player).player
+            return analyze_accuracy(games.pgn_file, command, player=player, progress=task.progress,
+                                    where=games.where)
 
-        positional_analysis = analyze_positional_analysis(games)
-        messagebox.showinfo("Positional Analysis", str(positional_analysis))
+        self.run_analysis("Move Accuracy", work,
+                          lambda report: messagebox.showinfo("Move Accuracy", format_accuracy(report)))
 
     def analyze_game_highlighs(self):
-        pgn_file_path = filedialog.askopenfilename(title="Select PGN File", filetypes=[("PGN Files", "*.pgn")])
-        if not pgn_file_path:
-            return
-
-        games = []
-        with open(pgn_file_path) as file:
-            while True:
-                game = chess.pgn.read_game(file)
-                if game is None:
-                    break
-                games.append(game)
-
-        game_highlights = analyze_game_highlights(games)
-        messagebox.showinfo("Game Highlights", "\n".join(game_highlights))
+        self.run_report("Game Highlights", "game_highlights")
 
     def run(self):
         self.mainloop()
 
 
 if __name__ == "__main__":
-    app = ChessAnalyzerApp()
-    app.run()
+    parser = argparse.ArgumentParser(description="Chess Pynalytics")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+
+    # With --profile the breakdown covers everything done until the window closes
+    with profiling.profile_from_args(args):
+        app = ChessAnalyzerApp()
+        app.run()
@@ -0,0 +1,591 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from array import array
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+import analytics
+import profiling
+from charts import DEFAULT_BIN_WIDTH, RatingHistogram
+from clocks import ClockStats, clock_seconds, parse_time_control
+from ingest import Quarantine, scan_games
+from players import PlayerGames, game_date, parse_dates, white_scores
+from timeseries import Timeline
+
+# Bump whenever the column layout changes so stale indexes get rebuilt
+FORMAT_VERSION = 7
+HASH_BLOCK_SIZE = 1 << 16
+DEFAULT_CACHE_BYTES = 1 << 30
+
+CATEGORY_COLUMNS = ("result", "eco", "opening", "date", "time_control", "white", "black")
+NUMBER_COLUMNS = ("white_elo", "black_elo")
+# Accumulators kept alongside the columns and carried forward on append
+AGGREGATE_METRICS = (
+    "win_loss",
+    "rating_distribution",
+    "performance_rating",
+    "common_openings",
+    "winning_streak",
+    "losing_streak",
+    "positional_analysis",
+)
+
+
+def index_path_for(pgn_file):
+    return pgn_file + ".index"
+
+
+def block_hash(pgn_file, start, end):
+    with open(pgn_file, "rb") as file:
+        file.seek(start)
+        return hashlib.sha1(file.read(end - start)).hexdigest()
+
+
+def file_key(pgn_file, size=None):
+    # Key for the first `size` bytes of the file (all of it by default).
+    # The edge hash lets an index recognise a file that was only appended to.
+    stat = os.stat(pgn_file)
+    size = stat.st_size if size is None else size
+    return {
+        "version": FORMAT_VERSION,
+        "pgn_file": os.path.abspath(pgn_file),
+        "size": size,
+        "mtime_ns": stat.st_mtime_ns,
+        "head_hash": block_hash(pgn_file, 0, min(size, HASH_BLOCK_SIZE)),
+        "edge_hash": block_hash(pgn_file, max(0, size - HASH_BLOCK_SIZE), size),
+    }
+
+
+class IndexBuilder:
+    def __init__(self, tables=None, aggregates=None, quarantine=None):
+        tables = tables or {name: [] for name in CATEGORY_COLUMNS}
+        self.categories = {name: {value: code for code, value in enumerate(tables[name])}
+                           for name in CATEGORY_COLUMNS}
+        self.codes = {name: array("i") for name in CATEGORY_COLUMNS}
+        self.numbers = {name: array("i") for name in NUMBER_COLUMNS}
+        self.clocks = array("d")
+        self.clock_offsets = array("q")
+        self.aggregates = aggregates or analytics.make_accumulators(AGGREGATE_METRICS)
+        self.quarantine = Quarantine.from_result(quarantine)
+        self.aggregate_adders = [accumulator.add for accumulator in self.aggregates.values()]
+
+    def encode(self, name, value):
+        table = self.categories[name]
+        code = table.get(value)
+        if code is None:
+            code = table[value] = len(table)
+        self.codes[name].append(code)
+
+    def add(self, headers, movetext):
+        self.encode("result", headers["Result"])
+        self.encode("eco", headers.get("ECO", ""))
+        self.encode("opening", headers.get("Opening", ""))
+        self.encode("date", game_date(headers))
+        self.encode("time_control", headers.get("TimeControl", ""))
+        self.encode("white", headers.get("White", "?"))
+        self.encode("black", headers.get("Black", "?"))
+        self.numbers["white_elo"].append(headers["WhiteElo"])
+        self.numbers["black_elo"].append(headers["BlackElo"])
+        self.clocks.extend(clock_seconds(movetext))
+        self.clock_offsets.append(len(self.clocks))
+        game = analytics.HeaderOnlyGame(headers)
+        for add in self.aggregate_adders:
+            add(game)
+
+    def add_file(self, file, progress=None):
+        for headers, movetext in scan_games(file, keep_movetext=True, quarantine=self.quarantine):
+            self.add(headers, movetext)
+            if progress is not None and len(self.clock_offsets) % analytics.PROGRESS_EVERY == 0:
+                progress(len(self.clock_offsets))
+        if progress is not None:
+            progress(len(self.clock_offsets))
+        return len(self.clock_offsets)
+
+    def columns(self, clocks_before=0):
+        columns = {name: np.frombuffer(codes, dtype=np.int32) for name, codes in self.codes.items()}
+        columns.update((name, np.frombuffer(numbers, dtype=np.int32)) for name, numbers in self.numbers.items())
+        columns["clocks"] = np.frombuffer(self.clocks, dtype=np.float64)
+        # End offset of each game's clocks; the full column starts with a 0
+        columns["clock_offsets"] = np.frombuffer(self.clock_offsets, dtype=np.int64) + clocks_before
+        return columns
+
+    def tables(self):
+        return {name: list(table) for name, table in self.categories.items()}
+
+
+def build_index(pgn_file, index_path=None, progress=None):
+    index_path = index_path or index_path_for(pgn_file)
+    meta = file_key(pgn_file)
+    builder = IndexBuilder()
+    with analytics.open_pgn(pgn_file) as file:
+        meta["num_games"] = builder.add_file(file, progress)
+    columns = builder.columns()
+    columns["clock_offsets"] = np.concatenate(([0], columns["clock_offsets"]))
+    meta["num_clocks"] = len(columns["clocks"])
+    meta["tables"] = builder.tables()
+    meta["quarantine"] = builder.quarantine.result()
+    write_index(index_path, meta, columns, builder.aggregates)
+    return load_index(pgn_file, index_path)
+
+
+def update_index(pgn_file, index_path=None, progress=None):
+    # Parses only what was appended since the index was written, or returns
+    # None when the file changed in any other way. Until the new meta is
+    # written the index still describes the old file, so rows left behind by
+    # an interrupted update are cut off and written again on the next one.
+    index_path = index_path or index_path_for(pgn_file)
+    meta = read_meta(index_path)
+    size = os.path.getsize(pgn_file)
+    if meta is None or meta.get("version") != FORMAT_VERSION or size <= meta["size"]:
+        return None
+    # Byte offsets into a compressed file don't point at games; rebuild those
+    if analytics.compression(pgn_file) is not None:
+        return None
+    key = file_key(pgn_file, meta["size"])
+    if any(meta.get(field) != key[field] for field in ("pgn_file", "head_hash", "edge_hash")):
+        return None
+    aggregates = read_aggregates(index_path, meta["num_games"])
+    if aggregates is None:
+        return None
+
+    builder = IndexBuilder(meta["tables"], aggregates, meta.get("quarantine"))
+    with analytics.open_shard(pgn_file, meta["size"], size) as file:
+        new_games = builder.add_file(file, progress)
+    rows = dict.fromkeys(builder.columns(), meta["num_games"])
+    rows.update(clocks=meta["num_clocks"], clock_offsets=meta["num_games"] + 1)
+    for name, column in builder.columns(meta["num_clocks"]).items():
+        append_column(os.path.join(index_path, name + ".npy"), column, rows[name])
+
+    meta.update(file_key(pgn_file))
+    meta["num_games"] += new_games
+    meta["num_clocks"] += len(builder.clocks)
+    meta["tables"] = builder.tables()
+    meta["quarantine"] = builder.quarantine.result()
+    write_aggregates(index_path, builder.aggregates, meta["num_games"])
+    write_meta(index_path, meta)
+    return load_index(pgn_file, index_path)
+
+
+def append_column(path, values, rows):
+    # Writes values after the first rows of the column, dropping anything
+    # past them. np.save leaves room in the header for the length to grow,
+    # so the new rows are written in place and only the shape in the header
+    # changes.
+    with open(path, "r+b") as file:
+        if np.lib.format.read_magic(file) == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(file)
+            header_length = file.tell()
+            header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+                np.lib.format.dtype_to_descr(dtype), rows + len(values))
+            header = header.ljust(header_length - 11) + "\n"
+            if shape[0] >= rows and len(header) == header_length - 10:
+                file.seek(header_length + rows * dtype.itemsize)
+                file.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+                file.truncate()
+                file.seek(10)
+                file.write(header.encode("latin1"))
+                return
+    column = np.load(path)
+    np.save(path, np.concatenate((column[:rows], values)))
+
+
+def write_index(index_path, meta, columns, aggregates):
+    # Written next to the final location and swapped in, so readers never
+    # see a half-written index
+    parent = os.path.dirname(os.path.abspath(index_path))
+    temp_path = tempfile.mkdtemp(prefix=".index-", dir=parent)
+    try:
+        for name, column in columns.items():
+            np.save(os.path.join(temp_path, name + ".npy"), column)
+        write_aggregates(temp_path, aggregates, meta["num_games"])
+        write_meta(temp_path, meta)
+        if os.path.isdir(index_path):
+            shutil.rmtree(index_path)
+        os.rename(temp_path, index_path)
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+
+
+def write_meta(index_path, meta):
+    temp_file = os.path.join(index_path, "meta.json.tmp")
+    with open(temp_file, "w") as file:
+        json.dump(meta, file)
+    os.replace(temp_file, os.path.join(index_path, "meta.json"))
+
+
+def write_aggregates(index_path, aggregates, num_games):
+    # Plain JSON, never a pickle: an index sits next to downloaded data and
+    # is loaded by the daemon. Stored with the number of games covered, so
+    # aggregates written by an update that never got to write its meta are
+    # not used.
+    data = {"num_games": num_games,
+            "metrics": {metric: aggregate_state(accumulator) for metric, accumulator in aggregates.items()}}
+    temp_file = os.path.join(index_path, "aggregates.json.tmp")
+    with open(temp_file, "w") as file:
+        json.dump(data, file)
+    os.replace(temp_file, os.path.join(index_path, "aggregates.json"))
+
+
+def read_aggregates(index_path, num_games):
+    try:
+        with open(os.path.join(index_path, "aggregates.json")) as file:
+            data = json.load(file)
+        if data["num_games"] != num_games or data["metrics"].keys() != set(AGGREGATE_METRICS):
+            return None
+        aggregates = {metric: restore_aggregate(metric, data["metrics"][metric]) for metric in AGGREGATE_METRICS}
+    except (OSError, ValueError, TypeError, KeyError, AttributeError):
+        return None
+    return None if None in aggregates.values() else aggregates
+
+
+def aggregate_state(accumulator):
+    # An accumulator's attributes as JSON data. Counters become [key, count]
+    # pairs so int keys and their order survive.
+    return {name: [[key, count] for key, count in value.items()] if isinstance(value, Counter) else value
+            for name, value in vars(accumulator).items()}
+
+
+def restore_aggregate(metric, state):
+    # The accumulator saved by aggregate_state, or None when the stored
+    # attributes don't match what the accumulator has now
+    accumulator = analytics.METRICS[metric]()
+    fields = vars(accumulator)
+    if state.keys() != fields.keys():
+        return None
+    for name, default in fields.items():
+        value = state[name]
+        if isinstance(default, Counter):
+            value = Counter({key: count for key, count in value})
+        elif type(value) is not type(default):
+            return None
+        fields[name] = value
+    return accumulator
+
+
+def read_meta(index_path):
+    try:
+        with open(os.path.join(index_path, "meta.json")) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def load_index(pgn_file, index_path=None):
+    index_path = index_path or index_path_for(pgn_file)
+    meta = read_meta(index_path)
+    if meta is None:
+        return None
+    key = file_key(pgn_file)
+    if any(meta.get(field) != value for field, value in key.items()):
+        return None
+    return GameIndex(pgn_file, index_path, meta)
+
+
+def open_index(pgn_file, index_path=None, progress=None):
+    with profiling.stage("index:load"):
+        index = load_index(pgn_file, index_path)
+    if index is None:
+        with profiling.stage("index:update"):
+            index = update_index(pgn_file, index_path, progress)
+    if index is None:
+        with profiling.stage("index:build"):
+            index = build_index(pgn_file, index_path, progress)
+    return index
+
+
+def load_column(index_path, name):
+    path = os.path.join(index_path, name + ".npy")
+    if os.path.getsize(path) <= 128:
+        # Empty arrays cannot be memory-mapped
+        return np.load(path)
+    return np.load(path, mmap_mode="r")
+
+
+def first_seen_counter(codes, table=None):
+    # Counter ordered by first occurrence, like counting game by game
+    uniques, first_index, counts = np.unique(codes, return_index=True, return_counts=True)
+    order = np.argsort(first_index, kind="stable")
+    keys = uniques[order].tolist()
+    if table is not None:
+        keys = [table[key] for key in keys]
+    return Counter(dict(zip(keys, counts[order].tolist())))
+
+
+def longest_broken_run(mask):
+    # Longest run of True that is followed by a False (open runs don't count)
+    breaks = np.flatnonzero(~mask)
+    if not breaks.size:
+        return 0
+    previous = np.concatenate(([-1], breaks[:-1]))
+    return int((breaks - previous - 1).max())
+
+
+class GameIndex:
+    is_game_index = True
+    # The query.GameFilter this index is narrowed to; None for every game
+    where = None
+
+    def __init__(self, pgn_file, index_path, meta):
+        self.pgn_file = pgn_file
+        self.index_path = index_path
+        self.meta = meta
+        self.tables = meta["tables"]
+        self.columns = {}
+        self.aggregates = None
+        self.results = {}
+
+    def __len__(self):
+        return self.meta["num_games"]
+
+    def column(self, name):
+        if name not in self.columns:
+            self.columns[name] = load_column(self.index_path, name)
+        return self.columns[name]
+
+    def code(self, name, value):
+        try:
+            return self.tables[name].index(value)
+        except ValueError:
+            return -1
+
+    def mask(self, name, value):
+        return self.column(name) == self.code(name, value)
+
+    def values(self, name):
+        return np.asarray(self.tables[name], dtype=object)[self.column(name)].tolist()
+
+    def game_clocks(self, game_number):
+        offsets = self.column("clock_offsets")
+        return self.column("clocks")[offsets[game_number]:offsets[game_number + 1]]
+
+    def player_games(self, player=None):
+        # The player's games as arrays, built once per player from the columns
+        key = ("player_games", player)
+        if key not in self.results:
+            self.results[key] = PlayerGames.from_columns(
+                player,
+                self.column("white"), self.tables["white"],
+                self.column("black"), self.tables["black"],
+                self.column("white_elo"), self.column("black_elo"),
+                white_scores(self.tables["result"])[self.column("result")],
+                parse_dates(self.tables["date"])[self.column("date")],
+            )
+        return self.results[key]
+
+    def quarantine(self):
+        # Games left out of the index, and fields repaired while building it
+        return Quarantine.from_result(self.meta.get("quarantine"))
+
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def analyze(self, metric, progress=None, **options):
+        # Results are kept for the life of the index, so asking again is free
+        key = (metric, tuple(sorted(options.items())))
+        if key not in self.results:
+            profiling.count("index result misses")
+            with profiling.stage("index:" + metric):
+                self.results[key] = self.compute(metric, progress, **options)
+        else:
+            profiling.count("index result hits")
+        return self.results[key]
+
+    def compute(self, metric, progress=None, **options):
+        if metric in AGGREGATE_METRICS and not options:
+            if self.aggregates is None:
+                self.aggregates = read_aggregates(self.index_path, self.meta["num_games"]) or {}
+            if metric in self.aggregates:
+                return self.aggregates[metric].result()
+        if metric in INDEX_METRICS:
+            return INDEX_METRICS[metric](self, **options)
+        # Move-level metrics are not indexed; stream the PGN for those
+        accumulators = {metric: analytics.METRICS[metric](**options)}
+        with analytics.open_pgn(self.pgn_file) as file:
+            games = analytics.reader_for(accumulators)(file, where=self.where)
+            return analytics.run_accumulators(games, accumulators, progress)[metric]
+
+    def report(self, metrics=analytics.DEFAULT_METRICS, workers=1, progress=None, options=None):
+        # Metrics that need the PGN are computed together in one pass
+        options = options or {}
+        keys = {metric: (metric, tuple(sorted(options.get(metric, {}).items()))) for metric in metrics}
+        missing = [metric for metric in metrics if metric not in INDEX_METRICS and keys[metric] not in self.results]
+        if missing:
+            report = analytics.analyze_file(self.pgn_file, missing, workers=workers, progress=progress, options=options,
+                                            where=self.where)
+            self.results.update((keys[metric], result) for metric, result in report.items())
+        return {metric: self.analyze(metric, **options.get(metric, {})) for metric in metrics}
+
+    def select(self, where):
+        # The games matching a query.GameFilter, as an index over the same
+        # files. Selections are kept like results, so reusing a filter across
+        # reports costs nothing after the first.
+        if where is None:
+            return self
+        where = where.resolve(self)
+        key = ("select", where)
+        if key not in self.results:
+            with profiling.stage("index:select"):
+                self.results[key] = GameSelection(self, where)
+        return self.results[key]
+
+
+class GameSelection(GameIndex):
+    # Columns are the parent's masked to the selected games; the aggregates
+    # stored with the index cover every game, so they are not used
+    def __init__(self, index, where):
+        super().__init__(index.pgn_file, index.index_path, index.meta)
+        self.index = index
+        self.where = where
+        self.selected = where.mask(index)
+        self.aggregates = {}
+
+    def __len__(self):
+        return int(np.count_nonzero(self.selected))
+
+    def column(self, name):
+        if name not in self.columns:
+            if name in ("clocks", "clock_offsets"):
+                offsets = self.index.column("clock_offsets")
+                counts = np.diff(offsets)
+                moves = np.repeat(self.selected, counts)
+                self.columns["clocks"] = self.index.column("clocks")[moves]
+                self.columns["clock_offsets"] = np.concatenate(([0], np.cumsum(counts[self.selected])))
+            else:
+                self.columns[name] = self.index.column(name)[self.selected]
+        return self.columns[name]
+
+    def quarantine(self):
+        return self.index.quarantine()
+
+    def select(self, where):
+        return self.index.select(where)
+
+
+class IndexCache:
+    # Indexes opened during a session, keyed by path, mtime and size. The
+    # least recently used are dropped once their loaded columns exceed
+    # max_bytes; the most recent one is always kept.
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.indexes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, pgn_file, progress=None):
+        stat = os.stat(pgn_file)
+        key = (os.path.abspath(pgn_file), stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            index = self.indexes.get(key)
+            if index is not None:
+                self.indexes.move_to_end(key)
+                profiling.count("index cache hits")
+                return index
+        profiling.count("index cache misses")
+        index = open_index(pgn_file, progress=progress)
+        with self.lock:
+            for stale_key in [other for other in self.indexes if other[0] == key[0]]:
+                del self.indexes[stale_key]
+            self.indexes[key] = index
+            while len(self.indexes) > 1 and sum(index.nbytes() for index in self.indexes.values()) > self.max_bytes:
+                self.indexes.popitem(last=False)
+        return index
+
+
+def index_win_loss(index):
+    return (
+        int(np.count_nonzero(index.mask("result", "1-0"))),
+        int(np.count_nonzero(index.mask("result", "0-1"))),
+        int(np.count_nonzero(index.mask("result", "1/2-1/2"))),
+        len(index),
+    )
+
+
+def index_rating_distribution(index):
+    ratings = np.column_stack((index.column("white_elo"), index.column("black_elo"))).ravel()
+    return first_seen_counter(ratings)
+
+
+def index_performance_rating(index):
+    white_rating = index.column("white_elo").astype(np.int64)
+    black_rating = index.column("black_elo").astype(np.int64)
+    wins = index.mask("result", "1-0")
+    losses = index.mask("result", "0-1")
+    draws = index.mask("result", "1/2-1/2")
+    rating_sum = int(white_rating[wins].sum() + black_rating[losses].sum()
+                     + ((white_rating[draws] + black_rating[draws]) // 2).sum())
+    rating_count = int(np.count_nonzero(wins | losses | draws))
+    if not rating_count:
+        return 0
+    if rating_sum % rating_count == 0:
+        return rating_sum // rating_count
+    return rating_sum / rating_count
+
+
+def index_common_openings(index, top_n=25):
+    eco = index.column("eco")
+    eco = eco[eco != index.code("eco", "")]
+    return first_seen_counter(eco, index.tables["eco"]).most_common(top_n)
+
+
+def index_time_usage(index):
+    # Summed in whole milliseconds, as TimeUsageAccumulator does
+    clocks = index.column("clocks")
+    return int(np.rint(clocks * 1000).astype(np.int64).sum()) / clocks.size / 1000 if clocks.size else 0
+
+
+def index_clock_stats(index):
+    time_controls = np.array([parse_time_control(time_control) for time_control in index.tables["time_control"]])
+    time_controls = time_controls.reshape(-1, 2)[index.column("time_control")]
+    stats = ClockStats()
+    stats.add_arrays(index.column("clocks"), index.column("clock_offsets"), time_controls[:, 0], time_controls[:, 1])
+    return stats.result()
+
+
+def index_player_stats(index, player=None):
+    return index.player_games(player).summary()
+
+
+def index_timeline(index, player=None):
+    return Timeline.from_player_games(index.player_games(player))
+
+
+def index_rating_histogram(index, player=None, width=DEFAULT_BIN_WIDTH):
+    return RatingHistogram.from_player_games(index.player_games(player), width)
+
+
+def index_winning_streak(index):
+    return longest_broken_run(index.mask("result", "1-0"))
+
+
+def index_losing_streak(index):
+    return longest_broken_run(index.mask("result", "0-1"))
+
+
+def index_results_timeline(index):
+    return list(zip(index.values("result"), index.values("date")))
+
+
+def index_positional_analysis(index):
+    return first_seen_counter(index.column("opening"), index.tables["opening"])
+
+
+INDEX_METRICS = {
+    "win_loss": index_win_loss,
+    "rating_distribution": index_rating_distribution,
+    "performance_rating": index_performance_rating,
+    "common_openings": index_common_openings,
+    "time_usage": index_time_usage,
+    "clock_stats": index_clock_stats,
+    "player_stats": index_player_stats,
+    "timeline": index_timeline,
+    "rating_histogram": index_rating_histogram,
+    "winning_streak": index_winning_streak,
+    "losing_streak": index_losing_streak,
+    "results_timeline": index_results_timeline,
+    "positional_analysis": index_positional_analysis,
+}
@@ -0,0 +1,212 @@
+import io
+import re
+from collections import Counter
+
+# Tags python-chess fills in for every game, so header-only records look the same
+ROSTER_DEFAULTS = {
+    "Event": "?",
+    "Site": "?",
+    "Date": "????.??.??",
+    "Round": "?",
+    "White": "?",
+    "Black": "?",
+    "Result": "*",
+}
+TAG_REGEX = re.compile(rb'\[([A-Za-z0-9][A-Za-z0-9_+#=:-]*)\s+"([^\r\n]*)"\][ \t\r]*$')
+TAG_LINES = re.compile("^" + TAG_REGEX.pattern.decode(), re.MULTILINE)
+# Tag, escape and blank lines at the start of a game
+HEADER_BLOCK = re.compile(rb"(?:[ \t\r]*\n|[\[%;][^\n]*(?:\n|$))*")
+CHUNK_SIZE = 1 << 20
+RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+RESULT_ALIASES = {"1/2": "1/2-1/2", "½-½": "1/2-1/2", "0.5-0.5": "1/2-1/2", "1-0 ": "1-0", "0-1 ": "0-1"}
+UNKNOWN_ELO = {"", "?", "-"}
+DATE_REGEX = re.compile(r"^(\d{4}|\?{4})[.\-/](\d{2}|\?{2})[.\-/](\d{2}|\?{2})$")
+MAX_SAMPLES = 100
+
+
+class Quarantine:
+    # Games left out of the analysis, counted by reason with the headers of
+    # the first few, plus counts of fields that were repaired in place
+    def __init__(self):
+        self.reasons = Counter()
+        self.normalized = Counter()
+        self.samples = []
+
+    @classmethod
+    def from_result(cls, result):
+        quarantine = cls()
+        if result:
+            quarantine.reasons.update(result["reasons"])
+            quarantine.normalized.update(result["normalized"])
+            quarantine.samples = list(result["samples"])
+        return quarantine
+
+    def add(self, reason, headers):
+        self.reasons[reason] += 1
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append({"reason": reason, "headers": {key: str(value) for key, value in headers.items()}})
+
+    def merge(self, other):
+        self.reasons.update(other.reasons)
+        self.normalized.update(other.normalized)
+        self.samples.extend(other.samples[:MAX_SAMPLES - len(self.samples)])
+
+    def __len__(self):
+        return sum(self.reasons.values())
+
+    def result(self):
+        return {"quarantined": len(self), "reasons": dict(self.reasons), "normalized": dict(self.normalized),
+                "samples": self.samples}
+
+
+def parse_elo(value):
+    # Returns the rating, 0 when unknown, or None when it isn't a rating
+    if isinstance(value, int):
+        return value
+    if value.isdigit():
+        return int(value)
+    value = value.strip()
+    if value in UNKNOWN_ELO:
+        return 0
+    if value.isdigit():
+        return int(value)
+    return None
+
+
+def normalize_headers(headers, quarantine, typed=True):
+    # Validates and repairs headers in place, once, so metrics can read
+    # them without checks: Result is one of RESULTS, Date is YYYY.MM.DD
+    # (with ?? for unknown parts) and WhiteElo/BlackElo are ints (0 when
+    # unknown; digit strings when not typed, for python-chess headers).
+    # Returns the reason to quarantine the game, or None.
+    white = headers.get("WhiteElo")
+    black = headers.get("BlackElo")
+    date = headers.get("Date")
+    # Well-formed games, which is nearly all of them, take one test
+    if (type(white) is str and white.isdigit() and type(black) is str and black.isdigit()
+            and headers.get("Result") in RESULTS and date is not None and len(date) == 10 and date[4] == "."
+            and date[7] == "." and ROSTER_DEFAULTS.keys() <= headers.keys()):
+        if typed:
+            headers["WhiteElo"] = int(white)
+            headers["BlackElo"] = int(black)
+        return None
+    return repair_headers(headers, quarantine, typed)
+
+
+def repair_headers(headers, quarantine, typed):
+    if not ROSTER_DEFAULTS.keys() <= headers.keys():
+        for tag, default in ROSTER_DEFAULTS.items():
+            if tag not in headers:
+                headers[tag] = default
+                if tag == "Result":
+                    quarantine.normalized["missing result"] += 1
+    result = headers["Result"]
+    if result not in RESULTS:
+        if result.strip() in RESULTS or result in RESULT_ALIASES:
+            headers["Result"] = RESULT_ALIASES.get(result, result.strip())
+            quarantine.normalized["result"] += 1
+        else:
+            return "bad result"
+    for tag in ("WhiteElo", "BlackElo"):
+        value = headers.get(tag, "")
+        elo = parse_elo(value)
+        if elo is None:
+            return "bad elo"
+        if tag in headers and isinstance(value, str) and value.strip() in UNKNOWN_ELO:
+            quarantine.normalized["unknown elo"] += 1
+        headers[tag] = elo if typed else str(elo)
+    date = headers["Date"]
+    if len(date) != 10 or date[4] != "." or date[7] != ".":
+        match = DATE_REGEX.match(date)
+        headers["Date"] = ".".join(match.groups()) if match else ROSTER_DEFAULTS["Date"]
+        quarantine.normalized["date"] += 1
+    return None
+
+
+def binary_stream(file):
+    # The bytes under a PGN opened in text or binary mode. Text files are
+    # read through their underlying buffer, so movetext is never decoded
+    # unless it is kept.
+    buffer = getattr(file, "buffer", None)
+    if buffer is not None:
+        return buffer
+    if isinstance(file.read(0), bytes):
+        return file
+    return io.BytesIO(file.read().encode())
+
+
+def find_next_game(data, start):
+    # Offset of the first tag line at or after start, or None
+    position = max(start - 1, 0)
+    while True:
+        position = data.find(b"\n[", position)
+        if position < 0:
+            return None
+        line_end = data.find(b"\n", position + 1)
+        if TAG_REGEX.match(data, position + 1, len(data) if line_end < 0 else line_end):
+            return position + 1
+        position += 1
+
+
+def split_games(file, chunk_size=CHUNK_SIZE, offsets=False):
+    # Yields (tag section, movetext) as bytes for each game, or with offsets
+    # (byte offset, tag section, movetext), the offset counted from where
+    # the stream was when the scan started. A game's tag section runs until
+    # the first line that isn't a tag, blank or escaped; the next tag line
+    # after that starts the next game.
+    stream = binary_stream(file)
+    data = b""
+    consumed = 0
+    eof = False
+    while not eof:
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        data += chunk
+        position = 0
+        while position < len(data):
+            header_end = HEADER_BLOCK.match(data, position).end()
+            if header_end == len(data) and not eof:
+                break
+            boundary = find_next_game(data, header_end)
+            if boundary is None:
+                if not eof:
+                    break
+                boundary = len(data)
+            header, movetext = data[position:header_end], data[header_end:boundary]
+            if movetext or b"[" in header:
+                yield (consumed + position, header, movetext) if offsets else (header, movetext)
+            position = boundary
+        consumed += position
+        data = data[position:]
+
+
+def scan_games(file, keep_movetext=False, quarantine=None, offsets=False):
+    # Byte-level scan that never tokenizes movetext: games are split on tag
+    # lines that follow movetext and each tag section is parsed with one
+    # regex. Yields (headers, movetext) with normalized headers and movetext
+    # as one string (None unless kept), with offsets (byte offset, headers,
+    # movetext). Games that fail validation go to quarantine instead.
+    quarantine = Quarantine() if quarantine is None else quarantine
+    for offset, header, movetext in split_games(file, offsets=True):
+        header = header.decode("utf-8", "replace")
+        tags = TAG_LINES.findall(header)
+        headers = dict(tags)
+        bad_tags = header.count("\n[") + header.startswith("[") - len(tags)
+        if bad_tags:
+            # Malformed tags are ignored, like python-chess does
+            quarantine.normalized["malformed tag"] += bad_tags
+        reason = normalize_headers(headers, quarantine) if headers else "no tags"
+        if reason is None:
+            movetext = movetext.decode("utf-8", "replace") if keep_movetext else None
+            yield (offset, headers, movetext) if offsets else (headers, movetext)
+        else:
+            quarantine.add(reason, headers)
+
+
+def format_quarantine(result):
+    lines = [f"Skipped {result['quarantined']} malformed games"
+             + (": " + ", ".join(f"{reason} {count}" for reason, count in result["reasons"].items())
+                if result["reasons"] else "")]
+    if result["normalized"]:
+        lines.append("Repaired: " + ", ".join(f"{field} {count}" for field, count in result["normalized"].items()))
+    return "\n".join(lines)
@@ -0,0 +1,248 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ARCHIVES_PATH = re.compile(r"^/pub/player/([^/]+)/games/archives$")
+MONTH_PATH = re.compile(r"^/pub/player/([^/]+)/games/(\d{4})/(\d{2})$")
+
+
+# The first plies of every synthetic game; longer games shuffle knights
+OPENING_PLIES = ("e4", "e5")
+SHUFFLE_PLIES = (("Nf3", "Nf6"), ("Ng1", "Ng8"))
+FIXTURE_NAME = re.compile(r"^(\d{4})-(\d{2})\.json$")
+
+
+def synthetic_movetext(plies):
+    # Legal moves with a clock comment each; plies sets the payload size
+    tokens = []
+    for ply in range(plies):
+        number, black = ply // 2 + 1, ply % 2
+        if ply < len(OPENING_PLIES):
+            san = OPENING_PLIES[ply]
+        else:
+            san = SHUFFLE_PLIES[(ply - len(OPENING_PLIES)) // 2 % 2][black]
+        seconds = max((178.1 if black else 179.9) - ply // 2, 0)
+        clock = f"{{[%clk 0:{int(seconds) // 60:02d}:{seconds % 60:04.1f}]}}"
+        tokens.append(f"{number}{'...' if black else '.'} {san} {clock}")
+    return " ".join(tokens)
+
+
+def synthetic_pgn(username, year, month, number, rng, plies=2):
+    white, black = (username, f"opponent{number}") if number % 2 else (f"opponent{number}", username)
+    result = rng.choice(["1-0", "0-1", "1/2-1/2"])
+    return (
+        f'[Event "Live Chess"]\n'
+        f'[Site "Chess.com"]\n'
+        f'[Date "{year}.{month:02d}.{number % 28 + 1:02d}"]\n'
+        f'[Round "-"]\n'
+        f'[White "{white}"]\n'
+        f'[Black "{black}"]\n'
+        f'[Result "{result}"]\n'
+        f'[WhiteElo "{rng.randint(800, 2400)}"]\n'
+        f'[BlackElo "{rng.randint(800, 2400)}"]\n'
+        f'[TimeControl "180"]\n'
+        f'[ECO "C50"]\n'
+        f'\n{synthetic_movetext(plies)} {result}'
+    )
+
+
+def record_fixtures(username, directory, base_url=None):
+    # Saves a player's monthly archives as served, one file per month, for
+    # MockGamesAPI(fixtures=directory) to replay
+    import downloader
+    session = downloader.make_session()
+    player_dir = os.path.join(directory, username.lower())
+    os.makedirs(player_dir, exist_ok=True)
+    archives = downloader.fetch_archive_list(session, username, base_url)
+    for archive_url in archives:
+        response = downloader.get_with_retry(session, archive_url)
+        if response.status_code != 200:
+            raise downloader.DownloadError(f"Failed to retrieve {archive_url}.")
+        year, month = archive_url.rstrip("/").split("/")[-2:]
+        with open(os.path.join(player_dir, f"{year}-{month}.json"), "wb") as file:
+            file.write(response.content)
+    return len(archives)
+
+
+class MockGamesAPI:
+    # Stand-in for the chess.com published-data API serving monthly
+    # archives: synthetic ones, or recorded ones for players that have a
+    # fixtures/<username>/YYYY-MM.json directory. Latency, payload size (plies
+    # per game) and throttling are configurable: throttle answers that
+    # share of requests with 429, and rate_limit answers 429 to requests past
+    # that many per second. Throttled responses carry Retry-After.
+    def __init__(self, months=12, games_per_month=50, latency=0.0, start_year=2020, host="127.0.0.1", port=0,
+                 plies=2, throttle=0.0, rate_limit=None, retry_after=1, fixtures=None, seed=0):
+        self.months = months
+        self.games_per_month = games_per_month
+        self.latency = latency
+        self.start_year = start_year
+        self.plies = plies
+        self.throttle = throttle
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.fixtures = fixtures
+        self.rng = random.Random(seed)
+        self.recent = deque()
+        self.bodies = {}
+        self.requests = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/pub"
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = self.throttled = self.bytes_sent = 0
+            self.recent.clear()
+
+    def month_list(self, username):
+        player_dir = self.fixture_dir(username)
+        if player_dir is not None:
+            matches = (FIXTURE_NAME.match(name) for name in sorted(os.listdir(player_dir)))
+            return [(int(match.group(1)), int(match.group(2))) for match in matches if match]
+        return [(self.start_year + month // 12, month % 12 + 1) for month in range(self.months)]
+
+    def fixture_dir(self, username):
+        if self.fixtures is None:
+            return None
+        player_dir = os.path.join(self.fixtures, username.lower())
+        return player_dir if os.path.isdir(player_dir) else None
+
+    def archives(self, username):
+        return {"archives": [f"{self.base_url}/player/{username}/games/{year}/{month:02d}"
+                             for year, month in self.month_list(username)]}
+
+    def month_games(self, username, year, month):
+        player_dir = self.fixture_dir(username)
+        if player_dir is not None:
+            with open(os.path.join(player_dir, f"{year}-{month:02d}.json"), "rb") as file:
+                return file.read()
+        rng = random.Random(f"{username}/{year}/{month}")
+        return json.dumps({"games": [{"pgn": synthetic_pgn(username, year, month, number, rng, self.plies)}
+                                     for number in range(self.games_per_month)]}).encode()
+
+    def respond(self, path):
+        # (status, body bytes); month bodies are built once and reused
+        match = ARCHIVES_PATH.match(path)
+        if match:
+            return 200, json.dumps(self.archives(match.group(1))).encode()
+        match = MONTH_PATH.match(path)
+        if match and (int(match.group(2)), int(match.group(3))) in self.month_list(match.group(1)):
+            if path not in self.bodies:
+                self.bodies[path] = self.month_games(match.group(1), int(match.group(2)), int(match.group(3)))
+            return 200, self.bodies[path]
+        return 404, json.dumps({"code": 0, "message": "Not found"}).encode()
+
+    def is_throttled(self):
+        with self.lock:
+            self.requests += 1
+            if self.throttle and self.rng.random() < self.throttle:
+                self.throttled += 1
+                return True
+            if self.rate_limit:
+                now = time.monotonic()
+                while self.recent and self.recent[0] <= now - 1:
+                    self.recent.popleft()
+                if len(self.recent) >= self.rate_limit:
+                    self.throttled += 1
+                    return True
+                self.recent.append(now)
+            return False
+
+    def stats(self):
+        return {"requests": self.requests, "throttled": self.throttled, "bytes_sent": self.bytes_sent}
+
+    def handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if api.is_throttled():
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(api.retry_after))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if api.latency:
+                    time.sleep(api.latency)
+                status, data = api.respond(self.path)
+                etag = '"%s"' % hashlib.sha1(data).hexdigest()
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if status == 200:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(data)
+                with api.lock:
+                    api.bytes_sent += len(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve synthetic or recorded game archives locally")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--games-per-month", type=int, default=50)
+    parser.add_argument("--plies", type=int, default=2, help="Moves per synthetic game, for the payload size")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument("--throttle", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--rate-limit", type=int, help="Requests per second before answering 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--fixtures", help="Directory of recorded archives (<username>/YYYY-MM.json) to serve")
+    parser.add_argument("--record", metavar="USERNAME", help="Record USERNAME's archives into --fixtures and exit")
+    parser.add_argument("--base-url", help="API to record from (default: $CHESS_ANALYZER_API or chess.com)")
+    args = parser.parse_args()
+
+    if args.record:
+        if not args.fixtures:
+            parser.error("--record needs --fixtures")
+        print(f"Recorded {record_fixtures(args.record, args.fixtures, args.base_url)} archives")
+    else:
+        api = MockGamesAPI(args.months, args.games_per_month, args.latency, port=args.port, plies=args.plies,
+                           throttle=args.throttle, rate_limit=args.rate_limit, retry_after=args.retry_after,
+                           fixtures=args.fixtures)
+        print(f"Serving on {api.base_url}")
+        api.server.serve_forever()
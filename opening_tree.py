@@ -0,0 +1,291 @@
+import argparse
+import json
+import os
+from array import array
+
+import chess
+import chess.polyglot
+import numpy as np
+
+from packed import MOVETEXT_REGEX, decode_move, encode_move, start_board
+from players import WHITE_SCORES
+
+FORMAT_VERSION = 2
+DEFAULT_PLIES = 20
+# (position, SAN) -> (next position, move) entries kept per accumulator.
+# Games share their openings, so most plies are answered from here without
+# touching a board.
+MEMO_SIZE = 1 << 18
+# Parent key of the row recording a game's starting position
+NO_PARENT = 0
+LOSS, DRAW, WIN, UNFINISHED = 0, 1, 2, -1
+
+
+def san_moves(movetext, max_plies):
+    # The first max_plies SAN moves of the mainline; variations are skipped
+    moves = []
+    depth = 0
+    for match in MOVETEXT_REGEX.finditer(movetext):
+        _, opening, closing, san = match.groups()
+        if opening:
+            depth += 1
+        elif closing:
+            depth = max(depth - 1, 0)
+        elif san and not depth:
+            moves.append(san)
+            if len(moves) == max_plies:
+                break
+    return moves
+
+
+def group_counts(inverse, outcomes, size):
+    # games, wins, draws, losses per group as an (size, 4) array
+    return np.column_stack([np.bincount(inverse, minlength=size)]
+                           + [np.bincount(inverse[outcomes == outcome], minlength=size)
+                              for outcome in (WIN, DRAW, LOSS)]).astype(np.int32)
+
+
+def stats_dict(counts):
+    games, wins, draws, losses = counts.tolist()
+    finished = wins + draws + losses
+    return {"games": games, "wins": wins, "draws": draws, "losses": losses,
+            "score": (wins + draws / 2) / finished if finished else None}
+
+
+class OpeningTree:
+    # Positions reached in the first max_plies of every game, keyed by
+    # Zobrist hash so transpositions share a node. Nodes and edges are
+    # sorted arrays: finding a position or its continuations is a binary
+    # search. Results are from White's side, or the player's if one was set.
+    def __init__(self, node_keys, node_counts, edge_parents, edge_moves, edge_counts, max_plies, player=None):
+        self.node_keys = node_keys
+        self.node_counts = node_counts
+        self.edge_parents = edge_parents
+        self.edge_moves = edge_moves
+        self.edge_counts = edge_counts
+        self.max_plies = max_plies
+        self.player = player
+
+    def __len__(self):
+        return len(self.node_keys)
+
+    @classmethod
+    def from_rows(cls, parents, moves, children, outcomes, max_plies, player=None):
+        node_keys, inverse = np.unique(children, return_inverse=True)
+        node_counts = group_counts(inverse, outcomes, len(node_keys))
+
+        played = parents != NO_PARENT
+        parents, moves, outcomes = parents[played], moves[played], outcomes[played]
+        order = np.lexsort((moves, parents))
+        parents, moves, outcomes = parents[order], moves[order], outcomes[order]
+        first = np.concatenate(([True], (parents[1:] != parents[:-1]) | (moves[1:] != moves[:-1])))
+        starts = np.flatnonzero(first)
+        edge_counts = group_counts(np.cumsum(first) - 1, outcomes, len(starts))
+        return cls(node_keys, node_counts, parents[starts], moves[starts], edge_counts, max_plies, player)
+
+    def save(self, path, source=None):
+        meta = {"version": FORMAT_VERSION, "max_plies": self.max_plies, "player": self.player, "source": source}
+        temp_file = path + ".tmp"
+        with open(temp_file, "wb") as file:
+            np.savez(file, node_keys=self.node_keys, node_counts=self.node_counts, edge_parents=self.edge_parents,
+                     edge_moves=self.edge_moves, edge_counts=self.edge_counts, meta=np.array(json.dumps(meta)))
+        os.replace(temp_file, path)
+
+    @classmethod
+    def load(cls, path):
+        # Returns (tree, meta), or (None, None) for a missing or stale file
+        try:
+            with np.load(path) as data:
+                meta = json.loads(str(data["meta"]))
+                if meta.get("version") != FORMAT_VERSION:
+                    return None, None
+                tree = cls(data["node_keys"], data["node_counts"], data["edge_parents"], data["edge_moves"],
+                           data["edge_counts"], meta["max_plies"], meta["player"])
+        except (OSError, KeyError, ValueError):
+            return None, None
+        return tree, meta
+
+    def node(self, key):
+        position = np.searchsorted(self.node_keys, key)
+        if position < len(self.node_keys) and self.node_keys[position] == key:
+            return self.node_counts[position]
+        return None
+
+    def lookup(self, moves=()):
+        # Stats for the position after moves (SAN or UCI, or a chess.Board)
+        # and for every move played from it, most played first
+        if isinstance(moves, chess.Board):
+            board = moves
+        else:
+            board = chess.Board()
+            for move in moves:
+                board.push(board.parse_san(move))
+        key = np.uint64(chess.polyglot.zobrist_hash(board))
+        counts = self.node(key)
+        start = np.searchsorted(self.edge_parents, key, side="left")
+        end = np.searchsorted(self.edge_parents, key, side="right")
+        continuations = []
+        for edge in sorted(range(start, end), key=lambda edge: -self.edge_counts[edge, 0]):
+            stats = stats_dict(self.edge_counts[edge])
+            stats["move"] = board.san(decode_move(int(self.edge_moves[edge])))
+            continuations.append(stats)
+        stats = stats_dict(counts) if counts is not None else stats_dict(np.zeros(4, dtype=np.int32))
+        stats["fen"] = board.fen()
+        stats["moves"] = continuations
+        return stats
+
+
+class OpeningTreeAccumulator:
+    # Streaming-engine accumulator. Each ply becomes a (parent, move, child,
+    # outcome) row; rows from shards are concatenated on merge and grouped
+    # into an OpeningTree at the end. A position reached twice in one game
+    # gets a row only the first time, so each game counts once per node.
+    # Games set up from a FEN start from that position.
+    needs_moves = False
+    needs_movetext = True
+
+    def __init__(self, max_plies=DEFAULT_PLIES, player=None):
+        self.max_plies = max_plies
+        self.player = player.lower() if player else None
+        self.parents = array("Q")
+        self.moves = array("H")
+        self.children = array("Q")
+        self.outcomes = array("b")
+        self.memo = {}
+        self.root = chess.polyglot.zobrist_hash(chess.Board())
+
+    def __getstate__(self):
+        # The memo is only a cache; don't ship it between processes
+        state = self.__dict__.copy()
+        state["memo"] = {}
+        return state
+
+    def outcome(self, headers):
+        score = WHITE_SCORES.get(headers.get("Result"))
+        if score is None:
+            return UNFINISHED
+        if self.player is not None and headers.get("Black", "").lower() == self.player:
+            score = 1 - score
+        return int(score * 2)
+
+    def add(self, game):
+        headers = game.headers
+        if self.player is not None and self.player not in (headers.get("White", "").lower(),
+                                                           headers.get("Black", "").lower()):
+            return
+        outcome = self.outcome(headers)
+        movetext = getattr(game, "movetext", None)
+        if movetext is None:
+            # A fully parsed python-chess game
+            board = game.board()
+            sans = []
+            for move in game.mainline_moves():
+                if len(sans) == self.max_plies:
+                    break
+                sans.append(board.san(move))
+                board.push(move)
+        else:
+            sans = san_moves(movetext, self.max_plies)
+
+        root = self.root if "FEN" not in headers else chess.polyglot.zobrist_hash(start_board(headers))
+        self.parents.append(NO_PARENT)
+        self.moves.append(0)
+        self.children.append(root)
+        self.outcomes.append(outcome)
+        seen = {root}
+        key = root
+        board = None
+        for ply, san in enumerate(sans):
+            step = self.memo.get((key, san))
+            if step is None:
+                if board is None:
+                    board = self.replay(headers, sans[:ply])
+                try:
+                    move = board.parse_san(san)
+                except ValueError:
+                    break
+                board.push(move)
+                step = (chess.polyglot.zobrist_hash(board), encode_move(move))
+                if len(self.memo) >= MEMO_SIZE:
+                    self.memo.clear()
+                self.memo[key, san] = step
+            elif board is not None:
+                board.push(decode_move(step[1]))
+            if step[0] not in seen:
+                seen.add(step[0])
+                self.parents.append(key)
+                self.moves.append(step[1])
+                self.children.append(step[0])
+                self.outcomes.append(outcome)
+            key = step[0]
+
+    def replay(self, headers, sans):
+        board = start_board(headers)
+        for san in sans:
+            board.push_san(san)
+        return board
+
+    def merge(self, other):
+        self.parents.extend(other.parents)
+        self.moves.extend(other.moves)
+        self.children.extend(other.children)
+        self.outcomes.extend(other.outcomes)
+
+    def result(self):
+        return OpeningTree.from_rows(
+            np.frombuffer(self.parents, dtype=np.uint64),
+            np.frombuffer(self.moves, dtype=np.uint16),
+            np.frombuffer(self.children, dtype=np.uint64),
+            np.frombuffer(self.outcomes, dtype=np.int8),
+            self.max_plies,
+            self.player,
+        )
+
+
+def tree_path_for(pgn_file, player=None):
+    suffix = f".{player.lower()}" if player else ""
+    return f"{pgn_file}{suffix}.openings.npz"
+
+
+def open_opening_tree(pgn_file, max_plies=DEFAULT_PLIES, player=None, workers=1, progress=None, tree_path=None,
+                      where=None):
+    # Loads the saved tree when it was built from this exact file with the
+    # same settings, otherwise builds and saves a new one. Trees for the
+    # games matching where (a query.GameFilter) are built but not saved.
+    import analytics
+    from game_index import file_key
+    options = {"opening_tree": {"max_plies": max_plies, "player": player}}
+    if where is not None:
+        return analytics.analyze_file(pgn_file, ["opening_tree"], workers, progress, options,
+                                      where=where)["opening_tree"]
+    tree_path = tree_path or tree_path_for(pgn_file, player)
+    source = file_key(pgn_file)
+    tree, meta = OpeningTree.load(tree_path)
+    if tree is not None and meta["source"] == source and tree.max_plies == max_plies:
+        return tree
+    tree = analytics.analyze_file(pgn_file, ["opening_tree"], workers, progress, options)["opening_tree"]
+    tree.save(tree_path, source)
+    return tree
+
+
+def format_lookup(stats):
+    lines = [f"{stats['fen']}",
+             f"Games: {stats['games']} (+{stats['wins']} ={stats['draws']} -{stats['losses']})"]
+    for move in stats["moves"]:
+        score = f"{move['score']:.0%}" if move["score"] is not None else "-"
+        lines.append(f"{move['move']:>8} {move['games']:>7} games  +{move['wins']} ={move['draws']} -{move['losses']}"
+                     f"  score {score}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Explore the openings played in a PGN file")
+    parser.add_argument("pgn_file", help="Path to your PGN file")
+    parser.add_argument("moves", nargs="*", help="Moves leading to the position, e.g. e4 c5")
+    parser.add_argument("--plies", type=int, default=DEFAULT_PLIES, help="Plies of each game to add to the tree")
+    parser.add_argument("--player", help="Only use this player's games and score them from their side")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes to parse with")
+    args = parser.parse_args()
+
+    tree = open_opening_tree(args.pgn_file, args.plies, args.player, args.workers)
+    print(format_lookup(tree.lookup(args.moves)))
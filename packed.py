@@ -0,0 +1,136 @@
+import re
+import sys
+from array import array
+
+import chess
+import chess.pgn
+
+from clocks import CLOCK_REGEX
+
+# A comment, a variation bracket, or a SAN move (the move forms python-chess
+# accepts). Move numbers, NAGs and annotations match none of the groups.
+MOVETEXT_REGEX = re.compile(r"\{([^}]*)\}?|;[^\n]*|(\()|(\))|([NBKRQ]?[a-h]?[1-8]?[\-x]?[a-h][1-8](?:=?[nbrqkNBRQK])?"
+                            r"|--|Z0|0000|@@@@|O-O(?:-O)?|0-0(?:-0)?)")
+NO_CLOCK = float("nan")
+# Tags whose values differ from game to game; interning them saves nothing
+UNIQUE_TAGS = {"Link", "Date", "UTCDate", "UTCTime", "StartTime", "EndDate", "EndTime", "CurrentPosition", "FEN"}
+SQUARE_NAMES = chess.SQUARE_NAMES
+PROMOTION_SYMBOLS = ("", "p", "n", "b", "r", "q", "k")
+
+
+def encode_move(move):
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(code):
+    return chess.Move(code & 63, code >> 6 & 63, code >> 12 or None)
+
+
+def move_uci(code):
+    # The same string as str(decode_move(code)), without making the Move
+    if not code:
+        return "0000"
+    return SQUARE_NAMES[code & 63] + SQUARE_NAMES[code >> 6 & 63] + PROMOTION_SYMBOLS[code >> 12]
+
+
+def intern_headers(headers):
+    # Tag names and repeated values (player names, events, results, time
+    # controls) are shared between all games in memory
+    intern = sys.intern
+    return {intern(tag): intern(value) if type(value) is str and tag not in UNIQUE_TAGS else value
+            for tag, value in headers.items()}
+
+
+def start_board(headers):
+    fen = headers.get("FEN")
+    if fen is None:
+        return chess.Board()
+    return chess.Board(fen, chess960="960" in headers.get("Variant", ""))
+
+
+class PackedGame:
+    # A mainline as 16-bit from/to/promotion codes with the clock after each
+    # ply in a parallel array (nan when the move had no clock comment):
+    # two arrays and a header dict per game instead of a GameNode tree.
+    # Boards and python-chess games are only built when asked for.
+    __slots__ = ("headers", "moves", "clocks", "errors", "movetext")
+
+    def __init__(self, headers, moves=None, clocks=None, errors=(), movetext=None):
+        self.headers = headers
+        self.moves = array("H") if moves is None else moves
+        self.clocks = array("d") if clocks is None else clocks
+        self.errors = list(errors)
+        self.movetext = movetext
+
+    @classmethod
+    def from_movetext(cls, headers, movetext):
+        # Parses the mainline of one game's movetext. Variations are skipped;
+        # an illegal move ends the mainline and is recorded in errors, as
+        # python-chess does.
+        board = start_board(headers)
+        moves = array("H")
+        clocks = array("d")
+        errors = []
+        depth = 0
+        for match in MOVETEXT_REGEX.finditer(movetext):
+            comment, opening, closing, san = match.groups()
+            if opening:
+                depth += 1
+            elif closing:
+                depth = max(depth - 1, 0)
+            elif depth:
+                continue
+            elif san:
+                try:
+                    move = board.push_san(san)
+                except ValueError as error:
+                    errors.append(error)
+                    break
+                moves.append(encode_move(move))
+                clocks.append(NO_CLOCK)
+            elif comment and moves and clocks[-1] != clocks[-1] and "[%clk" in comment:
+                clock = CLOCK_REGEX.search(comment)
+                if clock:
+                    hours, minutes, seconds = clock.groups()
+                    clocks[-1] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        return cls(intern_headers(headers), moves, clocks, errors)
+
+    @classmethod
+    def from_game(cls, game):
+        # Packs a python-chess game's mainline
+        moves = array("H")
+        clocks = array("d")
+        for node in game.mainline():
+            moves.append(encode_move(node.move))
+            clock = node.clock()
+            clocks.append(NO_CLOCK if clock is None else clock)
+        return cls(intern_headers(game.headers), moves, clocks, game.errors)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def mainline_moves(self):
+        return [decode_move(code) for code in self.moves]
+
+    def uci(self, plies=None):
+        return [move_uci(code) for code in self.moves[:plies]]
+
+    def board(self, ply=None):
+        # The position after the first ply moves (the final one by default)
+        board = start_board(self.headers)
+        for code in self.moves[:ply]:
+            board.push(decode_move(code))
+        return board
+
+    def to_game(self):
+        game = chess.pgn.Game()
+        for tag, value in self.headers.items():
+            game.headers[tag] = str(value)
+        if "FEN" in self.headers:
+            game.setup(start_board(self.headers))
+        node = game
+        for code, clock in zip(self.moves, self.clocks):
+            node = node.add_variation(decode_move(code))
+            if clock == clock:
+                node.set_clock(clock)
+        return game
@@ -0,0 +1,218 @@
+from array import array
+from collections import Counter
+
+import numpy as np
+
+WHITE_SCORES = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}
+RATING_BUCKET = 100
+
+
+def white_scores(results):
+    # Score for White of each result string; unfinished games ("*") are nan
+    return np.array([WHITE_SCORES.get(result, np.nan) for result in results], dtype=np.float64)
+
+
+def game_date(headers):
+    # Date, or UTCDate when the local date is missing or partly unknown
+    date = headers.get("Date", "????.??.??")
+    if "?" in date:
+        return headers.get("UTCDate", date)
+    return date
+
+
+def parse_dates(dates):
+    # "2023.04.01" -> datetime64; unknown dates ("????.??.??") become NaT
+    parsed = []
+    for date in dates:
+        try:
+            parsed.append(np.datetime64(date.replace(".", "-"), "D"))
+        except ValueError:
+            parsed.append(np.datetime64("NaT"))
+    return np.array(parsed, dtype="datetime64[D]")
+
+
+def infer_player(white, white_names, black, black_names):
+    # The downloaded user is in every game, so the most frequent name is theirs
+    counts = Counter()
+    for codes, names in ((white, white_names), (black, black_names)):
+        counts.update(dict(zip(names, np.bincount(codes, minlength=len(names)).tolist())))
+    return counts.most_common(1)[0][0] if counts else None
+
+
+def name_codes(names, player):
+    # chess.com usernames are case-insensitive
+    player = player.lower()
+    return [code for code, name in enumerate(names) if name.lower() == player]
+
+
+def longest_run(mask):
+    if not mask.any():
+        return 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+    return int((edges[1::2] - edges[::2]).max())
+
+
+class PlayerGames:
+    # One player's games in file order as parallel arrays, seen from their
+    # side of the board: is_white, my_elo, opp_elo, my_score (1, 0.5, 0 or
+    # nan when unfinished) and date
+    def __init__(self, player, is_white, my_elo, opp_elo, my_score, date):
+        self.player = player
+        self.is_white = is_white
+        self.my_elo = my_elo
+        self.opp_elo = opp_elo
+        self.my_score = my_score
+        self.date = date
+
+    @classmethod
+    def from_columns(cls, player, white, white_names, black, black_names, white_elo, black_elo, scores, dates):
+        # white/black are name codes into white_names/black_names; scores
+        # and dates are per game. player=None picks the most frequent name.
+        white = np.asarray(white)
+        black = np.asarray(black)
+        if player is None:
+            player = infer_player(white, white_names, black, black_names)
+        if player is None:
+            is_white = np.zeros(0, dtype=bool)
+            mine = np.zeros(len(white), dtype=bool)
+        else:
+            is_white = np.isin(white, name_codes(white_names, player))
+            mine = is_white | np.isin(black, name_codes(black_names, player))
+            is_white = is_white[mine]
+        white_elo = np.asarray(white_elo, dtype=np.int32)[mine]
+        black_elo = np.asarray(black_elo, dtype=np.int32)[mine]
+        scores = np.asarray(scores, dtype=np.float64)[mine]
+        return cls(
+            player,
+            is_white,
+            np.where(is_white, white_elo, black_elo),
+            np.where(is_white, black_elo, white_elo),
+            np.where(is_white, scores, 1 - scores),
+            np.asarray(dates, dtype="datetime64[D]")[mine],
+        )
+
+    def __len__(self):
+        return len(self.my_score)
+
+    def record(self):
+        wins = int(np.count_nonzero(self.my_score == 1))
+        losses = int(np.count_nonzero(self.my_score == 0))
+        draws = int(np.count_nonzero(self.my_score == 0.5))
+        return wins, losses, draws, len(self)
+
+    def rated(self):
+        # Finished games against a rated opponent
+        return ~np.isnan(self.my_score) & (self.opp_elo > 0)
+
+    def performance_rating(self):
+        # Average opponent rating plus 400 points per net win per game
+        rated = self.rated()
+        games = int(np.count_nonzero(rated))
+        if not games:
+            return 0
+        scores = self.my_score[rated]
+        net_wins = np.count_nonzero(scores == 1) - np.count_nonzero(scores == 0)
+        return round(float(self.opp_elo[rated].mean()) + 400 * net_wins / games)
+
+    def expected_score(self):
+        # Elo expectation against the score actually made in the same games
+        rated = self.rated() & (self.my_elo > 0)
+        difference = (self.opp_elo[rated] - self.my_elo[rated]).astype(np.float64)
+        return {
+            "games": int(np.count_nonzero(rated)),
+            "expected": float((1 / (1 + 10 ** (difference / 400))).sum()),
+            "actual": float(self.my_score[rated].sum()),
+        }
+
+    def rating_buckets(self, width=RATING_BUCKET):
+        # (wins, draws, losses) against opponents in each rating band
+        rated = self.rated()
+        buckets, inverse = np.unique(self.opp_elo[rated] // width * width, return_inverse=True)
+        scores = self.my_score[rated]
+        counts = [np.bincount(inverse[scores == score], minlength=len(buckets)).tolist() for score in (1, 0.5, 0)]
+        return {bucket: tuple(bucket_counts) for bucket, *bucket_counts in zip(buckets.tolist(), *counts)}
+
+    def summary(self):
+        return {
+            "player": self.player,
+            "record": self.record(),
+            "performance_rating": self.performance_rating(),
+            "expected_score": self.expected_score(),
+            "rating_buckets": self.rating_buckets(),
+            "winning_streak": longest_run(self.my_score == 1),
+            "losing_streak": longest_run(self.my_score == 0),
+        }
+
+
+class PlayerStatsAccumulator:
+    # Streaming-engine accumulator collecting the header fields PlayerGames
+    # needs as compact arrays, with names and dates interned
+    needs_moves = False
+
+    def __init__(self, player=None):
+        self.player = player
+        self.names = {}
+        self.dates = {}
+        self.white = array("i")
+        self.black = array("i")
+        self.white_elo = array("i")
+        self.black_elo = array("i")
+        self.scores = array("d")
+        self.date_codes = array("i")
+
+    def intern(self, table, value):
+        code = table.get(value)
+        if code is None:
+            code = table[value] = len(table)
+        return code
+
+    def add(self, game):
+        headers = game.headers
+        self.white.append(self.intern(self.names, headers.get("White", "?")))
+        self.black.append(self.intern(self.names, headers.get("Black", "?")))
+        self.white_elo.append(int(headers.get("WhiteElo", 0)))
+        self.black_elo.append(int(headers.get("BlackElo", 0)))
+        self.scores.append(WHITE_SCORES.get(headers.get("Result"), np.nan))
+        self.date_codes.append(self.intern(self.dates, game_date(headers)))
+
+    def merge(self, other):
+        names = np.array([self.intern(self.names, name) for name in other.names], dtype=np.int32)
+        dates = np.array([self.intern(self.dates, date) for date in other.dates], dtype=np.int32)
+        for mine, theirs, codes in ((self.white, other.white, names), (self.black, other.black, names),
+                                    (self.date_codes, other.date_codes, dates)):
+            if len(theirs):
+                mine.extend(array("i", codes[np.frombuffer(theirs, dtype=np.int32)].tobytes()))
+        self.white_elo.extend(other.white_elo)
+        self.black_elo.extend(other.black_elo)
+        self.scores.extend(other.scores)
+
+    def games(self):
+        names = list(self.names)
+        return PlayerGames.from_columns(
+            self.player,
+            np.frombuffer(self.white, dtype=np.int32), names,
+            np.frombuffer(self.black, dtype=np.int32), names,
+            np.frombuffer(self.white_elo, dtype=np.int32),
+            np.frombuffer(self.black_elo, dtype=np.int32),
+            np.frombuffer(self.scores, dtype=np.float64),
+            parse_dates(list(self.dates))[np.frombuffer(self.date_codes, dtype=np.int32)],
+        )
+
+    def result(self):
+        return self.games().summary()
+
+
+def format_player_stats(stats):
+    wins, losses, draws, total = stats["record"]
+    expected = stats["expected_score"]
+    buckets = "\n".join(f"  {bucket}-{bucket + RATING_BUCKET - 1}: +{won} ={drawn} -{lost}"
+                        for bucket, (won, drawn, lost) in stats["rating_buckets"].items())
+    return (
+        f"Player: {stats['player']}\n"
+        f"Wins: {wins}\nLosses: {losses}\nDraws: {draws}\nTotal Games: {total}\n"
+        f"Performance Rating: {stats['performance_rating']}\n"
+        f"Score: {expected['actual']:g} / {expected['games']} (expected {expected['expected']:.1f})\n"
+        f"Longest Winning Streak: {stats['winning_streak']}\n"
+        f"Longest Losing Streak: {stats['losing_streak']}\n"
+        f"By Opponent Rating:\n{buckets}"
+    )
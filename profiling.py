@@ -0,0 +1,121 @@
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# The active Profiler, or None. Instrumented code checks this once per call
+# (or once per loop), so with profiling off the cost is an attribute lookup.
+active = None
+
+
+class Profiler:
+    # Per-stage wall time and call counts, named counters, and a timeline of
+    # stage spans for Chrome's trace viewer
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.counters = Counter()
+        self.events = []
+
+    def add_time(self, name, seconds, calls=1):
+        with self.lock:
+            total = self.stages.setdefault(name, [0, 0.0])
+            total[0] += calls
+            total[1] += seconds
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            end_time = time.perf_counter()
+            self.add_time(name, end_time - start_time)
+            with self.lock:
+                self.events.append((name, start_time, end_time, threading.get_ident()))
+
+    def report(self):
+        lines = ["Stage                                       Calls      Total (s)"]
+        for name, (calls, seconds) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<40} {calls:>9} {seconds:>14.3f}")
+        if self.counters:
+            lines.append("")
+            lines.append("Counter                                     Value")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{name:<40} {value:>12}")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = [{"name": name, "ph": "X", "pid": pid, "tid": thread,
+                   "ts": (start_time - self.start_time) * 1e6, "dur": (end_time - start_time) * 1e6}
+                  for name, start_time, end_time, thread in self.events]
+        end = (time.perf_counter() - self.start_time) * 1e6
+        events.extend({"name": name, "ph": "C", "pid": pid, "tid": 0, "ts": end, "args": {"value": value}}
+                      for name, value in self.counters.items())
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as file:
+            json.dump(self.chrome_trace(), file)
+
+
+def enable():
+    global active
+    active = Profiler()
+    return active
+
+
+def disable():
+    global active
+    profiler, active = active, None
+    return profiler
+
+
+def stage(name):
+    if active is None:
+        return contextlib.nullcontext()
+    return active.stage(name)
+
+
+def count(name, amount=1):
+    if active is not None:
+        active.count(name, amount)
+
+
+def add_arguments(parser):
+    parser.add_argument("--profile", action="store_true", help="Print a breakdown of time per stage and counters")
+    parser.add_argument("--pstats", metavar="FILE", help="With --profile, also save cProfile stats to FILE")
+    parser.add_argument("--trace", metavar="FILE", help="With --profile, also save a Chrome trace (chrome://tracing)")
+
+
+@contextlib.contextmanager
+def profile_from_args(args, output=None):
+    # Profiles the block when --profile was given, then prints the report
+    # (to stderr by default) and writes whatever files were asked for
+    if not args.profile:
+        yield None
+        return
+    profiler = enable()
+    python_profiler = cProfile.Profile() if args.pstats else None
+    if python_profiler is not None:
+        python_profiler.enable()
+    try:
+        yield profiler
+    finally:
+        if python_profiler is not None:
+            python_profiler.disable()
+            python_profiler.dump_stats(args.pstats)
+        disable()
+        print(profiler.report(), file=output or sys.stderr)
+        if args.trace:
+            profiler.write_chrome_trace(args.trace)
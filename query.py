@@ -0,0 +1,216 @@
+from collections import Counter
+
+import numpy as np
+
+from clocks import parse_time_control
+from players import WHITE_SCORES, game_date, name_codes, white_scores
+
+# Upper bounds on the estimated game length (base + 40 increments, in
+# seconds) for each time class; anything longer is classical
+TIME_CLASS_LIMITS = (("bullet", 180), ("blitz", 600), ("rapid", 3600))
+TIME_CLASSES = ("bullet", "blitz", "rapid", "classical", "daily")
+COLORS = ("white", "black")
+PLAYER_RESULTS = {"win": 1.0, "draw": 0.5, "loss": 0.0}
+FIELDS = ("player", "color", "since", "until", "min_rating", "max_rating", "eco", "result", "time_class",
+          "time_control")
+
+
+def time_class(time_control):
+    # "180+2" -> "blitz"; correspondence ("1/86400") is daily; None if unknown
+    if "/" in time_control:
+        return "daily"
+    base, increment = parse_time_control(time_control)
+    if base != base:
+        return None
+    estimate = base + 40 * increment
+    for name, limit in TIME_CLASS_LIMITS:
+        if estimate < limit:
+            return name
+    return "classical"
+
+
+def normalize_date(date, end=False):
+    # "2023", "2023-05" or "2023.05.06" -> "YYYY.MM.DD", compared as a string
+    # with normalized Date headers. A partial end date covers the whole
+    # year or month.
+    parts = date.replace("-", ".").replace("/", ".").split(".")
+    return ".".join(parts + ["99" if end else "01"] * (3 - len(parts)))
+
+
+class GameFilter:
+    # A selection of games that can be tested against one game's headers
+    # during the header scan, or turned into a boolean mask over the index
+    # columns. Color, result and rating band are from the player's side
+    # (the most frequent player unless one is given); the rating band is
+    # the opponent's rating.
+    def __init__(self, player=None, color=None, since=None, until=None, min_rating=None, max_rating=None,
+                 eco=None, result=None, time_class=None, time_control=None):
+        if color not in (None,) + COLORS:
+            raise ValueError(f"Unknown color {color}")
+        if result not in (None,) + tuple(PLAYER_RESULTS):
+            raise ValueError(f"Unknown result {result}; expected win, draw or loss")
+        if time_class not in (None,) + TIME_CLASSES:
+            raise ValueError(f"Unknown time class {time_class}; expected one of {', '.join(TIME_CLASSES)}")
+        self.player = player
+        self.color = color
+        self.since = normalize_date(since) if since else None
+        self.until = normalize_date(until, end=True) if until else None
+        self.min_rating = min_rating
+        self.max_rating = max_rating
+        self.eco = eco.upper() if eco else None
+        self.result = result
+        self.time_class = time_class
+        self.time_control = time_control
+        self.time_classes = {}
+
+    @classmethod
+    def parse(cls, text):
+        # "blitz black since:2023 rating:1800- eco:B result:win", as typed in
+        # the GUI or passed to --where
+        options = {}
+        for token in text.split():
+            key, _, value = token.partition(":")
+            key = key.lower()
+            if not value and key in COLORS:
+                options["color"] = key
+            elif not value and key in TIME_CLASSES:
+                options["time_class"] = key
+            elif not value and key in PLAYER_RESULTS:
+                options["result"] = key
+            elif key == "rating":
+                low, _, high = value.partition("-")
+                options["min_rating"] = int(low) if low else None
+                options["max_rating"] = int(high) if high else None
+            elif key in ("tc", "time_control"):
+                options["time_control"] = value
+            elif key in ("player", "color", "since", "until", "eco", "result") and value:
+                options[key] = value.lower() if key in ("color", "result") else value
+            else:
+                raise ValueError(f"Unknown filter term {token!r}")
+        return cls(**options)
+
+    def key(self):
+        return tuple(getattr(self, field) for field in FIELDS)
+
+    def __eq__(self, other):
+        return isinstance(other, GameFilter) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __str__(self):
+        terms = [self.color, self.time_class, self.result]
+        terms += [f"{name}:{getattr(self, name)}" for name in ("player", "since", "until", "eco")
+                  if getattr(self, name)]
+        if self.time_control:
+            terms.append(f"tc:{self.time_control}")
+        if self.min_rating is not None or self.max_rating is not None:
+            terms.append(f"rating:{self.min_rating or ''}-{self.max_rating or ''}")
+        return " ".join(term for term in terms if term)
+
+    def needs_player(self):
+        return bool(self.color or self.result or self.min_rating is not None or self.max_rating is not None)
+
+    def with_player(self, player):
+        where = GameFilter(**{field: getattr(self, field) for field in FIELDS})
+        where.player = player
+        return where
+
+    def resolve(self, games):
+        # Fills in the most frequent player when the filter needs one. games
+        # is a GameIndex or a PGN path; a path costs one header scan.
+        if self.player or not self.needs_player():
+            return self
+        if getattr(games, "is_game_index", False):
+            return self.with_player(games.player_games(None).player)
+        import analytics
+        counts = Counter()
+        with analytics.open_pgn(games) as file:
+            for game in analytics.iter_headers(file):
+                counts[game.headers["White"]] += 1
+                counts[game.headers["Black"]] += 1
+        return self.with_player(counts.most_common(1)[0][0] if counts else None)
+
+    def __call__(self, headers):
+        # Whether one game's (normalized) headers match
+        if (self.since or self.until) and not self.date_matches(game_date(headers)):
+            return False
+        if self.eco and not headers.get("ECO", "").upper().startswith(self.eco):
+            return False
+        if self.time_control and headers.get("TimeControl") != self.time_control:
+            return False
+        if self.time_class:
+            time_control = headers.get("TimeControl", "")
+            if time_control not in self.time_classes:
+                self.time_classes[time_control] = time_class(time_control)
+            if self.time_classes[time_control] != self.time_class:
+                return False
+        if not self.needs_player():
+            return True
+        player = (self.player or "").lower()
+        if headers["White"].lower() == player:
+            is_white = True
+        elif headers["Black"].lower() == player:
+            is_white = False
+        else:
+            return False
+        if self.color and is_white != (self.color == "white"):
+            return False
+        if self.result:
+            score = WHITE_SCORES.get(headers["Result"])
+            if score is None or (score if is_white else 1 - score) != PLAYER_RESULTS[self.result]:
+                return False
+        if self.min_rating is not None or self.max_rating is not None:
+            rating = int(headers["BlackElo" if is_white else "WhiteElo"])
+            if not rating or not self.in_band(rating):
+                return False
+        return True
+
+    def date_matches(self, date):
+        return "?" not in date and (not self.since or date >= self.since) and (not self.until or date <= self.until)
+
+    def in_band(self, rating):
+        return ((self.min_rating is None or rating >= self.min_rating)
+                and (self.max_rating is None or rating <= self.max_rating))
+
+    def mask(self, index):
+        # The same test as a boolean mask over a GameIndex's columns. Tests
+        # on category columns are evaluated once per distinct value.
+        selected = np.ones(len(index), dtype=bool)
+        tables = index.tables
+        if self.since or self.until:
+            selected &= np.array([self.date_matches(date) for date in tables["date"]],
+                                 dtype=bool)[index.column("date")]
+        if self.eco:
+            selected &= np.array([eco.upper().startswith(self.eco) for eco in tables["eco"]],
+                                 dtype=bool)[index.column("eco")]
+        if self.time_control or self.time_class:
+            keep = np.array([(not self.time_control or time_control == self.time_control)
+                             and (not self.time_class or time_class(time_control) == self.time_class)
+                             for time_control in tables["time_control"]], dtype=bool)
+            selected &= keep[index.column("time_control")]
+        if not self.needs_player():
+            return selected
+        player = self.player or ""
+        is_white = np.isin(index.column("white"), name_codes(tables["white"], player))
+        is_black = np.isin(index.column("black"), name_codes(tables["black"], player))
+        selected &= is_white | is_black
+        if self.color:
+            selected &= is_white if self.color == "white" else ~is_white
+        if self.result:
+            scores = white_scores(tables["result"])[index.column("result")]
+            selected &= np.where(is_white, scores, 1 - scores) == PLAYER_RESULTS[self.result]
+        if self.min_rating is not None or self.max_rating is not None:
+            rating = np.where(is_white, index.column("black_elo"), index.column("white_elo"))
+            keep = rating > 0
+            if self.min_rating is not None:
+                keep &= rating >= self.min_rating
+            if self.max_rating is not None:
+                keep &= rating <= self.max_rating
+            selected &= keep
+        return selected
+
+
+def from_text(text):
+    # None for a blank query
+    return GameFilter.parse(text) if text and text.strip() else None
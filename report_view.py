@@ -0,0 +1,91 @@
+import tkinter as tk
+from tkinter import filedialog, ttk
+
+from reports import PAGE_SIZE
+
+
+class ReportWindow(tk.Toplevel):
+    # Shows a Report one section at a time. Tables are paged, so the tree
+    # only ever holds PAGE_SIZE rows however long the section is.
+    def __init__(self, master, report, title="Report", tasks=None):
+        super().__init__(master)
+        self.title(title)
+        self.geometry("760x480")
+        self.report = report
+        self.tasks = tasks
+        self.section = None
+        self.page_number = 0
+
+        self.sections = tk.Listbox(self, width=28, exportselection=False)
+        for section in report:
+            self.sections.insert(tk.END, section.title)
+        self.sections.bind("<<ListboxSelect>>", self.on_select)
+        self.sections.pack(side=tk.LEFT, fill=tk.Y)
+
+        controls = tk.Frame(self)
+        controls.pack(side=tk.BOTTOM, fill=tk.X)
+        tk.Button(controls, text="Export JSON...", command=lambda: self.export("json")).pack(side=tk.RIGHT)
+        tk.Button(controls, text="Export CSV...", command=lambda: self.export("csv")).pack(side=tk.RIGHT)
+        self.previous_button = tk.Button(controls, text="< Previous", command=lambda: self.show_page(self.page_number - 1))
+        self.previous_button.pack(side=tk.LEFT)
+        self.next_button = tk.Button(controls, text="Next >", command=lambda: self.show_page(self.page_number + 1))
+        self.next_button.pack(side=tk.LEFT)
+        self.page_var = tk.StringVar()
+        tk.Label(controls, textvariable=self.page_var).pack(side=tk.LEFT)
+
+        frame = tk.Frame(self)
+        frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(frame, show="headings")
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        if report.sections:
+            self.sections.selection_set(0)
+            self.show_section(report.sections[0])
+
+    def on_select(self, event):
+        selection = self.sections.curselection()
+        if selection:
+            self.show_section(self.report.sections[selection[0]])
+
+    def show_section(self, section):
+        self.section = section
+        columns = ("field", "value") if section.kind == "scalar" else section.columns
+        self.tree.configure(columns=columns)
+        for column in columns:
+            self.tree.heading(column, text=column.replace("_", " ").title())
+            self.tree.column(column, width=120, stretch=True)
+        self.show_page(0)
+
+    def show_page(self, number):
+        section = self.section
+        self.tree.delete(*self.tree.get_children())
+        if section.kind == "scalar":
+            rows = [(field.replace("_", " "), value) for field, value in section.fields.items()]
+            self.page_number, pages, total = 0, 1, len(rows)
+        else:
+            pages = section.pages()
+            self.page_number = max(0, min(number, pages - 1))
+            rows = section.page(self.page_number)
+            total = len(section)
+        for row in rows:
+            self.tree.insert("", tk.END, values=row)
+        first = self.page_number * PAGE_SIZE
+        self.page_var.set(f"Rows {first + 1 if total else 0}-{first + len(rows)} of {total}")
+        self.previous_button.config(state=tk.NORMAL if self.page_number > 0 else tk.DISABLED)
+        self.next_button.config(state=tk.NORMAL if self.page_number < pages - 1 else tk.DISABLED)
+
+    def export(self, output_format):
+        if output_format == "json":
+            path = filedialog.asksaveasfilename(parent=self, defaultextension=".json",
+                                                filetypes=[("JSON Files", "*.json")])
+        else:
+            path = filedialog.askdirectory(parent=self, title="Directory for the CSV files")
+        if not path:
+            return
+        if self.tasks is None:
+            self.report.write(output_format, path)
+        else:
+            self.tasks.submit("Export Report", lambda task: self.report.write(output_format, path))
@@ -0,0 +1,316 @@
+import csv
+import itertools
+import json
+import os
+
+import numpy as np
+
+import analytics
+from ingest import Quarantine, binary_stream, scan_games
+
+PAGE_SIZE = 100
+CHUNK_ROWS = 10000
+# Every metric with report sections; the opening tree is explored, not reported
+REPORT_METRICS = tuple(metric for metric in analytics.METRICS if metric != "opening_tree")
+
+
+def column_arrays(rows, columns):
+    if not rows:
+        return {name: np.array([]) for name in columns}
+    return {name: np.array(values) for name, values in zip(columns, zip(*rows))}
+
+
+class ListRows:
+    # Table rows held in a list, optionally converted row by row on access
+    def __init__(self, items, convert=None):
+        self.items = items
+        self.convert = convert
+
+    def __len__(self):
+        return len(self.items)
+
+    def rows(self, start, stop):
+        items = self.items[start:stop]
+        return [self.convert(item) for item in items] if self.convert else [tuple(item) for item in items]
+
+    def column_arrays(self, columns):
+        return column_arrays(self.rows(0, len(self)), columns)
+
+
+class ScanRows:
+    # Rows of a per-game metric read from the PGN each time they are asked
+    # for, using the accumulator's row(game). Counting the rows costs one
+    # header scan, which also notes the byte offset of every PAGE_SIZE-th
+    # game so a page is read by seeking close to it (compressed files that
+    # can't seek are read from the start). With numbered, each row starts
+    # with the game's number.
+    def __init__(self, pgn_file, metric, options=None, where=None, numbered=False):
+        self.pgn_file = pgn_file
+        self.accumulator = analytics.METRICS[metric](**(options or {}))
+        self.where = where
+        self.numbered = numbered
+        self.length = None
+        self.offsets = []
+
+    def __len__(self):
+        if self.length is None:
+            count = 0
+            with analytics.open_pgn(self.pgn_file) as file:
+                for offset, headers, _ in scan_games(file, quarantine=Quarantine(), offsets=True):
+                    if self.where is None or self.where(headers):
+                        if count % PAGE_SIZE == 0:
+                            self.offsets.append(offset)
+                        count += 1
+            self.length = count
+        return self.length
+
+    def iter_rows(self, start=0, stop=None):
+        row = self.accumulator.row
+        with analytics.open_pgn(self.pgn_file) as file:
+            stream = binary_stream(file)
+            skip = start
+            if start and stream.seekable():
+                if start >= len(self):
+                    return
+                stream.seek(self.offsets[start // PAGE_SIZE])
+                skip = start % PAGE_SIZE
+            games = analytics.reader_for({"rows": self.accumulator})(stream, Quarantine(), self.where)
+            games = itertools.islice(games, skip, None if stop is None else skip + stop - start)
+            for number, game in enumerate(games, start + 1):
+                yield (number, row(game)) if self.numbered else tuple(row(game))
+
+    def rows(self, start, stop):
+        return list(self.iter_rows(start, stop))
+
+    def column_arrays(self, columns):
+        return column_arrays(list(self.iter_rows()), columns)
+
+
+class ScalarSection:
+    kind = "scalar"
+
+    def __init__(self, name, title, fields):
+        self.name = name
+        self.title = title
+        self.fields = fields
+
+    def to_dict(self):
+        return {"name": self.name, "title": self.title, "kind": self.kind, "fields": self.fields}
+
+
+class TableSection:
+    kind = "table"
+
+    def __init__(self, name, title, columns, source):
+        self.name = name
+        self.title = title
+        self.columns = columns
+        self.source = source
+
+    def __len__(self):
+        return len(self.source)
+
+    def page(self, number, size=PAGE_SIZE):
+        return self.source.rows(number * size, (number + 1) * size)
+
+    def pages(self, size=PAGE_SIZE):
+        return max(1, -(-len(self) // size))
+
+    def iter_rows(self, chunk=CHUNK_ROWS):
+        if hasattr(self.source, "iter_rows"):
+            yield from self.source.iter_rows()
+            return
+        for start in range(0, len(self), chunk):
+            yield from self.source.rows(start, start + chunk)
+
+
+def flatten(fields, prefix=""):
+    # {"a": {"b": 1}} -> {"a_b": 1}, for CSV and display
+    flat = {}
+    for key, value in fields.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "_"))
+        else:
+            flat[name] = value
+    return flat
+
+
+def metric_sections(metric, result):
+    # Typed sections for one metric's raw result
+    if metric == "win_loss":
+        wins, losses, draws, total = result
+        return [ScalarSection(metric, "Win-Loss Ratio",
+                              {"wins": wins, "losses": losses, "draws": draws, "total_games": total})]
+    if metric == "rating_distribution":
+        return [TableSection(metric, "Rating Distribution", ("rating", "count"), ListRows(sorted(result.items())))]
+    if metric == "performance_rating":
+        return [ScalarSection(metric, "Performance Rating", {"performance_rating": result})]
+    if metric == "common_openings":
+        return [TableSection(metric, "Most Common Openings", ("eco", "count"), ListRows(result))]
+    if metric == "time_usage":
+        return [ScalarSection(metric, "Average Move Time", {"average_clock": result})]
+    if metric == "clock_stats":
+        return [ScalarSection(metric, "Time Usage", flatten({key: value for key, value in result.items()
+                                                            if key != "think_time_percentiles"})),
+                TableSection("think_time_percentiles", "Think Time Percentiles", ("percentile", "seconds"),
+                             ListRows(list(result["think_time_percentiles"].items())))]
+    if metric == "winning_streak":
+        return [ScalarSection(metric, "Longest Winning Streak", {"longest_winning_streak": result})]
+    if metric == "losing_streak":
+        return [ScalarSection(metric, "Longest Losing Streak", {"longest_losing_streak": result})]
+    if metric == "results_timeline":
+        return [TableSection(metric, "Game Results Timeline", ("result", "date"), ListRows(result))]
+    if metric == "positional_analysis":
+        return [TableSection(metric, "Positional Analysis", ("opening", "count"), ListRows(list(result.items())))]
+    if metric == "game_highlights":
+        return [TableSection(metric, "Game Highlights", ("game", "moves"),
+                             ListRows(range(len(result)), lambda number: (number + 1, result[number])))]
+    if metric == "player_stats":
+        wins, losses, draws, total = result["record"]
+        fields = {key: value for key, value in result.items() if key not in ("record", "rating_buckets")}
+        fields.update({"wins": wins, "losses": losses, "draws": draws, "total_games": total})
+        buckets = [(bucket,) + counts for bucket, counts in result["rating_buckets"].items()]
+        return [ScalarSection(metric, "Player Statistics", flatten(fields)),
+                TableSection("rating_buckets", "Results by Opponent Rating",
+                             ("opponent_rating", "wins", "draws", "losses"), ListRows(buckets))]
+    raise ValueError(f"No report section for {metric}")
+
+
+class Report:
+    def __init__(self, sections):
+        self.sections = sections
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def section(self, name):
+        for section in self.sections:
+            if section.name == name:
+                return section
+        raise KeyError(name)
+
+    def write_json(self, file):
+        # Table rows are written as they are read, never as one big string
+        file.write('{"sections": [')
+        for number, section in enumerate(self.sections):
+            file.write(",\n" if number else "\n")
+            if section.kind == "scalar":
+                file.write(json.dumps(section.to_dict()))
+                continue
+            header = {"name": section.name, "title": section.title, "kind": section.kind,
+                      "columns": list(section.columns), "total_rows": len(section)}
+            file.write(json.dumps(header)[:-1] + ', "rows": [')
+            for row_number, row in enumerate(section.iter_rows()):
+                file.write((",\n" if row_number else "\n") + json.dumps(row))
+            file.write("]}")
+        file.write("\n]}\n")
+
+    def write_csv(self, directory):
+        # summary.csv with every scalar field, plus one CSV per table
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "summary.csv"), "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(("section", "field", "value"))
+            for section in self.sections:
+                if section.kind == "scalar":
+                    writer.writerows((section.name, field, value) for field, value in section.fields.items())
+        for section in self.sections:
+            if section.kind == "table":
+                with open(os.path.join(directory, section.name + ".csv"), "w", newline="") as file:
+                    writer = csv.writer(file)
+                    writer.writerow(section.columns)
+                    writer.writerows(section.iter_rows())
+
+    def write_columnar(self, directory):
+        # One Parquet file per table when pyarrow is installed, otherwise an
+        # .npz of column arrays. Index-backed string columns stay dictionary
+        # encoded (codes plus values) either way.
+        os.makedirs(directory, exist_ok=True)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            pyarrow = None
+        for section in self.sections:
+            if section.kind != "table":
+                continue
+            arrays = section.source.column_arrays(section.columns)
+            if pyarrow is not None:
+                columns = {name: pyarrow.DictionaryArray.from_arrays(*value) if isinstance(value, tuple)
+                           else pyarrow.array(value) for name, value in arrays.items()}
+                pyarrow.parquet.write_table(pyarrow.table(columns), os.path.join(directory, section.name + ".parquet"))
+                continue
+            flat = {}
+            for name, value in arrays.items():
+                if isinstance(value, tuple):
+                    flat[name + "_codes"], flat[name + "_values"] = value
+                else:
+                    flat[name] = value
+            np.savez(os.path.join(directory, section.name + ".npz"), **flat)
+        with open(os.path.join(directory, "summary.json"), "w") as file:
+            json.dump([section.to_dict() for section in self.sections if section.kind == "scalar"], file)
+
+    def write(self, output_format, path=None):
+        if output_format == "json":
+            if path is None:
+                import sys
+                self.write_json(sys.stdout)
+            else:
+                with open(path, "w") as file:
+                    self.write_json(file)
+        elif output_format == "csv":
+            self.write_csv(path or "report")
+        elif output_format == "columnar":
+            self.write_columnar(path or "report")
+        else:
+            raise ValueError(f"Unknown report format {output_format}")
+
+
+def quarantine_sections(result):
+    # Only reported when something was skipped or repaired
+    if not result["quarantined"] and not result["normalized"]:
+        return []
+    fields = {"quarantined": result["quarantined"]}
+    fields.update((f"skipped_{reason.replace(' ', '_')}", count) for reason, count in result["reasons"].items())
+    fields.update((f"repaired_{field.replace(' ', '_')}", count) for field, count in result["normalized"].items())
+    samples = [(sample["reason"], sample["headers"].get("White"), sample["headers"].get("Black"),
+                sample["headers"].get("Date"), sample["headers"].get("Link", sample["headers"].get("Site")))
+               for sample in result["samples"]]
+    return [ScalarSection("quarantine", "Skipped Games", fields),
+            TableSection("quarantined_games", "Skipped Game List", ("reason", "white", "black", "date", "site"),
+                         ListRows(samples))]
+
+
+def build_report(games, metrics=analytics.DEFAULT_METRICS, workers=1, progress=None, options=None,
+                 quarantine=None, where=None):
+    # games is a PGN path or a GameIndex. With an index the timeline is
+    # served from its columns instead of being built as a list; from a PGN
+    # the per-game tables are read again from the file as they are written.
+    # Games skipped as malformed are collected in quarantine and reported
+    # last; where (a query.GameFilter) limits the report to matching games.
+    options = options or {}
+    quarantine = Quarantine() if quarantine is None else quarantine
+    if analytics.is_game_index(games):
+        games = games.select(where)
+        lazy = {"results_timeline": lambda: TableSection("results_timeline", "Game Results Timeline",
+                                                         ("result", "date"), IndexRows(games, ("result", "date")))}
+        results = games.report([metric for metric in metrics if metric not in lazy], workers, progress, options)
+        quarantine.merge(games.quarantine())
+    else:
+        if where is not None:
+            where = where.resolve(games)
+        lazy = {
+            "results_timeline": lambda: TableSection(
+                "results_timeline", "Game Results Timeline", ("result", "date"),
+                ScanRows(games, "results_timeline", options.get("results_timeline"), where)),
+            "game_highlights": lambda: TableSection(
+                "game_highlights", "Game Highlights", ("game", "moves"),
+                ScanRows(games, "game_highlights", options.get("game_highlights"), where, numbered=True)),
+        }
+        results = analytics.analyze_file(games, [metric for metric in metrics if metric not in lazy], workers,
+                                         progress, options, quarantine, where)
+    sections = []
+    for metric in metrics:
+        sections.extend([lazy[metric]()] if metric in lazy else metric_sections(metric, results[metric]))
+    return Report(sections + quarantine_sections(quarantine.result()))
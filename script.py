@@ -1,64 +1,46 @@
-import sys
-
-import requests
-import os
+import argparse
 import time
 
 
-def download_games(username):
-    url = f"https://api.chess.com/pub/player/{username}/games/archives"
-    response = requests.get(url)
-    if response.status_code != 200:
-        print("Failed to retrieve archives.")
-        return
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
 
-    archives = response.json().get("archives", [])
-    if not archives:
-        print("No game archives found.")
-        return
 
-    pgn_filename = f"{username}_games.pgn"
-    total_games = 0
-    downloaded_games = 0
+def download_games(username, compress=None, base_url=None):
+    # Imported here so the command line starts without requests
+    from archive_cache import ArchiveCache
+    from downloader import DownloadError, download_games as fetch_games
 
+    pgn_filename = f"{username}_games.pgn" + COMPRESSED_SUFFIXES.get(compress, "")
     start_time = time.time()
 
-    for archive_url in archives:
-        response = requests.get(archive_url)
-        if response.status_code == 200:
-            games = response.json().get("games", [])
-            total_games += len(games)
-
-    with open(pgn_filename, "w") as file:
-        for archive_url in archives:
-            response = requests.get(archive_url)
-            if response.status_code == 200:
-                games = response.json().get("games", [])
-                for game in games:
-                    pgn = game.get("pgn")
-                    if pgn is not None:
-                        file.write(pgn + "\n\n")
-                        downloaded_games += 1
-                        print_progress(downloaded_games, total_games)
+    try:
+        pgn_filename, downloaded_games = fetch_games(username, pgn_filename, base_url=base_url,
+                                                     progress=print_progress, cache=ArchiveCache())
+    except DownloadError as error:
+        print(error)
+        return
 
     # Calculate elapsed time
     elapsed_time = time.time() - start_time
 
     print(f"\nAll games retrieved and written to: {pgn_filename}")
+    print(f"New games: {downloaded_games}")
     print(f"Time elapsed: {elapsed_time:.2f} seconds")
 
 
-def print_progress(downloaded, total):
+def print_progress(downloaded, total, games):
+    if not total:
+        return
     progress = downloaded / total * 100
     progress_bar_length = 20
     filled_length = int(progress_bar_length * downloaded / total)
     bar = "█" * filled_length + "-" * (progress_bar_length - filled_length)
-    print(f"Progress: [{bar}] {progress:.2f}% ({downloaded}/{total} games)", end="\r", flush=True)
+    print(f"Progress: [{bar}] {progress:.2f}% ({downloaded}/{total} months, {games} games)", end="\r", flush=True)
 
 
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        username = sys.argv[1]
-    else:
-        username = input("Enter the username: ")
-    download_games(username)
+    import cli
+
+    parser = argparse.ArgumentParser(description="Download a player's games")
+    cli.add_download_arguments(parser)
+    cli.run_download(parser.parse_args())
@@ -0,0 +1,79 @@
+import argparse
+import hashlib
+import sys
+import time
+
+import chess
+
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900}
+
+
+def evaluate(board):
+    # Material from the side to move, plus a small deterministic jitter so
+    # positions with equal material don't all score the same
+    score = sum(value * (len(board.pieces(piece, board.turn)) - len(board.pieces(piece, not board.turn)))
+                for piece, value in PIECE_VALUES.items())
+    jitter = hashlib.sha1(board.fen().encode()).digest()[0] % 21 - 10
+    return score + jitter
+
+
+def set_position(tokens):
+    # "position startpos moves e2e4 ..." or "position fen <fen> moves ..."
+    if tokens[1] == "startpos":
+        board = chess.Board()
+        rest = tokens[2:]
+    else:
+        end = tokens.index("moves") if "moves" in tokens else len(tokens)
+        board = chess.Board(" ".join(tokens[2:end]))
+        rest = tokens[end:]
+    for move in rest[1:]:
+        board.push_uci(move)
+    return board
+
+
+def main():
+    # A tiny UCI engine for exercising the engine pool without a real engine
+    parser = argparse.ArgumentParser(description="Minimal UCI engine that scores positions by material")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to spend on each search")
+    args = parser.parse_args()
+
+    board = chess.Board()
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+        if command == "uci":
+            print("id name StubEngine")
+            print("id author chess-analyzer")
+            print("uciok")
+        elif command == "isready":
+            print("readyok")
+        elif command == "ucinewgame":
+            board = chess.Board()
+        elif command == "position":
+            board = set_position(tokens)
+        elif command == "go":
+            if args.delay:
+                time.sleep(args.delay)
+            moves = list(board.legal_moves)
+            if not moves:
+                print("info depth 1 score mate 0" if board.is_check() else "info depth 1 score cp 0")
+                print("bestmove 0000")
+            else:
+                # One ply of search: the move leaving the opponent worst off
+                scored = []
+                for move in moves:
+                    board.push(move)
+                    scored.append((-evaluate(board), move.uci()))
+                    board.pop()
+                score, best = max(scored)
+                print(f"info depth 1 nodes {len(moves)} score cp {score} pv {best}")
+                print(f"bestmove {best}")
+        elif command == "quit":
+            break
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
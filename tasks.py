@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+FRAME_RATE = 20
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class Task:
+    def __init__(self, name):
+        self.name = name
+        self.cancel_event = threading.Event()
+        self.start_time = time.perf_counter()
+        self.count = 0
+        self.done = None
+        self.total = None
+
+    def progress(self, count, done=None, total=None):
+        # count is games processed; done/total optionally track steps such
+        # as months downloaded. Called from the worker as often as it likes;
+        # the runner only reads the latest values once per frame. Raises once
+        # the task is cancelled.
+        if self.cancel_event.is_set():
+            raise TaskCancelled()
+        self.count = count
+        self.done = done
+        self.total = total
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.start_time
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+
+class TaskRunner:
+    # Runs work off the Tk main loop. Results come back through a queue that
+    # is polled with after(), so callbacks and widget updates only ever run
+    # on the Tk thread, and progress is redrawn at a fixed frame rate.
+    def __init__(self, widget, on_status, workers=2, frame_rate=FRAME_RATE):
+        self.widget = widget
+        self.on_status = on_status
+        self.frame_ms = max(1, 1000 // frame_rate)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.events = queue.Queue()
+        self.running = []
+        self.widget.after(self.frame_ms, self.poll)
+
+    def submit(self, name, work, on_done=None, on_error=None):
+        # work(task) runs on a worker thread; on_done(result) and
+        # on_error(exception) run on the Tk thread.
+        task = Task(name)
+        self.running.append(task)
+        self.executor.submit(self.run, task, work, on_done, on_error)
+        return task
+
+    def run(self, task, work, on_done, on_error):
+        try:
+            result = work(task)
+        except TaskCancelled:
+            self.events.put((task, None, None))
+        except Exception as error:
+            self.events.put((task, on_error, error))
+        else:
+            self.events.put((task, on_done, result))
+
+    def poll(self):
+        while True:
+            try:
+                task, callback, value = self.events.get_nowait()
+            except queue.Empty:
+                break
+            self.running.remove(task)
+            self.on_status(task, finished=True)
+            if callback is not None and not task.cancelled:
+                callback(value)
+        for task in self.running:
+            self.on_status(task, finished=False)
+        self.widget.after(self.frame_ms, self.poll)
+
+    def cancel(self):
+        for task in self.running:
+            task.cancel()
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,34 @@
+import downloader
+from benchmark import sequential_download, time_call
+from mock_api import MockGamesAPI
+
+MONTHS = 6
+LATENCY = 0.1
+
+
+def test_pooled_download_fetches_each_archive_once(tmp_path):
+    with MockGamesAPI(months=MONTHS, games_per_month=5, latency=LATENCY) as api:
+        sequential_time, _ = time_call(sequential_download, "player", api.base_url, str(tmp_path / "sequential.pgn"))
+        sequential_requests = api.requests
+        api.reset_counters()
+        pooled_time, (_, games) = time_call(downloader.download_games, "player", str(tmp_path / "pooled.pgn"),
+                                            workers=MONTHS, base_url=api.base_url)
+        pooled_requests = api.requests
+
+    # The archive list plus every month twice, against every month once
+    assert sequential_requests == 1 + 2 * MONTHS
+    assert pooled_requests == 1 + MONTHS
+    assert games == MONTHS * 5
+    assert (tmp_path / "pooled.pgn").read_text() == (tmp_path / "sequential.pgn").read_text()
+    # Sequential pays the latency once per request; pooled about twice in all
+    assert pooled_time < sequential_time / 2
+
+
+def test_rerun_only_refetches_the_latest_month(tmp_path):
+    pgn_file = str(tmp_path / "player.pgn")
+    with MockGamesAPI(months=MONTHS, games_per_month=5) as api:
+        downloader.download_games("player", pgn_file, base_url=api.base_url)
+        api.reset_counters()
+        _, games = downloader.download_games("player", pgn_file, base_url=api.base_url)
+        assert api.requests == 2
+    assert games == 0
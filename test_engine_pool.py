@@ -0,0 +1,61 @@
+import os
+import sys
+
+import chess
+import chess.engine
+
+from engine_pool import EnginePool, EvalCache, analyze_accuracy
+
+STUB_ENGINE = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_engine.py")]
+PGN = """[Event "Test"]
+[White "alice"]
+[Black "bob"]
+[Result "1-0"]
+[WhiteElo "1500"]
+[BlackElo "1500"]
+[Date "2023.01.01"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. Bxc6 dxc6 1-0
+
+[Event "Test"]
+[White "bob"]
+[Black "alice"]
+[Result "0-1"]
+[WhiteElo "1500"]
+[BlackElo "1500"]
+[Date "2023.01.02"]
+
+1. e4 e5 2. Nf3 Nf6 3. Nxe5 Qe7 0-1
+
+"""
+
+
+def test_engine_pool_scores_positions():
+    board = chess.Board()
+    with EnginePool(STUB_ENGINE, workers=2, limit=chess.engine.Limit(depth=1)) as pool:
+        results = pool.evaluate({1: board.fen(), 2: "4k3/8/8/8/8/8/8/3QK3 w - - 0 1"})
+    assert set(results) == {1, 2}
+    score, best = results[2]
+    # A queen up, from White's side
+    assert score > 800
+    assert best is not None
+
+
+def test_second_run_is_served_from_the_eval_cache(tmp_path):
+    pgn_file = tmp_path / "games.pgn"
+    pgn_file.write_text(PGN)
+    limit = chess.engine.Limit(depth=1)
+    cache = EvalCache(str(tmp_path / "evals.sqlite3"))
+    try:
+        first = analyze_accuracy(str(pgn_file), STUB_ENGINE, limit, workers=1, cache=cache)
+        second = analyze_accuracy(str(pgn_file), STUB_ENGINE, limit, workers=1, cache=cache)
+    finally:
+        cache.close()
+
+    assert first["games"] == 2
+    # 9 + 7 positions, of which the first 4 are shared and evaluated once
+    assert first["positions"] == first["evaluated"] == 12
+    assert second["cached"] == second["positions"] == first["positions"]
+    assert second["evaluated"] == 0
+    for field in ("moves", "average_centipawn_loss", "accuracy", "inaccuracies", "mistakes", "blunders"):
+        assert second[field] == first[field]
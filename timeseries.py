@@ -0,0 +1,224 @@
+import argparse
+
+import numpy as np
+
+from players import longest_run
+
+FREQUENCIES = ("day", "week", "month")
+DEFAULT_WINDOW = 50
+
+
+def to_date(value, end=False):
+    # "2023.04.01", "2023-04-01", "2023.04", "2023" or a datetime64 ->
+    # datetime64[D]. A year or month is its first day, or with end its last,
+    # the way query.normalize_date pads until: dates.
+    if isinstance(value, str):
+        value = np.datetime64(value.replace(".", "-").replace("/", "-"))
+    value = np.datetime64(value)
+    if end and np.datetime_data(value.dtype)[0] in ("Y", "M"):
+        return (value + 1).astype("datetime64[D]") - 1
+    return value.astype("datetime64[D]")
+
+
+def period_starts(dates, freq):
+    # First day of the day, week (from Monday) or month holding each date
+    if freq == "day":
+        return dates
+    if freq == "week":
+        days = dates.astype(np.int64)
+        # 1970-01-01 was a Thursday
+        return (days - (days + 3) % 7).astype("datetime64[D]")
+    if freq == "month":
+        return dates.astype("datetime64[M]").astype("datetime64[D]")
+    raise ValueError(f"Unknown frequency {freq}; expected one of {', '.join(FREQUENCIES)}")
+
+
+def period_range(first, last, freq):
+    # Every period start from first to last, gaps included
+    if freq == "month":
+        return np.arange(first.astype("datetime64[M]"), last.astype("datetime64[M]") + 1).astype("datetime64[D]")
+    return np.arange(first, last + 1, 7 if freq == "week" else 1)
+
+
+def window_sums(values, window):
+    # Sum of each value and the window - 1 before it
+    totals = np.concatenate(([0], np.cumsum(values, dtype=np.float64)))
+    return totals[1:] - totals[np.maximum(np.arange(1, len(totals)) - window, 0)]
+
+
+class Timeline:
+    # One player's dated games sorted by date (file order within a day), so
+    # a date range is two binary searches and a slice
+    def __init__(self, dates, scores, my_elo, opp_elo, undated=0, player=None):
+        self.player = player
+        self.dates = dates
+        self.scores = scores
+        self.my_elo = my_elo
+        self.opp_elo = opp_elo
+        self.undated = undated
+        self.binned = {}
+
+    @classmethod
+    def from_player_games(cls, games):
+        dated = ~np.isnat(games.date)
+        order = np.argsort(games.date[dated], kind="stable")
+        return cls(games.date[dated][order], games.my_score[dated][order], games.my_elo[dated][order],
+                   games.opp_elo[dated][order], int(np.count_nonzero(~dated)), games.player)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def between(self, start=None, end=None):
+        # Games from start to end, both inclusive; either may be left open
+        low = 0 if start is None else np.searchsorted(self.dates, to_date(start), "left")
+        high = len(self.dates) if end is None else np.searchsorted(self.dates, to_date(end, end=True), "right")
+        return Timeline(self.dates[low:high], self.scores[low:high], self.my_elo[low:high], self.opp_elo[low:high],
+                        player=self.player)
+
+    def last(self, days, end=None):
+        # The last `days` days up to end (default: the latest game)
+        if not len(self):
+            return self
+        end = self.dates[-1] if end is None else to_date(end, end=True)
+        return self.between(end - np.timedelta64(days - 1, "D"), end)
+
+    def record(self):
+        return (int(np.count_nonzero(self.scores == 1)), int(np.count_nonzero(self.scores == 0.5)),
+                int(np.count_nonzero(self.scores == 0)))
+
+    def streaks(self):
+        # Longest winning and losing runs in date order
+        return longest_run(self.scores == 1), longest_run(self.scores == 0)
+
+    def rolling_win_rate(self, window=DEFAULT_WINDOW):
+        # Score over each game's last `window` finished games (fewer at the start)
+        finished = ~np.isnan(self.scores)
+        points = window_sums(np.where(finished, self.scores, 0), window)
+        games = window_sums(finished, window)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(games > 0, points / games, np.nan)
+
+    def rating_trajectory(self):
+        # (dates, rating) for every game with a rating
+        rated = self.my_elo > 0
+        return self.dates[rated], self.my_elo[rated]
+
+    def bins(self, freq="day"):
+        if freq not in self.binned:
+            self.binned[freq] = Bins.from_timeline(self, freq)
+        return self.binned[freq]
+
+
+class Bins:
+    # Dense per-period arrays from the first game's period to the last one's,
+    # empty periods included
+    def __init__(self, freq, periods, games, wins, draws, losses, rating):
+        self.freq = freq
+        self.periods = periods
+        self.games = games
+        self.wins = wins
+        self.draws = draws
+        self.losses = losses
+        self.rating = rating
+
+    @classmethod
+    def from_timeline(cls, timeline, freq="day"):
+        if not len(timeline):
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(freq, np.array([], dtype="datetime64[D]"), empty, empty, empty, empty, np.zeros(0))
+        starts = period_starts(timeline.dates, freq)
+        periods = period_range(starts[0], starts[-1], freq)
+        slots = np.searchsorted(periods, starts)
+        size = len(periods)
+        scores = timeline.scores
+        rating = np.full(size, np.nan)
+        rated = np.flatnonzero(timeline.my_elo > 0)
+        if len(rated):
+            # The rating after the period's last rated game
+            last = np.full(size, -1)
+            np.maximum.at(last, slots[rated], rated)
+            found = last >= 0
+            rating[found] = timeline.my_elo[last[found]]
+        return cls(freq, periods, np.bincount(slots, minlength=size),
+                   np.bincount(slots, scores == 1, size).astype(np.int64),
+                   np.bincount(slots, scores == 0.5, size).astype(np.int64),
+                   np.bincount(slots, scores == 0, size).astype(np.int64), rating)
+
+    def __len__(self):
+        return len(self.periods)
+
+    def score(self, window=1):
+        # Score per period, or over each period and the window - 1 before it
+        finished = window_sums(self.wins + self.draws + self.losses, window)
+        points = window_sums(self.wins + self.draws / 2, window)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(finished > 0, points / finished, np.nan)
+
+    def volume(self, window=1):
+        return window_sums(self.games, window).astype(np.int64)
+
+    def calendar(self, values=None):
+        # Day bins laid out as a (7, weeks) grid for a heatmap: rows Monday to
+        # Sunday, columns the weeks from the first game's to the last's. Days
+        # outside the range are nan. values defaults to games per day.
+        if self.freq != "day":
+            raise ValueError("calendar needs day bins")
+        values = self.games if values is None else values
+        if not len(self):
+            return np.array([], dtype="datetime64[D]"), np.zeros((7, 0))
+        offset = int((self.periods[0] - period_starts(self.periods[:1], "week")[0]).astype(np.int64))
+        weeks = -(-(offset + len(self)) // 7)
+        grid = np.full(weeks * 7, np.nan)
+        grid[offset:offset + len(self)] = values
+        week_starts = self.periods[0] - np.timedelta64(offset, "D") + 7 * np.arange(weeks)
+        return week_starts, grid.reshape(weeks, 7).T
+
+
+def format_bins(bins, window=1):
+    lines = [f"{'Period':<12} {'Games':>6} {'W':>5} {'D':>5} {'L':>5} {'Score':>7} {'Rating':>7}"]
+    scores = bins.score(window)
+    for period, games, wins, draws, losses, score, rating in zip(
+            bins.periods, bins.games, bins.wins, bins.draws, bins.losses, scores, bins.rating):
+        if not games:
+            continue
+        lines.append(f"{str(period):<12} {games:>6} {wins:>5} {draws:>5} {losses:>5} "
+                     f"{'-' if np.isnan(score) else f'{score:.1%}':>7} {'-' if np.isnan(rating) else int(rating):>7}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    import analytics
+    import query
+
+    parser = argparse.ArgumentParser(description="Results over time, binned by day, week or month")
+    parser.add_argument("pgn_file", help="Path to your PGN file")
+    parser.add_argument("--player", help="Whose results to show (default: the most frequent player)")
+    parser.add_argument("--freq", choices=FREQUENCIES, default="month", help="Bin size")
+    parser.add_argument("--window", type=int, default=1, help="Periods in the rolling score")
+    parser.add_argument("--last", type=int, metavar="DAYS", help="Only the last DAYS days")
+    parser.add_argument("--since", help="First date to include (YYYY.MM.DD, or a YYYY.MM month or YYYY year)")
+    parser.add_argument("--until", help="Last date to include (YYYY.MM.DD, or through the end of a YYYY.MM month "
+                                        "or YYYY year)")
+    parser.add_argument("--index", action="store_true", help="Build or reuse the on-disk game index")
+    parser.add_argument("--where", metavar="QUERY", help='Only games matching QUERY, e.g. "blitz black eco:B"')
+    args = parser.parse_args()
+
+    where = query.from_text(args.where)
+    if args.index:
+        from game_index import open_index
+        timeline = analytics.analyze_timeline(open_index(args.pgn_file).select(where), args.player)
+    else:
+        if where is not None:
+            where = where.resolve(args.pgn_file)
+        with analytics.open_pgn(args.pgn_file) as file:
+            timeline = analytics.analyze_timeline(analytics.iter_headers(file, where=where), args.player)
+    if args.last:
+        timeline = timeline.last(args.last)
+    if args.since or args.until:
+        timeline = timeline.between(args.since, args.until)
+    wins, draws, losses = timeline.record()
+    winning, losing = timeline.streaks()
+    print(format_bins(timeline.bins(args.freq), args.window))
+    print()
+    print(f"Player: {timeline.player}  Games: {len(timeline)}  W/D/L: {wins}/{draws}/{losses}  "
+          f"Longest Winning Streak: {winning}  Longest Losing Streak: {losing}")